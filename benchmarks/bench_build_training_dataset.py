@@ -0,0 +1,104 @@
+import argparse
+import csv
+import pathlib
+import resource
+import tempfile
+import time
+
+from benchmarks.synthetic import write_articles
+from gpt_2.build_training_dataset import (
+    FIELDNAMES,
+    CSVSink,
+    JSONLSink,
+    TextFileSink,
+    build_training_dataset,
+    iter_label_rows,
+    write_training_sample,
+)
+
+def legacy_build(label_csv, raw_dir, out_dir, training_csv):
+    """The read-everything, concatenate-and-write-twice build this benchmark
+    compares against"""
+    with open(label_csv, "r") as labelcsv:
+        with open(training_csv, "w") as traincsv:
+            traincsv.write("# data\n")
+            reader = csv.DictReader(labelcsv, fieldnames=FIELDNAMES)
+            writer = csv.writer(traincsv)
+            next(reader)
+            for row in reader:
+                body = raw_dir.joinpath(f"{row['file_name']}.txt").read_text()
+                fulltext = ""
+                fulltext += "[LABELS]\n\n"
+                for k, v in row.items():
+                    if k == "file_name":
+                        continue
+                    fulltext += f"{k}: {v}\n"
+                    fulltext += "\n"
+                fulltext += "[BODY]\n\n"
+                fulltext += body
+                out_dir.joinpath(f"{row['file_name']}.txt").write_text(fulltext)
+                writer.writerow([fulltext])
+
+
+def streaming_build(label_csv, raw_dir, out_dir, training_csv, jsonl=None):
+    with open(training_csv, "w") as traincsv:
+        traincsv.write("# data\n")
+        sinks = [TextFileSink(out_dir), CSVSink(traincsv)]
+        jsonl_f = open(jsonl, "w") if jsonl else None
+        if jsonl_f is not None:
+            sinks.append(JSONLSink(jsonl_f))
+        for row in iter_label_rows(label_csv):
+            write_training_sample(row, raw_dir, sinks)
+        if jsonl_f is not None:
+            jsonl_f.close()
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark building the training dataset from synthetic articles"
+    )
+    parser.add_argument("-n", "--articles", type=int, default=100000)
+    parser.add_argument("-w", "--words", type=int, default=400, help="Words per article")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=4, help="Threads for the parallel build"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = pathlib.Path(tmp)
+        print(f"Generating {args.articles} synthetic articles ...")
+        raw_dir, label_csv = write_articles(root, args.articles, args.words, args.seed)
+        for name in ("legacy", "streaming", "parallel"):
+            root.joinpath(name).mkdir()
+        builds = (
+            ("legacy", lambda out: legacy_build(label_csv, raw_dir, out, out / "train.csv")),
+            ("streaming", lambda out: streaming_build(label_csv, raw_dir, out, out / "train.csv")),
+            (
+                "parallel",
+                lambda out: build_training_dataset(
+                    iter_label_rows(label_csv), raw_dir, out, out / "train.csv", jobs=args.jobs
+                ),
+            ),
+        )
+        for name, build in builds:
+            out_dir = root.joinpath(name)
+            start = time.perf_counter()
+            build(out_dir)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{name:>10}: {elapsed:7.2f} s  ({args.articles / elapsed:,.0f} articles/s, "
+                f"peak RSS so far {peak_rss_mb():.0f} MB)"
+            )
+        legacy_csv = root.joinpath("legacy", "train.csv").read_bytes()
+        assert root.joinpath("streaming", "train.csv").read_bytes() == legacy_csv
+        assert root.joinpath("parallel", "train.csv").read_bytes() == legacy_csv
+        print("Training CSVs are identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+DEFAULT_COMMANDS = (
+    ("build_label_csv --help", ["-m", "gpt_2.build_label_csv", "--help"]),
+    ("import build_label_csv", ["-c", "import gpt_2.build_label_csv"]),
+)
+
+
+def time_command(args, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def slowest_imports(module, count):
+    """Parse `python -X importtime` output for the modules with the largest
+    cumulative import time"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CLI startup latency")
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument(
+        "--max-seconds",
+        type=float,
+        default=None,
+        help="Exit with an error if any command takes longer than this to start",
+    )
+    args = parser.parse_args()
+
+    failed = False
+    for name, command in DEFAULT_COMMANDS:
+        elapsed = time_command(command, args.repeat)
+        print(f"{name:>24}: {elapsed * 1000:8.1f} ms")
+        if args.max_seconds is not None and elapsed > args.max_seconds:
+            failed = True
+    print("Slowest imports of gpt_2.build_label_csv (cumulative):")
+    for cumulative, module in slowest_imports("gpt_2.build_label_csv", 10):
+        print(f"{cumulative / 1000:10.1f} ms  {module}")
+    if failed:
+        sys.exit(f"CLI startup exceeded {args.max_seconds} seconds")
+
+
+if __name__ == "__main__":
+    main()
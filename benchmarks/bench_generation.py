@@ -0,0 +1,102 @@
+import argparse
+import os
+import tempfile
+import time
+
+# Benchmark on the CPU, set before TensorFlow is imported
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+
+import gpt_2_simple as gpt2
+
+from benchmarks.synthetic import make_prompts
+from gpt_2.generation import GenerationEngine, StopCriteria, iter_generated
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark generation throughput in samples per second"
+    )
+    parser.add_argument("-m", "--model-name", default="124M")
+    parser.add_argument("--model-dir", default="models")
+    parser.add_argument("-p", "--prompts", type=int, default=8)
+    parser.add_argument("-n", "--nsamples", type=int, default=5)
+    parser.add_argument("-l", "--length", type=int, default=64)
+    parser.add_argument(
+        "-b", "--batch-sizes", type=int, nargs="+", default=[5, 20, 0],
+        help="Engine batch sizes to compare, 0 auto-tunes to the available memory",
+    )
+    parser.add_argument(
+        "-w", "--max-words", type=int, default=10,
+        help="Word bound of the run measuring early stopping",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if not os.path.isdir(os.path.join(args.model_dir, args.model_name)):
+        gpt2.download_gpt2(model_dir=args.model_dir, model_name=args.model_name)
+    sess = gpt2.start_tf_sess()
+    gpt2.load_gpt2(sess, model_name=args.model_name, model_dir=args.model_dir)
+    prompts = make_prompts(args.prompts, args.seed)
+    total = args.prompts * args.nsamples
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        for file_name, prompt in prompts:
+            gpt2.generate_to_file(
+                sess,
+                model_name=args.model_name,
+                model_dir=args.model_dir,
+                prefix=prompt,
+                destination_path=os.path.join(tmp, file_name),
+                length=args.length,
+                temperature=0.7,
+                nsamples=args.nsamples,
+                batch_size=1,
+            )
+        elapsed = time.perf_counter() - start
+        print(f"{'generate_to_file, batch 1':>44}: {total / elapsed:8.2f} samples/s")
+
+        for share_prefixes in (False, True):
+            engine = GenerationEngine(
+                sess,
+                model_name=args.model_name,
+                model_dir=args.model_dir,
+                seed=args.seed,
+                share_prefixes=share_prefixes,
+            )
+            # Build the step graph before timing
+            engine.generate_tokens([engine.enc.encode(prompts[0][1])], 2)
+            for batch_size in args.batch_sizes:
+                start = time.perf_counter()
+                first = None
+                for _ in iter_generated(
+                    engine,
+                    prompts,
+                    nsamples=args.nsamples,
+                    batch_size=batch_size or None,
+                    length=args.length,
+                ):
+                    if first is None:
+                        first = time.perf_counter() - start
+                elapsed = time.perf_counter() - start
+                name = f"engine, batch {batch_size or 'auto'}"
+                if share_prefixes:
+                    name += ", shared prefixes"
+                print(
+                    f"{name:>44}: {total / elapsed:8.2f} samples/s, "
+                    f"first prompt after {first:.2f} s"
+                )
+
+        # Rows leave the batch once they reach the word bound
+        stop = StopCriteria(max_words=args.max_words)
+        start = time.perf_counter()
+        for _ in iter_generated(
+            engine, prompts, nsamples=args.nsamples, length=args.length, stop=stop,
+        ):
+            pass
+        elapsed = time.perf_counter() - start
+        name = f"engine, batch auto, stop at {args.max_words} words"
+        print(f"{name:>44}: {total / elapsed:8.2f} samples/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import random
+import time
+
+from benchmarks.synthetic import make_body, make_keyword_corpus, make_vocabulary
+from gpt_2.keyword_matcher import KeywordMatcher
+
+
+def legacy_get_keywords_in_body(corpus, body):
+    """The per-keyword substring search this benchmark compares against"""
+    keywords = []
+    for keyword in corpus:
+        klower = keyword.lower()
+        if klower in keywords:
+            continue
+        if klower in body.lower():
+            keywords.append(klower)
+    return keywords
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark keyword matching against synthetic keyword corpora"
+    )
+    parser.add_argument(
+        "-s", "--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+        help="Keyword corpus sizes to benchmark",
+    )
+    parser.add_argument("-b", "--bodies", type=int, default=10, help="Number of article bodies")
+    parser.add_argument("-w", "--words", type=int, default=500, help="Words per article body")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocabulary = make_vocabulary(rng, 5000)
+    bodies = [make_body(rng, vocabulary, args.words) for _ in range(args.bodies)]
+    for size in args.sizes:
+        corpus = make_keyword_corpus(rng, vocabulary, size)
+
+        start = time.perf_counter()
+        matcher = KeywordMatcher(corpus)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        new = [matcher.find_all(body) for body in bodies]
+        new_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        old = [legacy_get_keywords_in_body(corpus, body) for body in bodies]
+        old_time = time.perf_counter() - start
+
+        assert new == old, "KeywordMatcher results differ from get_keywords_in_body"
+        print(
+            f"{size:>7} keywords: build {build_time * 1000:8.1f} ms | "
+            f"legacy {old_time / len(bodies) * 1000:9.2f} ms/body | "
+            f"matcher {new_time / len(bodies) * 1000:7.2f} ms/body | "
+            f"speedup {old_time / new_time:6.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import argparse
+import io
+import time
+
+from benchmarks.synthetic import make_document
+from gpt_2.docs_text import read_structural_elements, write_structural_elements
+
+
+def legacy_read_paragraph_element(element):
+    text_run = element.get("textRun")
+    if not text_run:
+        return ""
+    return text_run.get("content")
+
+
+def legacy_read_structural_elements(elements):
+    """The recursive, concatenating implementation this benchmark compares against"""
+    text = ""
+    for value in elements:
+        if "paragraph" in value:
+            elements = value.get("paragraph").get("elements")
+            for elem in elements:
+                text += legacy_read_paragraph_element(elem)
+        elif "table" in value:
+            table = value.get("table")
+            for row in table.get("tableRows"):
+                cells = row.get("tableCells")
+                for cell in cells:
+                    text += legacy_read_structural_elements(cell.get("content"))
+        elif "tableOfContents" in value:
+            toc = value.get("tableOfContents")
+            text += legacy_read_structural_elements(toc.get("content"))
+    return text
+
+
+def best_of(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark Google Docs text extraction on synthetic documents"
+    )
+    parser.add_argument("-p", "--paragraphs", type=int, default=20000)
+    parser.add_argument("-t", "--tables", type=int, default=20)
+    parser.add_argument("-d", "--table-depth", type=int, default=2)
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    content = make_document(args.paragraphs, args.tables, args.table_depth)
+    expected = legacy_read_structural_elements(content)
+    assert read_structural_elements(content) == expected
+    print(f"Document size: {len(expected)} characters")
+
+    benchmarks = (
+        ("legacy recursive", lambda: legacy_read_structural_elements(content)),
+        ("read_structural_elements", lambda: read_structural_elements(content)),
+        ("write_structural_elements", lambda: write_structural_elements(content, io.StringIO())),
+    )
+    for name, func in benchmarks:
+        elapsed = best_of(func, args.repeat)
+        rate = len(expected) / elapsed / 1e6
+        print(f"{name:>28}: {elapsed * 1000:8.2f} ms  ({rate:.1f} Mchars/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import argparse
+import time
+
+from benchmarks.synthetic import make_store_suffixes, make_titles
+from gpt_2.title_parser import (
+    DEFAULT_PAGE_MODIFIERS,
+    DEFAULT_STORE_SUFFIXES,
+    TitleParser,
+)
+
+
+def legacy_extract_store_name_and_page_template_from_title(
+    name, page_modifiers=DEFAULT_PAGE_MODIFIERS, store_suffixes=DEFAULT_STORE_SUFFIXES
+):
+    """The table walking implementation this benchmark compares against"""
+    cleaned_name = name
+    page_template = ""
+    for page_modifier in page_modifiers:
+        if page_modifier in name:
+            page_template = page_modifier
+            cleaned_name = cleaned_name.replace(page_modifier, "")
+            break
+    store_suffix = ""
+    for possible_suffix in store_suffixes:
+        index = cleaned_name.find(possible_suffix)
+        if index >= 0:
+            store_suffix = possible_suffix
+            break
+    store_name = cleaned_name[0:index].strip() + " " + store_suffix
+    page_template = page_template + cleaned_name[index + len(store_suffix) :]
+    return store_name.strip(), page_template.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark article title parsing")
+    parser.add_argument("-n", "--titles", type=int, default=100000)
+    parser.add_argument(
+        "-e", "--extra-suffixes", type=int, nargs="+", default=[0, 100, 1000],
+        help="Numbers of synthetic store suffixes to add to the default table",
+    )
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for extra in args.extra_suffixes:
+        store_suffixes = make_store_suffixes(extra, args.seed)
+        titles = make_titles(args.titles, store_suffixes, args.seed)
+        title_parser = TitleParser(store_suffixes=store_suffixes)
+
+        legacy_time = parser_time = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            legacy = [
+                legacy_extract_store_name_and_page_template_from_title(
+                    t, store_suffixes=store_suffixes
+                )
+                for t in titles
+            ]
+            legacy_time = min(legacy_time, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            parsed = list(title_parser.parse_many(titles))
+            parser_time = min(parser_time, time.perf_counter() - start)
+
+        assert [p[:2] for p in parsed] == legacy, "TitleParser results differ"
+        print(
+            f"{len(store_suffixes):>5} suffixes: "
+            f"legacy {len(titles) / legacy_time:>10,.0f} titles/s | "
+            f"TitleParser {len(titles) / parser_time:>10,.0f} titles/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
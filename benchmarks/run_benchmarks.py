@@ -0,0 +1,286 @@
+"""
+Throughput of every stage of the data pipeline on synthetic inputs
+
+Run from the repository root with `python -m benchmarks.run_benchmarks`. Every
+stage is timed on inputs from `benchmarks.synthetic` and compared against the
+throughput stored in `benchmarks/baselines.json`. A stage regresses when it is
+slower than its baseline by more than its threshold.
+
+Throughputs are compared relative to the speed of a fixed reference workload
+timed alongside each stage, which cancels out most of the noise of a loaded or
+frequency scaling machine. Baselines recorded on a very different machine or
+Python version should still be recorded again with `--update-baselines`.
+"""
+import argparse
+import json
+import pathlib
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic import (
+    make_article_body,
+    make_body,
+    make_docs_json,
+    make_keyword_corpus,
+    make_prompt_csv,
+    make_titles,
+    make_vocabulary,
+    write_articles,
+)
+
+SCRIPT_DIR = pathlib.Path(__file__).parent.absolute()
+DEFAULT_BASELINES = SCRIPT_DIR.joinpath("baselines.json")
+# Fraction of its baseline throughput a stage may lose before it counts as a
+# regression, unless the baseline sets its own threshold
+DEFAULT_THRESHOLD = 0.3
+
+
+def scaled(count, scale):
+    return max(1, int(count * scale))
+
+
+def stage_docs_text(scale, seed, workdir):
+    from gpt_2.docs_text import read_structural_elements
+
+    titles = make_titles(scaled(20, scale), seed=seed)
+    docs = [
+        make_docs_json(title, paragraphs=500, tables=5, table_depth=1, seed=seed + i)
+        for i, title in enumerate(titles)
+    ]
+
+    def run():
+        for doc in docs:
+            read_structural_elements(doc["body"]["content"])
+
+    return run, len(docs), "docs/s"
+
+
+def stage_keywords(scale, seed, workdir):
+    from gpt_2.build_label_csv import get_keywords_in_body
+    from gpt_2.keyword_matcher import KeywordMatcher
+
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(rng, 5000)
+    matcher = KeywordMatcher(make_keyword_corpus(rng, vocabulary, 10000))
+    bodies = [make_body(rng, vocabulary, 500) for _ in range(scaled(200, scale))]
+
+    def run():
+        for body in bodies:
+            get_keywords_in_body(matcher, body)
+
+    return run, len(bodies), "bodies/s"
+
+
+def stage_titles(scale, seed, workdir):
+    from gpt_2.build_label_csv import extract_store_name_and_page_template_from_title
+
+    titles = make_titles(scaled(20000, scale), seed=seed)
+
+    def run():
+        for title in titles:
+            extract_store_name_and_page_template_from_title(title)
+
+    return run, len(titles), "titles/s"
+
+
+def stage_training_text(scale, seed, workdir):
+    from gpt_2.build_training_dataset import create_training_text_body, iter_label_rows
+
+    raw_dir, label_csv = write_articles(workdir, scaled(2000, scale), 400, seed)
+    rows = list(iter_label_rows(label_csv))
+
+    def run():
+        for row in rows:
+            create_training_text_body(row, raw_dir)
+
+    return run, len(rows), "articles/s"
+
+
+def stage_training_dataset(scale, seed, workdir):
+    from gpt_2.build_training_dataset import build_training_dataset, iter_label_rows
+
+    count = scaled(2000, scale)
+    raw_dir, label_csv = write_articles(workdir, count, 400, seed)
+    training_csv = workdir.joinpath("train.csv")
+
+    def run():
+        build_training_dataset(iter_label_rows(label_csv), raw_dir, training_csv=training_csv)
+
+    return run, count, "articles/s"
+
+
+def stage_prompts(scale, seed, workdir):
+    from gpt_2.prompts import DEFAULT_PROMPT_BUILDER, iter_prompts
+
+    count = scaled(20000, scale)
+    data = make_prompt_csv(count, seed)
+
+    def run():
+        for _ in iter_prompts(data, DEFAULT_PROMPT_BUILDER):
+            pass
+
+    return run, count, "prompts/s"
+
+
+def stage_minhash(scale, seed, workdir):
+    from gpt_2.dedup import MinHasher
+
+    rng = random.Random(seed)
+    hasher = MinHasher()
+    bodies = [make_article_body(rng, 400) for _ in range(scaled(500, scale))]
+
+    def run():
+        for body in bodies:
+            hasher.signature(body)
+
+    return run, len(bodies), "bodies/s"
+
+
+STAGES = {
+    "docs_text": stage_docs_text,
+    "keywords": stage_keywords,
+    "titles": stage_titles,
+    "training_text": stage_training_text,
+    "training_dataset": stage_training_dataset,
+    "prompts": stage_prompts,
+    "minhash": stage_minhash,
+}
+
+
+def best_of(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def reference_workload():
+    # Fixed pure Python work of dict, string and sorting operations, the same
+    # kinds of work as the stages
+    counts = {}
+    for i in range(20000):
+        word = str(i * 7919 % 1009)
+        counts[word] = counts.get(word, 0) + 1
+    return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+
+
+def reference_speed(repeat):
+    """Runs of `reference_workload` per second, a measure of the current speed of
+    the machine that stage throughputs are divided by"""
+    return 1 / best_of(reference_workload, repeat)
+
+
+def load_baselines(path):
+    path = pathlib.Path(path)
+    if not path.exists():
+        return {"scale": None, "stages": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baselines(path, baselines):
+    with open(path, "w") as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def run_stage(name, scale, seed, repeat):
+    """
+    Time one stage
+
+    Returns
+    -------
+    throughput : float or None
+        Items per second of the best of `repeat` runs, or None when the stage's
+        dependencies aren't installed
+    unit : str
+        Unit of the throughput, or the reason the stage was skipped
+    reference : float or None
+        `reference_speed` measured between the runs of the stage
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            run, count, unit = STAGES[name](scale, seed, pathlib.Path(tmp))
+        except ImportError as e:
+            return None, f"skipped, {e}", None
+        # Interleave the reference runs with the stage runs so both see the same
+        # machine load
+        times, references = [], []
+        for _ in range(repeat):
+            times.append(best_of(run, 1))
+            references.append(reference_speed(1))
+        return count / min(times), unit, max(references)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark every data pipeline stage against stored baselines"
+    )
+    parser.add_argument(
+        "-s", "--stages", nargs="+", choices=sorted(STAGES), default=list(STAGES),
+        help="Stages to run, all by default",
+    )
+    parser.add_argument(
+        "--scale", type=float, default=1.0,
+        help="Multiplier of the number of synthetic inputs per stage",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("--baselines", default=DEFAULT_BASELINES)
+    parser.add_argument(
+        "-t", "--threshold", type=float, default=None,
+        help="Allowed slowdown as a fraction of the baseline throughput, overriding "
+        f"the thresholds stored with the baselines (default {DEFAULT_THRESHOLD})",
+    )
+    parser.add_argument(
+        "--update-baselines", action="store_true",
+        help="Store the measured throughputs as the new baselines",
+    )
+    args = parser.parse_args()
+
+    baselines = load_baselines(args.baselines)
+    if baselines["scale"] not in (None, args.scale):
+        print(
+            f"Baselines were recorded at scale {baselines['scale']}, "
+            f"comparing at scale {args.scale}"
+        )
+    regressions = []
+    for name in args.stages:
+        throughput, unit, reference = run_stage(name, args.scale, args.seed, args.repeat)
+        if throughput is None:
+            print(f"{name:>18}: {unit}")
+            continue
+        line = f"{name:>18}: {throughput:>12,.1f} {unit:<11}"
+        baseline = baselines["stages"].get(name)
+        if baseline is not None:
+            threshold = args.threshold
+            if threshold is None:
+                threshold = baseline.get("threshold", DEFAULT_THRESHOLD)
+            ratio = throughput / baseline["throughput"]
+            if "reference" in baseline:
+                ratio *= baseline["reference"] / reference
+            line += f" {ratio:6.2f}x baseline"
+            if ratio < 1 - threshold:
+                regressions.append(name)
+                line += f"  REGRESSION (threshold {threshold:.0%})"
+        print(line.rstrip())
+        if args.update_baselines:
+            stored = baselines["stages"].setdefault(name, {})
+            stored.update(
+                throughput=round(throughput, 1), unit=unit, reference=round(reference, 1)
+            )
+            stored.setdefault("threshold", DEFAULT_THRESHOLD)
+    if args.update_baselines:
+        baselines["scale"] = args.scale
+        save_baselines(args.baselines, baselines)
+        print(f"Saved baselines to {args.baselines}")
+    elif regressions:
+        sys.exit(f"Throughput regressed in: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
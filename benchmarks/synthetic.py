@@ -0,0 +1,192 @@
+"""
+Seeded generators of synthetic inputs for every stage of the data pipeline
+
+Everything here is deterministic given the seed and needs no network, so the
+benchmarks can run anywhere and compare like with like.
+"""
+import csv
+import io
+import random
+
+from gpt_2.build_training_dataset import FIELDNAMES
+from gpt_2.title_parser import DEFAULT_PAGE_MODIFIERS, DEFAULT_STORE_SUFFIXES
+
+WORDS = (
+    "carpet", "tile", "hardwood", "vinyl", "plank", "rug", "kitchen", "bathroom",
+    "flooring", "store", "install", "waterproof", "durable", "style", "home", "the",
+    "and", "with", "for", "your", "our", "a", "to", "of",
+)
+PAGE_TEMPLATES = (
+    "Area Rugs",
+    "Backsplash Tile Page Update",
+    "Custom Area Rugs",
+    "Hardwood Flooring",
+    "Kitchen and Bathroom Flooring",
+    "Luxury Vinyl Plank",
+    "Waterproof Flooring",
+)
+STORE_NAMES = ("Wrucks", "Burlington", "Hosner", "Skawg Brothers", "I-Five", "Joe's")
+STORES = ("Wrucks Carpet One", "Burlington Flooring", "Hosner Floor Covering")
+LOCATIONS = ("Boston United States", "Toronto Canada", "Springfield United States")
+
+
+def make_paragraph(rng, words=20):
+    runs = []
+    for _ in range(rng.randint(1, 4)):
+        text = " ".join(f"word{rng.randint(0, 999)}" for _ in range(words))
+        runs.append({"textRun": {"content": text + " "}})
+    runs.append({"textRun": {"content": "\n"}})
+    return {"paragraph": {"elements": runs}}
+
+
+def make_table(rng, depth, rows=3, cols=3, paragraphs=2):
+    table_rows = []
+    for _ in range(rows):
+        cells = []
+        for _ in range(cols):
+            content = [make_paragraph(rng) for _ in range(paragraphs)]
+            if depth > 0:
+                content.append(make_table(rng, depth - 1, rows, cols, paragraphs))
+            cells.append({"content": content})
+        table_rows.append({"tableCells": cells})
+    return {"table": {"tableRows": table_rows}}
+
+
+def make_document(paragraphs, tables, table_depth, seed=0):
+    """Build the `body.content` of a synthetic Google Doc"""
+    rng = random.Random(seed)
+    content = []
+    for i in range(paragraphs):
+        content.append(make_paragraph(rng))
+        if tables and i % max(1, paragraphs // tables) == 0:
+            content.append(make_table(rng, table_depth))
+    return content
+
+
+def make_docs_json(title, paragraphs, tables=0, table_depth=0, seed=0):
+    """A synthetic Google Doc as returned by the Docs API `documents.get`"""
+    return {
+        "documentId": f"synthetic-{seed}",
+        "title": title,
+        "body": {"content": make_document(paragraphs, tables, table_depth, seed)},
+    }
+
+
+def make_vocabulary(rng, size):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(3, 9))) for _ in range(size)]
+
+
+def make_keyword_corpus(rng, vocabulary, size):
+    corpus = []
+    for _ in range(size):
+        phrase = " ".join(rng.choice(vocabulary) for _ in range(rng.randint(1, 3)))
+        corpus.append(phrase.title() if rng.random() < 0.3 else phrase)
+    return corpus
+
+
+def make_body(rng, vocabulary, words):
+    return " ".join(rng.choice(vocabulary) for _ in range(words))
+
+
+def make_article_body(rng, words, paragraph_words=80):
+    """An article body of flooring words split into paragraphs"""
+    paragraphs = []
+    for start in range(0, words, paragraph_words):
+        count = min(paragraph_words, words - start)
+        paragraphs.append(" ".join(rng.choice(WORDS) for _ in range(count)))
+    return "\n\n".join(paragraphs) + "\n"
+
+
+def make_store_suffixes(extra, seed=0):
+    """The default store suffixes preceded by `extra` synthetic ones"""
+    rng = random.Random(seed)
+    words = ("Flooring", "Carpets", "Floors", "Tile", "Design", "Interiors", "Home")
+    suffixes = [
+        f"{rng.choice(STORE_NAMES)}{i} {rng.choice(words)} {rng.choice(words)}"
+        for i in range(extra)
+    ]
+    return tuple(suffixes) + DEFAULT_STORE_SUFFIXES
+
+
+def make_titles(count, store_suffixes=DEFAULT_STORE_SUFFIXES, seed=0):
+    """Synthetic titles shaped like `<store> <suffix> [<modifier>] <page template>`"""
+    rng = random.Random(seed)
+    titles = []
+    for _ in range(count):
+        parts = [rng.choice(STORE_NAMES), rng.choice(store_suffixes)]
+        if rng.random() < 0.5:
+            parts.append(rng.choice(DEFAULT_PAGE_MODIFIERS))
+        parts.append(rng.choice(PAGE_TEMPLATES))
+        titles.append(" ".join(parts))
+    return titles
+
+
+def write_articles(root, count, words, seed=0):
+    """Write `count` synthetic raw articles to `root/raw` and a label CSV describing
+    them to `root/metadata.csv`"""
+    rng = random.Random(seed)
+    raw_dir = root.joinpath("raw")
+    raw_dir.mkdir()
+    label_csv = root.joinpath("metadata.csv")
+    with open(label_csv, "w") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        for i in range(count):
+            name = f"C{i:06d}-X Store {i} Carpet One Area Rugs"
+            body = " ".join(rng.choice(WORDS) for _ in range(words))
+            raw_dir.joinpath(f"{name}.txt").write_text(f'{body}\n"Quoted" line\n')
+            writer.writerow(
+                {
+                    "file_name": name,
+                    "title": name[10:],
+                    "store_name": f"Store {i} Carpet One",
+                    "store_location": "Boston United States",
+                    "page_template": "Area Rugs",
+                    "keywords": "carpet:rug",
+                }
+            )
+    return raw_dir, label_csv
+
+
+def make_prompt_rows(count, seed=0):
+    """Rows of a synthetic prompt CSV"""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        store, template = rng.choice(STORES), rng.choice(PAGE_TEMPLATES)
+        rows.append(
+            {
+                "file_name": f"prompt_{i:04d}",
+                "title": f"{store} {template}",
+                "store_name": store,
+                "store_location": rng.choice(LOCATIONS),
+                "page_template": template,
+                "keywords": ":".join(rng.sample(WORDS[:6], 2)),
+            }
+        )
+    return rows
+
+
+def make_prompt_csv(count, seed=0):
+    """The bytes of a synthetic prompt CSV as uploaded to the UI"""
+    f = io.StringIO()
+    writer = csv.DictWriter(f, fieldnames=FIELDNAMES, lineterminator="\n")
+    writer.writeheader()
+    writer.writerows(make_prompt_rows(count, seed))
+    return f.getvalue().encode("utf-8")
+
+
+def make_prompts(count, seed=0):
+    """Synthetic prompts shaped like the ones generate builds from a prompt CSV"""
+    rng = random.Random(seed)
+    prompts = []
+    for i in range(count):
+        store, template = rng.choice(STORES), rng.choice(PAGE_TEMPLATES)
+        prompt = (
+            f"\n[LABELS]\n\ntitle: {store} {template}\n\nstore_name: {store}\n\n"
+            f"store_location: {rng.choice(LOCATIONS)}\n\npage_template: {template}\n\n"
+            f"keywords: carpet:rug\n"
+        )
+        prompts.append((f"prompt_{i:04d}", prompt))
+    return prompts
@@ -1,18 +1,47 @@
 import csv
+import hashlib
+import json
+import os
 import pathlib
 import argparse
-import re
+import logging
+import pickle
 import pprint
-import geograpy
-import nltk
-from nltk import pos_tag, ne_chunk
-from nltk.tokenize import SpaceTokenizer
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing.util import Finalize
+
+from gpt_2.instrumentation import add_instrumentation_arguments, instrumented
+
+from gpt_2.keyword_matcher import KeywordMatcher
+from gpt_2.title_parser import DEFAULT_TITLE_PARSER, TitleParser
+from gpt_2.location_cache import LocationCache
+from gpt_2.location_extractors import (
+    LOCATION_EXTRACTORS,
+    GeograpyLocationExtractor,
+    get_location_extractor,
+)
+
+logger = logging.getLogger(__name__)
 
 
 SCRIPT_DIR = pathlib.Path(__file__).parent.absolute()
 DEFAULT_DATA_DIR = SCRIPT_DIR.joinpath("..", "data", "raw")
 DEFAULT_EXT_DIR = SCRIPT_DIR.joinpath("..", "data", "external")
 DEFAULT_KEYWORDS_DIR = SCRIPT_DIR.joinpath("..", "data", "interim", "keyword_corpus")
+DEFAULT_CACHE_DIR = SCRIPT_DIR.joinpath("..", "data", "interim", "cache")
+DEFAULT_LOCATION_CACHE = DEFAULT_CACHE_DIR.joinpath("location_cache.sqlite")
+DEFAULT_LOCATION_EXTRACTOR = GeograpyLocationExtractor.name
+FIELDNAMES = [
+    "file_name",
+    "title",
+    "store_name",
+    "store_location",
+    "page_template",
+    "keywords",
+]
 
 
 def get_title_word_histogram(names):
@@ -20,7 +49,7 @@ def get_title_word_histogram(names):
     for name in names:
         cleaned_name = " ".join(name.split(" ")[1:])
         words = cleaned_name.split()
-        print("words = {}".format(words))
+        logger.debug("words = %s", words)
         for w in words:
             if w in hist:
                 hist[w] += 1
@@ -29,47 +58,15 @@ def get_title_word_histogram(names):
     return hist
 
 
-def extract_store_name_and_page_template_from_title(name):
-    # Remove serial number
-    cleaned_name = name
-    page_template = ""
-    page_modfifiers = (
-        "MULTI-MAIN",
-        "MULTI-ADDON",
-        "MULTI-LOC",
-        "MULTI SINGLE",
-        "MULTI",
-    )
-    for page_modifier in page_modfifiers:
-        if page_modifier in name:
-            page_template = page_modifier
-            cleaned_name = cleaned_name.replace(page_modifier, "")
-            break
-    possible_store_suffixes = (
-        "Carpet One Floor & Home - Asheville",
-        "Carpet One Floor & Home of Billings",
-        "Carpet One Floor & Home",
-        "Carpet One Belleville",
-        "Rochester Flooring",
-        "Nice Carpets",
-        "Fox Floors",
-        "Northeast Flooring and Kitchens",
-        "Carpet & Flooring",
-        "Carpet One & Paint",
-        "Flooring & Kitchens",
-        "Carpet One",
-        "Carpet",
-    )
-    store_suffix = ""
-    for possible_suffix in possible_store_suffixes:
-        index = cleaned_name.find(possible_suffix)
-        if index >= 0:
-            store_suffix = possible_suffix
-            break
+def extract_store_name_and_page_template_from_title(name, title_parser=DEFAULT_TITLE_PARSER):
+    """
+    Split an article title into its store name and page template
 
-    store_name = cleaned_name[0:index].strip() + " " + store_suffix
-    page_template = page_template + cleaned_name[index + len(store_suffix) :]
-    return store_name.strip(), page_template.strip()
+    If the title contains none of the known store suffixes the store name is empty
+    and the page template only contains the page modifier, if any.
+    """
+    parsed = title_parser.parse(name)
+    return parsed.store_name, parsed.page_template
 
 
 def get_page_title_from_path(path):
@@ -77,51 +74,261 @@ def get_page_title_from_path(path):
     return " ".join(name.split(" ")[1:])
 
 
-def write_csv(files, outfile, keyword_corpus):
-    # titles = [get_page_title_from_path(p) for p in files]
-    print("Extracting store locations, this could take awhile ...")
-    # locations = [extract_store_location(t, p.read_text()) for (t, p) in zip(titles,
-    #     files)]
-    fieldnames = [
-        "file_name",
-        "title",
-        "store_name",
-        "store_location",
-        "page_template",
-        "keywords",
-    ]
-    # print(len(files))
-    # print(len(titles))
-    # print(len(locations))
-    with open(outfile, "w") as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
+def build_label_row(path, keyword_matcher, location_cache=None,
+                    title_parser=DEFAULT_TITLE_PARSER, location_extractor=None):
+    logger.debug("Loading %s ...", path)
+    body = path.read_text()
+    logger.debug("Extracting title ...")
+    title = get_page_title_from_path(path)
+    logger.debug("Extracting store location ...")
+    extract = extract_store_location
+    if location_extractor is not None:
+        extract = location_extractor.extract
+    if location_cache is None:
+        location = extract(title, body)
+    else:
+        location = location_cache.get_or_compute(title, body, extract)
+    (
+        store_name,
+        page_template,
+    ) = extract_store_name_and_page_template_from_title(title, title_parser)
+    logger.debug("Matching keywords ...")
+    keywords = get_keywords_in_body(keyword_matcher, body)
+    keyword_str = ":".join(keywords)
+    return {
+        "file_name": path.with_suffix("").name,
+        "title": title,
+        "store_name": store_name,
+        "store_location": location,
+        "page_template": page_template,
+        "keywords": keyword_str
+    }
+
+
+# Per-process state of the --jobs worker pool, set up by _init_label_worker on a
+# worker's first file. ProcessPoolExecutor only takes an initializer from Python
+# 3.7, and the keyword matcher is too large to send along with every file, so
+# the workers load it from a pickle file once each.
+_worker_state = {}
+_worker_settings_path = None
+
+
+def _init_label_worker(settings_path):
+    with open(settings_path, "rb") as f:
+        keyword_matcher, location_cache_args, title_parser, location_extractor = (
+            pickle.load(f)
+        )
+    location_extractor.load()
+    _worker_state.clear()
+    _worker_state.update(
+        keyword_matcher=keyword_matcher,
+        location_cache=None,
+        title_parser=title_parser,
+        location_extractor=location_extractor,
+    )
+    if location_cache_args is not None:
+        location_cache = LocationCache(*location_cache_args)
+        # Write the last use of the worker's hits when the pool shuts down, before
+        # the main process prunes the cache
+        Finalize(location_cache, location_cache.close, exitpriority=10)
+        _worker_state["location_cache"] = location_cache
+
+
+def _timed_label_row(path, keyword_matcher, location_cache=None, **kwargs):
+    """Returns the label row, whether its location came from the cache and the
+    seconds it took"""
+    start = time.perf_counter()
+    hits = location_cache.hits if location_cache is not None else 0
+    row = build_label_row(path, keyword_matcher, location_cache, **kwargs)
+    hit = None if location_cache is None else location_cache.hits > hits
+    return row, hit, time.perf_counter() - start
+
+
+def _build_label_row_in_worker(settings_path, path):
+    global _worker_settings_path
+    if _worker_settings_path != settings_path:
+        _init_label_worker(settings_path)
+        _worker_settings_path = settings_path
+    return _timed_label_row(path, **_worker_state)
+
+
+def _record_label_row(stage, path, hit, seconds):
+    stage.record_item(path.name, seconds, bytes_in=path.stat().st_size, cache_hit=hit)
+    if hit is not None:
+        stage.record_cache(hits=int(hit), misses=int(not hit))
+
+
+def iter_label_rows(files, keyword_matcher, jobs=1, location_cache=None,
+                    title_parser=DEFAULT_TITLE_PARSER, location_extractor=None,
+                    stage=None):
+    """
+    Yield the label row of each file, in the same order as `files`
+
+    With `jobs` greater than one the rows are computed by a pool of worker processes,
+    each of which loads the location extractor's models once and opens its own
+    connection to the location cache. Their cache hits and misses are added to
+    `location_cache`, and the time, size and cache hit of every file to the
+    `gpt_2.instrumentation.StageMetrics` `stage`.
+    """
+    if location_extractor is None:
+        location_extractor = get_location_extractor(DEFAULT_LOCATION_EXTRACTOR)
+    if jobs <= 1:
         for path in files:
-            print("-"*25)
-            print(f"Loading {path} ...")
-            body = path.read_text()
-            print("Extracting title ...")
-            title = get_page_title_from_path(path)
-            print("Extracting store location ...")
-            location = extract_store_location(title, body)
-        # for path, title, location in zip(files, titles, locations):
-            (
-                store_name,
-                page_template,
-            ) = extract_store_name_and_page_template_from_title(title)
-            print("Matching keywords ...")
-            keywords = get_keywords_in_body(keyword_corpus, body) 
-            keyword_str = ":".join(keywords)
-            writer.writerow(
-                {
-                    "file_name": path.with_suffix("").name,
-                    "title": title,
-                    "store_name": store_name,
-                    "store_location": location,
-                    "page_template": page_template,
-                    "keywords": keyword_str
-                }
+            row, hit, seconds = _timed_label_row(
+                path,
+                keyword_matcher,
+                location_cache,
+                title_parser=title_parser,
+                location_extractor=location_extractor,
             )
+            if stage is not None:
+                _record_label_row(stage, path, hit, seconds)
+            yield row
+        return
+    location_cache_args = None
+    if location_cache is not None:
+        location_cache_args = (location_cache.path, location_cache.version)
+    with tempfile.TemporaryDirectory() as tmp, \
+            ProcessPoolExecutor(max_workers=jobs) as executor:
+        settings_path = os.path.join(tmp, "settings.pickle")
+        with open(settings_path, "wb") as f:
+            pickle.dump(
+                (keyword_matcher, location_cache_args, title_parser, location_extractor),
+                f,
+            )
+        build_row = partial(_build_label_row_in_worker, settings_path)
+        for path, (row, hit, seconds) in zip(files, executor.map(build_row, files)):
+            if location_cache is not None:
+                location_cache.record(hit)
+            if stage is not None:
+                _record_label_row(stage, path, hit, seconds)
+            yield row
+
+
+def labeling_settings_hash(keyword_corpus, word_boundary=False,
+                           title_parser=DEFAULT_TITLE_PARSER, location_extractor=None):
+    """Hash of everything besides the article itself that a label row depends on"""
+    if location_extractor is None:
+        location_extractor = get_location_extractor(DEFAULT_LOCATION_EXTRACTOR)
+    h = hashlib.sha256()
+    h.update(location_extractor.cache_version.encode("utf-8"))
+    h.update(b"\0word_boundary\0" if word_boundary else b"\0")
+    h.update(json.dumps([title_parser.page_modifiers, title_parser.store_suffixes]).encode("utf-8"))
+    for keyword in keyword_corpus:
+        h.update(keyword.encode("utf-8"))
+        h.update(b"\n")
+    return h.hexdigest()
+
+
+def get_file_state(path, previous=None):
+    """
+    Get the modification time, size and content hash of a raw article
+
+    The content is only hashed when the modification time or size differ from
+    `previous`, the state recorded by an earlier run.
+
+    Returns
+    -------
+    state : dict
+        The current state of the file
+    unchanged : bool
+        True if the content of the file is the same as in `previous`
+    """
+    st = path.stat()
+    state = {"mtime_ns": st.st_mtime_ns, "size": st.st_size}
+    if previous is not None and all(previous.get(k) == v for k, v in state.items()):
+        state["sha256"] = previous["sha256"]
+        return state, True
+    state["sha256"] = hashlib.sha256(path.read_bytes()).hexdigest()
+    return state, previous is not None and previous.get("sha256") == state["sha256"]
+
+
+def load_previous_labels(outfile, manifest_path, settings_hash):
+    """
+    Load the rows and file states of a previous run, if it used the same settings
+
+    Returns
+    -------
+    rows : dict
+        Label rows keyed by file name
+    file_states : dict
+        File states keyed by file name
+    """
+    if not outfile.is_file() or not manifest_path.is_file():
+        return {}, {}
+    manifest = json.loads(manifest_path.read_text())
+    if manifest.get("settings_hash") != settings_hash:
+        logger.info("Keyword corpus or labeling settings changed, relabeling every file")
+        return {}, {}
+    with open(outfile, "r", newline="") as csvfile:
+        rows = {row["file_name"]: row for row in csv.DictReader(csvfile)}
+    return rows, manifest.get("files", {})
+
+
+def write_csv(files, outfile, keyword_corpus, word_boundary=False, jobs=1,
+              location_cache=None, incremental=False, title_parser=DEFAULT_TITLE_PARSER,
+              location_extractor=None, stage=None):
+    """
+    Write the label CSV for `files`
+
+    A sidecar manifest next to the CSV records the state of every labeled file and
+    a hash of the labeling settings. With `incremental`, rows of files that did not
+    change since the previous run are copied from the existing CSV and only new or
+    changed files are labeled. The CSV and manifest are replaced atomically.
+    Every labeled file is recorded in the `gpt_2.instrumentation.StageMetrics`
+    `stage`.
+    """
+    outfile = pathlib.Path(outfile)
+    manifest_path = outfile.with_name(outfile.name + ".manifest.json")
+    if location_extractor is None:
+        location_extractor = get_location_extractor(DEFAULT_LOCATION_EXTRACTOR)
+    settings_hash = labeling_settings_hash(
+        keyword_corpus, word_boundary, title_parser, location_extractor
+    )
+    previous_rows, previous_states = {}, {}
+    if incremental:
+        previous_rows, previous_states = load_previous_labels(
+            outfile, manifest_path, settings_hash
+        )
+    file_states = {}
+    changed = []
+    for path in files:
+        name = path.with_suffix("").name
+        file_states[name], unchanged = get_file_state(path, previous_states.get(name))
+        if not unchanged or name not in previous_rows:
+            changed.append(path)
+    logger.info("Number of files to label: %d of %d", len(changed), len(files))
+
+    logger.info("Extracting store locations, this could take awhile ...")
+    keyword_matcher = KeywordMatcher(keyword_corpus, word_boundary=word_boundary)
+    # Changed files are labeled in the same order they are written in below
+    new_rows = iter_label_rows(
+        changed,
+        keyword_matcher,
+        jobs=jobs,
+        location_cache=location_cache,
+        title_parser=title_parser,
+        location_extractor=location_extractor,
+        stage=stage,
+    )
+    changed = set(changed)
+    tmp_path = outfile.with_name(outfile.name + ".tmp")
+    with open(tmp_path, "w") as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        for path in files:
+            if path in changed:
+                row = next(new_rows)
+            else:
+                row = previous_rows[path.with_suffix("").name]
+            writer.writerow(row)
+    os.replace(tmp_path, outfile)
+    manifest = {"settings_hash": settings_hash, "files": file_states}
+    tmp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    os.replace(tmp_path, manifest_path)
+    if location_cache is not None:
+        logger.info("Location cache: %s", location_cache.stats())
 
 def extract_entity_names(t):
     entity_names = []
@@ -135,15 +342,16 @@ def extract_entity_names(t):
 
     return entity_names
 
-def get_keywords_in_body(corpus, body):
-    keywords = []
-    for keyword in corpus:
-        klower = keyword.lower() 
-        if klower in keywords:
-            continue
-        if klower in body.lower():
-            keywords.append(klower)
-    return keywords
+def get_keywords_in_body(corpus, body, word_boundary=False):
+    """
+    Get the lower cased keywords from `corpus` that appear in `body`
+
+    `corpus` is either a list of keywords or a precompiled KeywordMatcher. Compile
+    the matcher once with `KeywordMatcher(corpus)` when matching many bodies.
+    """
+    if not isinstance(corpus, KeywordMatcher):
+        corpus = KeywordMatcher(corpus, word_boundary=word_boundary)
+    return corpus.find_all(body)
 
 def load_keyword_corpus(folder):
     files = pathlib.Path(folder).glob("**/*.txt")
@@ -156,62 +364,12 @@ def load_keyword_corpus(folder):
     return corpus
 
 
+_geograpy_extractor = GeograpyLocationExtractor()
+
+
 def extract_store_location(title, body):
-    # First try to grab it from the title
-    compiled_re = re.compile('\([\w ]+\)')
-    match = re.search(compiled_re, title)
-    location = ''
-    if match is not None:
-        location += match.group(0).strip('()')
-        location += " "
-    # If that didn't work we need to search the body
-    # capital_words = re.findall('([A-Z][a-z]+)', body)
-    # print("capital_words = {}".format(capital_words))
-    places = geograpy.get_geoPlace_context(text=body)
-    # for attr in ("countries", "regions", "cities", "other", "country_regions",
-    #         "country_cities", "address_strings"):
-    #     print(f"places.{attr}")
-    #     pprint.pprint(getattr(places, attr))
-    allowed_countries = {"Canada", "United States"}
-    all_locs = []
-    for attr in ('country_regions', 'country_cities'):
-        for k, v in getattr(places, attr).items():
-            if k not in allowed_countries: 
-                continue
-            for subloc in v:
-                all_locs.append(f"{subloc} {k}")
-    location += ",".join(all_locs)
-    print("location = {}".format(location))
-    # all_cities = ' '.join(places.cities).strip()
-    # all_regions = ' '.join(places.regions).strip()
-    # all_countries = ' '.join(places.countries).strip()
-    # location += f"{all_cities} {all_regions} {all_countries}"
-
-    # print("propernouns:")
-    # pprint.pprint(propernouns)
-
-    # tokenizer = SpaceTokenizer()
-    # toks = tokenizer.tokenize(body)
-    # pos = pos_tag(toks)
-    # chunked_nes = ne_chunk(pos) 
-
-    # nes = set(' '.join(map(lambda x: x[0], ne.leaves())) for ne in chunked_nes if isinstance(ne, nltk.tree.Tree))
-    # print("nes:")
-    # pprint.pprint(nes)
-    # entities = []
-    # sentences = nltk.sent_tokenize(body)
-    # tokenized_sentences = [nltk.word_tokenize(sentence) for sentence in sentences]
-    # tagged_sentences = [nltk.pos_tag(sentence) for sentence in tokenized_sentences]
-    # chunked_sentences = nltk.ne_chunk_sents(tagged_sentences, binary=True)
-
-    # for tree in chunked_sentences:
-    #     entities.extend(extract_entity_names(tree))
-    # print("entities:")
-    # pprint.pprint(entities)
-    # print("common:")
-    # common = nes & propernouns
-    # print(common)
-    return location 
+    """Extract the store location with geograpy, loading its models on first use"""
+    return _geograpy_extractor.extract(title, body)
 
 
 def main():
@@ -237,13 +395,97 @@ def main():
         default=DEFAULT_KEYWORDS_DIR,
         help="Path to directory containing text files of keywords and phrases",
     )
+    parser.add_argument(
+        "-w",
+        "--word-boundary",
+        action="store_true",
+        default=False,
+        help="Only match keywords that are not part of a larger word",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes extracting labels in parallel",
+    )
+    parser.add_argument(
+        "-l",
+        "--location-extractor",
+        choices=sorted(LOCATION_EXTRACTORS),
+        default=DEFAULT_LOCATION_EXTRACTOR,
+        help="How to extract store locations from article bodies",
+    )
+    parser.add_argument(
+        "--location-cache",
+        type=str,
+        default=DEFAULT_LOCATION_CACHE,
+        help="Path to the SQLite cache of extracted store locations",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        default=False,
+        help="Always rerun location extraction instead of using the location cache",
+    )
+    parser.add_argument(
+        "--prune-cache",
+        action="store_true",
+        default=False,
+        help="Remove location cache entries that were not used by this run (with "
+        "--incremental, only entries from other location extractors or versions)",
+    )
+    parser.add_argument(
+        "-t",
+        "--title-config",
+        type=str,
+        default="",
+        help="JSON file with the page_modifiers and store_suffixes used to parse titles",
+    )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        default=False,
+        help="Only relabel files that are new or changed since the last run",
+    )
+    add_instrumentation_arguments(parser)
     args = parser.parse_args()
-    files = list(pathlib.Path(args.data_dir).glob("*.txt"))
-    out_path = pathlib.Path(args.output_dir).joinpath("metadata.csv")
-    # hist = get_title_word_histogram(names)
-    # pprint.pprint(hist)
-    keyword_corpus = load_keyword_corpus(args.keyword_corpus)
-    write_csv(files, out_path, keyword_corpus)
+    start_time = time.time()
+    with instrumented(args, "build_label_csv") as metrics:
+        files = sorted(pathlib.Path(args.data_dir).glob("*.txt"))
+        out_path = pathlib.Path(args.output_dir).joinpath("metadata.csv")
+        # hist = get_title_word_histogram(names)
+        # pprint.pprint(hist)
+        keyword_corpus = load_keyword_corpus(args.keyword_corpus)
+        title_parser = DEFAULT_TITLE_PARSER
+        if args.title_config:
+            title_parser = TitleParser.from_config(args.title_config)
+        location_extractor = get_location_extractor(args.location_extractor)
+        location_cache = None
+        if not args.no_cache:
+            location_cache = LocationCache(
+                args.location_cache, location_extractor.cache_version
+            )
+        with metrics.stage("label") as stage:
+            write_csv(
+                files,
+                out_path,
+                keyword_corpus,
+                word_boundary=args.word_boundary,
+                jobs=args.jobs,
+                location_cache=location_cache,
+                incremental=args.incremental,
+                title_parser=title_parser,
+                location_extractor=location_extractor,
+                stage=stage,
+            )
+        if location_cache is not None:
+            if args.prune_cache:
+                unused_since = None if args.incremental else start_time
+                pruned = location_cache.prune(unused_since=unused_since)
+                logger.info("Pruned %d unused location cache entries", pruned)
+            location_cache.close()
 
 
 if __name__ == "__main__":
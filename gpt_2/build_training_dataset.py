@@ -1,26 +1,334 @@
 import csv
+import hashlib
+import io
+import json
 import argparse
+import logging
 import pathlib
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from gpt_2.instrumentation import add_instrumentation_arguments, instrumented
+
+logger = logging.getLogger(__name__)
 
 SCRIPT_DIR = pathlib.Path(__file__).parent.absolute()
 DEFAULT_PROCESSED_DIR = SCRIPT_DIR.joinpath("..", "data", "processed")
 DEFAULT_DATA_DIR = SCRIPT_DIR.joinpath("..", "data", "raw")
+FIELDNAMES = [
+    "file_name",
+    "title",
+    "store_name",
+    "store_location",
+    "page_template",
+    "keywords",
+]
+# Raw article bodies are copied to the outputs in chunks of this many characters
+BODY_CHUNK_SIZE = 64 * 1024
 
 
-def create_training_text_body(labels, data_dir):
-    rawpath = data_dir.joinpath(f"{labels['file_name']}.txt")
-    print("rawpath = {}".format(rawpath))
-    body = rawpath.read_text()
-    fulltext = ""
-    fulltext += "[LABELS]\n\n"
+def iter_label_rows(label_csv):
+    """Lazily yield the rows of a label CSV written by build_label_csv"""
+    with open(label_csv, "r") as labelcsv:
+        reader = csv.DictReader(labelcsv, fieldnames=FIELDNAMES)
+        next(reader, None)
+        yield from reader
+
+
+def create_training_text_header(labels):
+    """Returns the `[LABELS]` block of a training sample, up to and including the
+    `[BODY]` marker"""
+    parts = ["[LABELS]\n\n"]
     for k, v in labels.items():
         if k == "file_name":
             continue
-        fulltext += f"{k}: {v}\n"
-        fulltext += "\n"
-    fulltext += "[BODY]\n\n"
-    fulltext += body
-    return fulltext
+        parts.append(f"{k}: {v}\n")
+        parts.append("\n")
+    parts.append("[BODY]\n\n")
+    return "".join(parts)
+
+
+def iter_training_text(labels, data_dir, chunk_size=BODY_CHUNK_SIZE):
+    """Yield the text of a training sample in pieces of at most `chunk_size`
+    characters of the raw article body"""
+    rawpath = data_dir.joinpath(f"{labels['file_name']}.txt")
+    yield create_training_text_header(labels)
+    with open(rawpath, "r") as raw:
+        while True:
+            chunk = raw.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def create_training_text_body(labels, data_dir):
+    return "".join(iter_training_text(labels, data_dir))
+
+
+class TextFileSink:
+    """Writes each training sample to its own `<file_name>.txt` in `output_dir`"""
+
+    def __init__(self, output_dir):
+        self.output_dir = pathlib.Path(output_dir)
+        self._f = None
+
+    def start(self, labels):
+        outpath = self.output_dir.joinpath(f"{labels['file_name']}.txt")
+        self._f = open(outpath, "w")
+
+    def write(self, text):
+        self._f.write(text)
+
+    def end(self):
+        self._f.close()
+        self._f = None
+
+
+class CSVSink:
+    """
+    Writes each training sample as a one column CSV row
+
+    The field is quoted and escaped while it is streamed, producing the same bytes
+    as `csv.writer(f).writerow([sample])` for samples containing a newline, which
+    every sample does.
+    """
+
+    def __init__(self, f):
+        self._f = f
+
+    def start(self, labels):
+        self._f.write('"')
+
+    def write(self, text):
+        self._f.write(text.replace('"', '""'))
+
+    def end(self):
+        self._f.write('"\r\n')
+
+
+class JSONLSink:
+    """Writes each training sample as a `{"file_name": ..., "text": ...}` JSON line"""
+
+    def __init__(self, f):
+        self._f = f
+
+    def start(self, labels):
+        self._f.write(f'{{"file_name": {json.dumps(labels["file_name"])}, "text": "')
+
+    def write(self, text):
+        # Strip the quotes json.dumps puts around the escaped chunk
+        self._f.write(json.dumps(text)[1:-1])
+
+    def end(self):
+        self._f.write('"}\n')
+
+
+class TokenSink:
+    """
+    Encodes each training sample with a `TokenizedDatasetWriter`
+
+    Samples are added to the writer as they finish, unless `defer` is set, in which
+    case the last encoded sample is kept in `encoded` for the caller to add.
+    """
+
+    def __init__(self, dataset, defer=False):
+        self.dataset = dataset
+        self.defer = defer
+        self.encoded = None
+        self._parts = None
+
+    def start(self, labels):
+        self._parts = []
+
+    def write(self, text):
+        self._parts.append(text)
+
+    def end(self):
+        self.encoded = self.dataset.encode("".join(self._parts))
+        self._parts = None
+        if not self.defer:
+            self.dataset.add(*self.encoded)
+            self.encoded = None
+
+
+class ByteCountSink:
+    """Counts the UTF-8 encoded size of each training sample"""
+
+    def __init__(self):
+        self.count = 0
+
+    def start(self, labels):
+        self.count = 0
+
+    def write(self, text):
+        self.count += len(text.encode("utf-8"))
+
+    def end(self):
+        pass
+
+
+def write_training_sample(labels, data_dir, sinks):
+    """Stream one training sample to every sink without building its full text"""
+    for sink in sinks:
+        sink.start(labels)
+    for text in iter_training_text(labels, data_dir):
+        for sink in sinks:
+            sink.write(text)
+    for sink in sinks:
+        sink.end()
+
+
+def shard_index(file_name, shards):
+    """Deterministically assign a sample to one of `shards` shards by the hash of its
+    file name"""
+    digest = hashlib.md5(file_name.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shards
+
+
+def shard_path(path, index, shards):
+    """Returns `path` with a `-0000i-of-0000K` shard suffix, or `path` itself when
+    there is a single shard"""
+    path = pathlib.Path(path)
+    if shards == 1:
+        return path
+    return path.with_name(f"{path.stem}-{index:05d}-of-{shards:05d}{path.suffix}")
+
+
+def bounded_map(executor, func, iterable, window):
+    """Like `executor.map` but yields results in order while only keeping `window`
+    items in flight, so the input is consumed lazily"""
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def build_training_dataset(rows, data_dir, output_dir=None, training_csv=None,
+                           jsonl=None, shards=1, jobs=1, tokenized=None, stage=None):
+    """
+    Write training samples for every label row
+
+    Parameters
+    ----------
+    rows : iterable of dict
+        Label rows, e.g. from `iter_label_rows`
+    data_dir : pathlib.Path
+        Directory containing the raw articles
+    output_dir : str or pathlib.Path
+        Directory for one text file per sample, or None to skip them
+    training_csv : str or pathlib.Path
+        Training CSV to write, or None to skip it
+    jsonl : str or pathlib.Path
+        JSON lines file to write, or None to skip it
+    shards : int
+        Split the CSV and JSON lines outputs into this many files. Samples are
+        assigned to shards by the hash of their file name.
+    jobs : int
+        Number of threads reading and formatting samples. With more than one job
+        each in-flight sample's CSV and JSON lines records are buffered in memory
+        so they can be written in input order.
+    tokenized : gpt_2.tokenized_dataset.TokenizedDatasetWriter
+        Also encode every sample into this writer, which the caller saves. Samples
+        are not sharded.
+    stage : gpt_2.instrumentation.StageMetrics
+        Records the time, raw article size and sample size of every sample, or
+        None to skip measuring them
+
+    Returns
+    -------
+    count : int
+        Number of samples written
+    """
+    with ExitStack() as stack:
+        csv_files = []
+        jsonl_files = []
+        for i in range(shards):
+            if training_csv:
+                f = stack.enter_context(open(shard_path(training_csv, i, shards), "w"))
+                f.write("# data\n")
+                csv_files.append(f)
+            if jsonl:
+                jsonl_files.append(
+                    stack.enter_context(open(shard_path(jsonl, i, shards), "w"))
+                )
+
+        def make_sinks(csv_f, jsonl_f, token_sink=None, counter=None):
+            sinks = [token_sink] if token_sink is not None else []
+            if counter is not None:
+                sinks.append(counter)
+            if output_dir:
+                sinks.append(TextFileSink(output_dir))
+            if csv_f is not None:
+                sinks.append(CSVSink(csv_f))
+            if jsonl_f is not None:
+                sinks.append(JSONLSink(jsonl_f))
+            return sinks
+
+        def record_sample(row, seconds, bytes_out):
+            rawpath = data_dir.joinpath(f"{row['file_name']}.txt")
+            stage.record_item(
+                row["file_name"], seconds, rawpath.stat().st_size, bytes_out
+            )
+
+        if jobs <= 1:
+            token_sink = TokenSink(tokenized) if tokenized is not None else None
+
+            counter = ByteCountSink() if stage is not None else None
+
+            def write(row):
+                start = time.perf_counter()
+                shard = shard_index(row["file_name"], shards)
+                sinks = make_sinks(
+                    csv_files[shard] if csv_files else None,
+                    jsonl_files[shard] if jsonl_files else None,
+                    token_sink,
+                    counter,
+                )
+                write_training_sample(row, data_dir, sinks)
+                if stage is not None:
+                    record_sample(row, time.perf_counter() - start, counter.count)
+
+            results = map(write, rows)
+        else:
+            def render(row):
+                start = time.perf_counter()
+                counter = ByteCountSink() if stage is not None else None
+                shard = shard_index(row["file_name"], shards)
+                csv_buf = io.StringIO() if csv_files else None
+                jsonl_buf = io.StringIO() if jsonl_files else None
+                token_sink = (
+                    TokenSink(tokenized, defer=True) if tokenized is not None else None
+                )
+                write_training_sample(
+                    row, data_dir, make_sinks(csv_buf, jsonl_buf, token_sink, counter)
+                )
+                if stage is not None:
+                    record_sample(row, time.perf_counter() - start, counter.count)
+                return shard, csv_buf, jsonl_buf, token_sink
+
+            def write(result):
+                shard, csv_buf, jsonl_buf, token_sink = result
+                if token_sink is not None:
+                    tokenized.add(*token_sink.encoded)
+                if csv_buf is not None:
+                    csv_files[shard].write(csv_buf.getvalue())
+                if jsonl_buf is not None:
+                    jsonl_files[shard].write(jsonl_buf.getvalue())
+
+            executor = stack.enter_context(ThreadPoolExecutor(max_workers=jobs))
+            results = map(write, bounded_map(executor, render, rows, window=4 * jobs))
+
+        count = 0
+        for _ in results:
+            count += 1
+            if count % 1000 == 0:
+                logger.info("Wrote %d training samples", count)
+    return count
 
 
 def main():
@@ -48,33 +356,91 @@ def main():
         default=DEFAULT_PROCESSED_DIR.joinpath("training_data.csv"),
         help="Destination CSV file for training",
     )
+    parser.add_argument(
+        "--jsonl",
+        type=str,
+        default="",
+        help="Also write the training samples to this JSON lines file",
+    )
+    parser.add_argument(
+        "--no-text-files",
+        action="store_true",
+        default=False,
+        help="Don't write a text file per training sample to the output directory",
+    )
+    parser.add_argument(
+        "--no-csv",
+        action="store_true",
+        default=False,
+        help="Don't write the training CSV",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of threads reading and writing training samples",
+    )
+    parser.add_argument(
+        "-s",
+        "--shards",
+        type=int,
+        default=1,
+        help="Split the training CSV and JSON lines file into this many shards, "
+        "named like training_data-00000-of-00004.csv",
+    )
+    parser.add_argument(
+        "--tokenized",
+        type=str,
+        default="",
+        help="Also encode the training samples with the GPT-2 encoder and save the "
+        "tokens to this .npz file, which finetune loads instead of the CSV",
+    )
+    parser.add_argument(
+        "--model-dir",
+        type=str,
+        default="models/355M",
+        help="Downloaded GPT-2 model whose encoder --tokenized uses",
+    )
+    add_instrumentation_arguments(parser)
     args = parser.parse_args()
 
-    fieldnames = [
-        "file_name",
-        "title",
-        "store_name",
-        "store_location",
-        "page_template",
-        "keywords",
-    ]
-
-    with open(args.label_csv, "r") as labelcsv:
-        with open(args.training_csv, "w") as traincsv:
-            traincsv.write("# data\n")
-            reader = csv.DictReader(labelcsv, fieldnames=fieldnames)
-            writer = csv.writer(traincsv)
-            next(reader)
-            for row in reader:
-                print(row)
-                outpath = pathlib.Path(args.output_dir).joinpath(
-                    f"{row['file_name']}.txt"
-                )
-                training_body = create_training_text_body(
-                    row, pathlib.Path(args.data_dir)
+    with instrumented(args, "build_training_dataset") as metrics:
+        tokenized = None
+        if args.tokenized:
+            from gpt_2.tokenized_dataset import TokenizedDatasetWriter
+
+            tokenized = TokenizedDatasetWriter.from_model_dir(args.model_dir)
+
+        # Sizing every sample costs an encode of its text and a stat of its
+        # article, only worth it when the sizes are written out
+        measure = bool(args.metrics or args.prometheus)
+        with metrics.stage("write_samples") as stage:
+            count = build_training_dataset(
+                iter_label_rows(args.label_csv),
+                pathlib.Path(args.data_dir),
+                output_dir=None if args.no_text_files else args.output_dir,
+                training_csv=None if args.no_csv else args.training_csv,
+                jsonl=args.jsonl or None,
+                shards=max(1, args.shards),
+                jobs=args.jobs,
+                tokenized=tokenized,
+                stage=stage if measure else None,
+            )
+            if not measure:
+                stage.record_items(count)
+        logger.info("Wrote %d training samples", count)
+        if tokenized is not None:
+            with metrics.stage("save_tokens") as stage:
+                start = time.perf_counter()
+                num_tokens = tokenized.save(args.tokenized)
+                stage.record_item(
+                    str(args.tokenized),
+                    time.perf_counter() - start,
+                    bytes_out=pathlib.Path(args.tokenized).stat().st_size,
+                    tokens=num_tokens,
                 )
-                outpath.write_text(training_body)
-                writer.writerow([training_body])
+            logger.info("Wrote %d tokens to %s", num_tokens, args.tokenized)
 
 
 if __name__ == "__main__":
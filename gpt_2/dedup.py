@@ -0,0 +1,343 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import pathlib
+import re
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from gpt_2.build_training_dataset import DEFAULT_DATA_DIR, FIELDNAMES, iter_label_rows
+from gpt_2.instrumentation import add_instrumentation_arguments, instrumented
+
+logger = logging.getLogger(__name__)
+
+SCRIPT_DIR = pathlib.Path(__file__).parent.absolute()
+DEFAULT_INTERIM_DIR = SCRIPT_DIR.joinpath("..", "data", "interim")
+DEFAULT_NUM_PERM = 128
+DEFAULT_SHINGLE_SIZE = 5
+DEFAULT_THRESHOLD = 0.8
+# Shingle hashes are hashed again by this many universal hash functions at a time,
+# which bounds memory for very long articles
+SHINGLE_BLOCK_SIZE = 4096
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+WORD_RE = re.compile(r"\w+")
+
+
+class MinHasher:
+    """
+    Computes MinHash signatures of article bodies
+
+    Bodies are lowercased and split into words, and every run of `shingle_size`
+    consecutive words is a shingle. The fraction of equal entries in two signatures
+    estimates the Jaccard similarity of the two bodies' shingle sets.
+
+    Parameters
+    ----------
+    num_perm : int
+        Number of hash functions, i.e. the length of a signature
+    shingle_size : int
+        Number of words per shingle
+    seed : int
+        Seed of the hash functions. Signatures are only comparable if they were
+        computed with the same seed.
+    """
+
+    def __init__(self, num_perm=DEFAULT_NUM_PERM, shingle_size=DEFAULT_SHINGLE_SIZE,
+                 seed=1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.seed = seed
+        rng = np.random.RandomState(seed)
+        # Keep a * x + b below 2 ** 64 for 32 bit x
+        self._a = rng.randint(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 31, size=num_perm, dtype=np.uint64)
+        self._combine = np.uint64(0x9E3779B1)
+
+    def shingle_hashes(self, body):
+        """Returns the 32 bit hashes of the body's shingles"""
+        words = WORD_RE.findall(body.lower())
+        if not words:
+            return np.zeros(0, dtype=np.uint64)
+        word_hashes = np.fromiter(
+            (zlib.crc32(w.encode("utf-8")) for w in words), dtype=np.uint64, count=len(words)
+        )
+        k = min(self.shingle_size, len(word_hashes))
+        count = len(word_hashes) - k + 1
+        shingles = word_hashes[:count].copy()
+        for j in range(1, k):
+            shingles = (shingles * self._combine + word_hashes[j:j + count]) & MAX_HASH
+        return shingles
+
+    def signature(self, body):
+        """Returns the MinHash signature of `body` as a uint32 array"""
+        signature = np.full(self.num_perm, MAX_HASH, dtype=np.uint64)
+        shingles = self.shingle_hashes(body)
+        for start in range(0, len(shingles), SHINGLE_BLOCK_SIZE):
+            block = shingles[start:start + SHINGLE_BLOCK_SIZE]
+            hashed = (np.outer(self._a, block) + self._b[:, None]) % MERSENNE_PRIME
+            np.minimum(signature, (hashed & MAX_HASH).min(axis=1), out=signature)
+        return signature.astype(np.uint32)
+
+
+def lsh_parameters(num_perm, threshold):
+    """
+    Choose the number of bands and rows per band for locality sensitive hashing
+
+    Two bodies with Jaccard similarity s share a band with probability
+    1 - (1 - s ** rows) ** bands, which rises steeply around (1 / bands) ** (1 / rows).
+    Returns the split of `num_perm` whose steepest point is closest to, but not above,
+    `threshold`, favouring recall since candidates are verified afterwards.
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if (1 / bands) ** (1 / rows) <= threshold:
+            best = (bands, rows)
+    return best
+
+
+class UnionFind:
+    def __init__(self, size):
+        self.parent = np.arange(size, dtype=np.int64)
+
+    def find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i, j):
+        i, j = self.find(i), self.find(j)
+        if i != j:
+            # The earliest document is the root of every cluster
+            self.parent[max(i, j)] = min(i, j)
+
+
+def find_clusters(signatures, threshold=DEFAULT_THRESHOLD, bands=None, rows=None):
+    """
+    Cluster near-duplicate documents by their MinHash signatures
+
+    Each band of every signature is reduced to one 64 bit key. Documents with equal
+    keys are candidates, and each candidate is joined to the first document in its
+    bucket when their estimated similarity reaches `threshold`. Sorting the keys of
+    one band at a time keeps this O(n log n) in time and O(n) in extra memory.
+
+    Parameters
+    ----------
+    signatures : numpy.ndarray
+        One signature per row, as returned by `MinHasher.signature`
+    threshold : float
+        Minimum estimated Jaccard similarity of near-duplicates
+    bands, rows : int
+        LSH band layout, by default chosen with `lsh_parameters`
+
+    Returns
+    -------
+    roots : numpy.ndarray
+        The index of the first document of each document's cluster
+    """
+    count, num_perm = signatures.shape
+    if bands is None or rows is None:
+        bands, rows = lsh_parameters(num_perm, threshold)
+    clusters = UnionFind(count)
+    rng = np.random.RandomState(0)
+    multipliers = rng.randint(1, 1 << 62, size=rows, dtype=np.uint64) | np.uint64(1)
+    for band in range(bands):
+        columns = signatures[:, band * rows:(band + 1) * rows].astype(np.uint64)
+        keys = (columns * multipliers).sum(axis=1, dtype=np.uint64)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.diff(sorted_keys)) + 1
+        for bucket in np.split(order, starts):
+            if len(bucket) < 2:
+                continue
+            first = bucket[0]
+            similarity = (signatures[bucket[1:]] == signatures[first]).mean(axis=1)
+            for other in bucket[1:][similarity >= threshold]:
+                clusters.union(first, other)
+    return np.array([clusters.find(i) for i in range(count)], dtype=np.int64)
+
+
+def _signature_in_worker(hasher, path):
+    return hasher.signature(path.read_text())
+
+
+def compute_signatures(paths, hasher, jobs=1):
+    """Returns the signatures of the articles at `paths`, one per row"""
+    signatures = np.empty((len(paths), hasher.num_perm), dtype=np.uint32)
+    if jobs <= 1:
+        results = (hasher.signature(path.read_text()) for path in paths)
+    else:
+        # The hasher is small, so it is sent with every chunk of paths instead of
+        # through an initializer, which ProcessPoolExecutor only takes from 3.7
+        executor = ProcessPoolExecutor(max_workers=jobs)
+        results = executor.map(
+            partial(_signature_in_worker, hasher), paths, chunksize=64
+        )
+    try:
+        for i, signature in enumerate(results):
+            signatures[i] = signature
+            if (i + 1) % 10000 == 0:
+                logger.info("Hashed %d of %d articles", i + 1, len(paths))
+    finally:
+        if jobs > 1:
+            executor.shutdown()
+    return signatures
+
+
+def dedup(label_csv, data_dir, outfile, report=None, keep=1, threshold=DEFAULT_THRESHOLD,
+          hasher=None, jobs=1):
+    """
+    Write the rows of `label_csv` whose article bodies are not near-duplicates
+
+    At most `keep` documents of each cluster of near-duplicates are kept, the ones
+    that come first in `label_csv`. The output has the same columns as the label CSV
+    so it can be passed to build_training_dataset.
+
+    Returns
+    -------
+    summary : dict
+        Counts of documents, clusters and removed rows
+    """
+    if hasher is None:
+        hasher = MinHasher()
+    data_dir = pathlib.Path(data_dir)
+    file_names = [row["file_name"] for row in iter_label_rows(label_csv)]
+    paths = [data_dir.joinpath(f"{name}.txt") for name in file_names]
+    signatures = compute_signatures(paths, hasher, jobs)
+    bands, rows = lsh_parameters(hasher.num_perm, threshold)
+    roots = find_clusters(signatures, threshold, bands, rows)
+    del signatures
+
+    kept_per_cluster = {}
+    keep_row = np.zeros(len(roots), dtype=bool)
+    for i, root in enumerate(roots):
+        kept = kept_per_cluster.get(root, 0)
+        keep_row[i] = kept < keep
+        kept_per_cluster[root] = kept + 1
+
+    tmp_outfile = pathlib.Path(f"{outfile}.tmp")
+    with open(tmp_outfile, "w") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        for i, row in enumerate(iter_label_rows(label_csv)):
+            if keep_row[i]:
+                writer.writerow(row)
+    os.replace(tmp_outfile, outfile)
+
+    sizes = np.bincount(roots, minlength=len(roots))
+    summary = {
+        "documents": len(roots),
+        "kept": int(keep_row.sum()),
+        "removed": int(len(roots) - keep_row.sum()),
+        "duplicate_clusters": int((sizes > 1).sum()),
+        "largest_cluster": int(sizes.max()) if len(sizes) else 0,
+        "settings": {
+            "keep": keep,
+            "threshold": threshold,
+            "num_perm": hasher.num_perm,
+            "shingle_size": hasher.shingle_size,
+            "seed": hasher.seed,
+            "bands": bands,
+            "rows": rows,
+        },
+    }
+    if report is not None:
+        clusters = {}
+        for i, root in enumerate(roots):
+            if sizes[root] > 1:
+                cluster = clusters.setdefault(int(root), {"kept": [], "removed": []})
+                cluster["kept" if keep_row[i] else "removed"].append(file_names[i])
+        clusters = sorted(clusters.values(), key=lambda c: -len(c["kept"]) - len(c["removed"]))
+        with open(report, "w") as f:
+            json.dump(dict(summary, clusters=clusters), f, indent=2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Remove near-duplicate articles from a label CSV with MinHash LSH"
+    )
+    parser.add_argument(
+        "-c", "--label-csv", required=True, help="CSV file containing label data"
+    )
+    parser.add_argument(
+        "-d",
+        "--data-dir",
+        type=str,
+        default=DEFAULT_DATA_DIR,
+        help="Path to directory containing raw downloaded data",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-csv",
+        type=str,
+        default=DEFAULT_INTERIM_DIR.joinpath("metadata_dedup.csv"),
+        help="Destination label CSV without near-duplicates, for build_training_dataset",
+    )
+    parser.add_argument(
+        "-r",
+        "--report",
+        type=str,
+        default=DEFAULT_INTERIM_DIR.joinpath("dedup_report.json"),
+        help="Destination JSON report of the near-duplicate clusters",
+    )
+    parser.add_argument(
+        "-k",
+        "--keep",
+        type=int,
+        default=1,
+        help="Number of articles to keep from each cluster of near-duplicates",
+    )
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="Jaccard similarity of word shingles above which articles are near-duplicates",
+    )
+    parser.add_argument("--num-perm", type=int, default=DEFAULT_NUM_PERM)
+    parser.add_argument("--shingle-size", type=int, default=DEFAULT_SHINGLE_SIZE)
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes hashing articles",
+    )
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+
+    with instrumented(args, "dedup") as metrics:
+        with metrics.stage("dedup") as stage:
+            summary = dedup(
+                args.label_csv,
+                args.data_dir,
+                args.output_csv,
+                report=args.report,
+                keep=args.keep,
+                threshold=args.threshold,
+                hasher=MinHasher(args.num_perm, args.shingle_size),
+                jobs=args.jobs,
+            )
+            stage.record_items(summary["documents"])
+        logger.info(
+            "Kept %d of %d articles, removed %d near-duplicates in %d clusters",
+            summary["kept"],
+            summary["documents"],
+            summary["removed"],
+            summary["duplicate_clusters"],
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# Text of the JSON the Google Docs API returns for a document. Kept free of the
+# Google client libraries so it can be used and benchmarked without them.
+HEADING_MARKERS = {
+    "TITLE": "# ",
+    "SUBTITLE": "## ",
+    "HEADING_1": "# ",
+    "HEADING_2": "## ",
+    "HEADING_3": "### ",
+    "HEADING_4": "#### ",
+    "HEADING_5": "##### ",
+    "HEADING_6": "###### ",
+}
+
+
+def read_paragraph_element(element):
+    """Returns the text in the given ParagraphElement.
+
+    Args:
+        element: a ParagraphElement from a Google Doc.
+    """
+    text_run = element.get("textRun")
+    if not text_run:
+        return ""
+    return text_run.get("content")
+
+
+def paragraph_marker(paragraph):
+    """Returns a Markdown-style marker for headings and list items, or an empty
+    string for plain paragraphs.
+
+    Args:
+        paragraph: a Paragraph from a Google Doc.
+    """
+    bullet = paragraph.get("bullet")
+    if bullet is not None:
+        return "  " * bullet.get("nestingLevel", 0) + "- "
+    style = paragraph.get("paragraphStyle", {}).get("namedStyleType", "")
+    return HEADING_MARKERS.get(style, "")
+
+
+def iter_structural_elements(elements, structure_markers=False):
+    """Yields the text runs of a list of Structural Elements in document order, where
+    text may be in nested elements.
+
+    Nested tables and tables of contents are walked with an explicit stack instead of
+    recursion, so arbitrarily deep documents are read in linear time.
+
+    Args:
+        elements: a list of Structural Elements.
+        structure_markers: prefix headings and list items with Markdown-style markers.
+    """
+    stack = [iter(elements)]
+    while stack:
+        value = next(stack[-1], None)
+        if value is None:
+            stack.pop()
+        elif "paragraph" in value:
+            paragraph = value.get("paragraph")
+            if structure_markers:
+                marker = paragraph_marker(paragraph)
+                if marker:
+                    yield marker
+            for elem in paragraph.get("elements"):
+                content = read_paragraph_element(elem)
+                if content:
+                    yield content
+        elif "table" in value:
+            # The text in table cells are in nested Structural Elements and tables may be
+            # nested.
+            table = value.get("table")
+            stack.append(
+                content
+                for row in table.get("tableRows")
+                for cell in row.get("tableCells")
+                for content in cell.get("content")
+            )
+        elif "tableOfContents" in value:
+            # The text in the TOC is also in a Structural Element.
+            toc = value.get("tableOfContents")
+            stack.append(iter(toc.get("content")))
+
+
+def read_structural_elements(elements, structure_markers=False):
+    """Reads a document's text from a list of Structural Elements where text may be
+    in nested elements.
+
+    Args:
+        elements: a list of Structural Elements.
+        structure_markers: prefix headings and list items with Markdown-style markers.
+    """
+    return "".join(iter_structural_elements(elements, structure_markers))
+
+
+def write_structural_elements(elements, out_f, structure_markers=False):
+    """Writes a document's text from a list of Structural Elements straight to a file
+    object, without building the whole text in memory.
+
+    Args:
+        elements: a list of Structural Elements.
+        out_f: a text file object.
+        structure_markers: prefix headings and list items with Markdown-style markers.
+    """
+    for text in iter_structural_elements(elements, structure_markers):
+        out_f.write(text)
+
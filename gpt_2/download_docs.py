@@ -1,9 +1,15 @@
 import os.path
 import pprint
 import csv
+import json
 import re
 import argparse
+import logging
 import pathlib
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from googleapiclient import errors
 from googleapiclient.discovery import build
@@ -11,6 +17,12 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 
+from gpt_2.docs_text import write_structural_elements
+from gpt_2.instrumentation import add_instrumentation_arguments, instrumented
+from gpt_2.sync_manifest import SyncManifest
+
+logger = logging.getLogger(__name__)
+
 # If modifying these scopes, delete the file token.json.
 SCOPES = [
     "https://www.googleapis.com/auth/documents",
@@ -19,66 +31,87 @@ SCOPES = [
 
 SCRIPT_DIR = pathlib.Path(__file__).parent.absolute()
 DEFAULT_DATA_DIR = SCRIPT_DIR.joinpath( "..", "data", "raw")
+DEFAULT_CACHE_DIR = SCRIPT_DIR.joinpath("..", "data", "interim", "cache")
+
+# Default Docs API read quota is 300 requests per minute per user
+DEFAULT_REQUESTS_PER_MINUTE = 300
+DEFAULT_MAX_RETRIES = 5
+# Truncated exponential backoff, as recommended for Google APIs
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 64.0
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+MANIFEST_NAME = "sync_manifest.json"
+# Largest page size files.list and changes.list accept
+MAX_PAGE_SIZE = 1000
+FILE_FIELDS = "id, name"
+SYNC_FILE_FIELDS = "id, name, modifiedTime, version"
+DEFAULT_FOLDER_CACHE_TTL = 24 * 60 * 60
+# Google API batch requests accept at most 100 calls each
+MAX_BATCH_SIZE = 100
+
+
+def query_escape(value):
+    """Escape a string for use as a literal in a Drive API `q` query"""
+    return value.replace("\\", "\\\\").replace("'", "\\'")
+
+
+def regex_literal_prefix(regex):
+    """
+    Get the literal text every name matched by `regex` must start with
 
+    Only regexes anchored with `^` and without alternation have such a prefix. The
+    prefix stops at the first character that is not alphanumeric, because Drive
+    splits names into terms on punctuation and whitespace before prefix matching.
 
-def read_paragraph_element(element):
-    """Returns the text in the given ParagraphElement.
-
-    Args:
-        element: a ParagraphElement from a Google Doc.
+    Returns
+    -------
+    prefix : str
+        The literal prefix, or an empty string if there is none
     """
-    text_run = element.get("textRun")
-    if not text_run:
+    if not regex.startswith("^") or "|" in regex:
         return ""
-    return text_run.get("content")
+    prefix = ""
+    for i, c in enumerate(regex[1:], start=1):
+        if not c.isalnum():
+            break
+        following = regex[i + 1 : i + 2]
+        if following in ("*", "?", "{"):
+            break
+        prefix += c
+        if following == "+":
+            break
+    return prefix
 
 
-def read_structural_elements(elements):
-    """Recurses through a list of Structural Elements to read a document's text where text may be
-    in nested elements.
+def get_google_drive_folders(service, name=''):
+    """
+    Get folder objects from Google Drive API keyed by folder name
 
-    Args:
-        elements: a list of Structural Elements.
+    Parameters
+    ----------
+    service :
+        Drive API service instance
+    name : str
+        Only look up folders with exactly this name instead of listing every folder
     """
-    text = ""
-    for value in elements:
-        if "paragraph" in value:
-            elements = value.get("paragraph").get("elements")
-            for elem in elements:
-                text += read_paragraph_element(elem)
-        elif "table" in value:
-            # The text in table cells are in nested Structural Elements and tables may be
-            # nested.
-            table = value.get("table")
-            for row in table.get("tableRows"):
-                cells = row.get("tableCells")
-                for cell in cells:
-                    text += read_structural_elements(cell.get("content"))
-        elif "tableOfContents" in value:
-            # The text in the TOC is also in a Structural Element.
-            toc = value.get("tableOfContents")
-            text += read_structural_elements(toc.get("content"))
-    return text
-
-
-def get_google_drive_folders(service):
+    query = f"mimeType = '{FOLDER_MIME_TYPE}' and trashed = false"
+    if name:
+        query += f" and name = '{query_escape(name)}'"
     all_files = dict()
     page_token = None
     while True:
-        # print("page_token = {}".format(page_token))
         response = (
             service.files()
             .list(
-                q="mimeType = 'application/vnd.google-apps.folder'",
-                pageSize=10,
+                q=query,
+                pageSize=MAX_PAGE_SIZE,
                 fields="nextPageToken, files(id, name)",
                 pageToken=page_token,
             )
             .execute()
         )
         for f in response.get("files", []):
-            # Process change
-            # print("Found file: %s (%s)" % (f.get("name"), f.get("id")))
             all_files[f.get("name")] = f
         page_token = response.get("nextPageToken", None)
         if page_token is None:
@@ -86,7 +119,42 @@ def get_google_drive_folders(service):
     return all_files
 
 
-def get_google_drive_files(service, folder_id='', regex='', prefix=''):
+def get_google_drive_folder_id(service, name, cache_path=None, ttl=DEFAULT_FOLDER_CACHE_TTL):
+    """
+    Get the ID of the Google Drive folder called `name`
+
+    Parameters
+    ----------
+    service :
+        Drive API service instance
+    name : str
+        Folder name
+    cache_path : str or pathlib.Path
+        JSON file caching the folder name to ID map. No cache is used when omitted.
+    ttl : float
+        Number of seconds a cached folder ID stays valid for
+    """
+    cache = {}
+    if cache_path is not None:
+        cache_path = pathlib.Path(cache_path)
+        if cache_path.is_file():
+            cache = json.loads(cache_path.read_text())
+        entry = cache.get(name)
+        if entry is not None and time.time() - entry["timestamp"] < ttl:
+            return entry["id"]
+    folders = get_google_drive_folders(service, name=name)
+    if name not in folders:
+        raise ValueError(f"Could not find a Google Drive folder named {name!r}")
+    folder_id = folders[name]["id"]
+    if cache_path is not None:
+        cache[name] = {"id": folder_id, "timestamp": time.time()}
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(json.dumps(cache, indent=2, sort_keys=True))
+    return folder_id
+
+
+def get_google_drive_files(service, folder_id='', regex='', prefix='', fields=FILE_FIELDS,
+                           raise_errors=False):
     """
     Get file objects from Google Drive API with optional filters
 
@@ -97,27 +165,36 @@ def get_google_drive_files(service, folder_id='', regex='', prefix=''):
     folder : str
         Folder ID of folder to restrict list of files to
     regex : str
-        A regex that must be contained within the file name
+        A regex that must be contained within the file name. The literal prefix of an
+        anchored regex is also pushed into the query so Drive filters server-side.
     prefix : str
         A prefix that must match the beginning of the file name
+    fields : str
+        Comma separated file fields to return
+    raise_errors : bool
+        Raise API errors instead of logging them and returning the files listed
+        before the error
     """
     if regex:
         compiled_re = re.compile(regex)
         has_regex = lambda name: re.search(compiled_re, name) is not None
+        if not prefix:
+            prefix = regex_literal_prefix(regex)
     else:
         has_regex = lambda name: True
-    query = "mimeType != 'application/vnd.google-apps.folder'"
+    query = f"mimeType != '{FOLDER_MIME_TYPE}' and trashed = false"
     if folder_id:
-        query += f" and '{folder_id}' in parents"
+        query += f" and '{query_escape(folder_id)}' in parents"
     if prefix:
-        query += f"  and name contains '{prefix}'"
+        query += f" and name contains '{query_escape(prefix)}'"
     page_token = None
     files = {}
     while True:
         try:
             param = {
                 "q": query,
-                "fields": "nextPageToken, files(id, name)",
+                "pageSize": MAX_PAGE_SIZE,
+                "fields": f"nextPageToken, files({fields})",
             }
             if page_token:
                 param["pageToken"] = page_token
@@ -131,11 +208,111 @@ def get_google_drive_files(service, folder_id='', regex='', prefix=''):
             if page_token is None:
                 break
         except errors.HttpError as error:
-            print("An error occurred: %s" % error)
+            if raise_errors:
+                raise
+            logger.error("An error occurred: %s", error)
             break
     return files
 
 
+def get_drive_changes(service, page_token):
+    """
+    Get all changes to Google Drive since `page_token`
+
+    Parameters
+    ----------
+    service :
+        Drive API service instance
+    page_token : str
+        Page token returned by `changes().getStartPageToken()` or by a previous
+        call to this function
+
+    Returns
+    -------
+    changes : list
+        Change resources, oldest first
+    new_page_token : str
+        Token to pass in on the next sync
+    """
+    changes = []
+    while True:
+        response = (
+            service.changes()
+            .list(
+                pageToken=page_token,
+                pageSize=MAX_PAGE_SIZE,
+                includeRemoved=True,
+                fields="nextPageToken, newStartPageToken, changes(fileId, removed, "
+                "file(id, name, mimeType, parents, trashed, modifiedTime, version))",
+            )
+            .execute()
+        )
+        changes.extend(response.get("changes", []))
+        if "newStartPageToken" in response:
+            return changes, response["newStartPageToken"]
+        page_token = response["nextPageToken"]
+
+
+def file_matches_filters(f, folder_id='', regex=''):
+    """Apply the same filters as `get_google_drive_files` to a single file object"""
+    if f.get("mimeType") == FOLDER_MIME_TYPE:
+        return False
+    if folder_id and folder_id not in f.get("parents", []):
+        return False
+    if regex and re.search(regex, f.get("name", "")) is None:
+        return False
+    return True
+
+
+def select_files_to_sync(drive, manifest, folder_id='', regex='', prune=False):
+    """
+    Work out which files need downloading to bring a directory up to date
+
+    On the first sync every matching file is listed. Afterwards only the Drive
+    changes since the manifest's page token are fetched. Files that were removed,
+    trashed or no longer match the filters are deleted locally when `prune` is
+    set and marked as removed in the manifest otherwise.
+
+    Returns
+    -------
+    files : dict
+        Mapping of file name to Drive file object for every file to download
+    page_token : str
+        Changes page token to store once the downloads are done
+    """
+    files = {}
+    if manifest.page_token is None:
+        # Grab the token before listing so no change made during the listing is lost
+        page_token = drive.changes().getStartPageToken().execute()["startPageToken"]
+        # A partial listing would mark the missing files removed and skip them
+        # until they change, so errors end the sync before the manifest is saved
+        listed = get_google_drive_files(
+            drive, folder_id=folder_id, regex=regex, fields=SYNC_FILE_FIELDS,
+            raise_errors=True,
+        )
+        listed_ids = set(f["id"] for f in listed.values())
+        for file_id in list(manifest.files):
+            if file_id not in listed_ids:
+                manifest.remove(file_id, delete=prune)
+        for name, f in listed.items():
+            if not manifest.is_current(f):
+                files[name] = f
+    else:
+        changes, page_token = get_drive_changes(drive, manifest.page_token)
+        logger.info("Number of changes since last sync: %d", len(changes))
+        for change in changes:
+            f = change.get("file")
+            if change.get("removed") or f is None or f.get("trashed"):
+                manifest.remove(change["fileId"], delete=prune)
+            elif not file_matches_filters(f, folder_id=folder_id, regex=regex):
+                manifest.remove(f["id"], delete=prune)
+            elif not manifest.is_current(f):
+                files[f["name"]] = f
+    for f in manifest.pending.values():
+        files.setdefault(f["name"], f)
+    return files, page_token
+
+
 def get_creds(creds_path, token_path):
     # creds_file = "dlahoodbb_at_gmail_dot_com_creds.json"
     creds = None
@@ -159,23 +336,217 @@ def get_creds(creds_path, token_path):
 
 
 
-def download_files(docs, files, out_dir):
-    for name, f in files.items():
-        print("-" * 25)
+class RateLimiter:
+    """Thread-safe token bucket allowing at most `rate` calls per `period` seconds.
+
+    Args:
+        rate: number of calls allowed per period.
+        period: length of the period in seconds.
+    """
+
+    def __init__(self, rate, period=60.0, clock=time.monotonic, sleep=time.sleep):
+        self.capacity = float(rate)
+        self.fill_rate = rate / period
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, n=1):
+        """Block until `n` calls may be made. Requests larger than the bucket are
+        allowed once it is full and put the bucket into debt."""
+        while True:
+            with self._lock:
+                now = self._clock()
+                elapsed = now - self._updated
+                self._updated = now
+                self._tokens = min(self.capacity, self._tokens + elapsed * self.fill_rate)
+                needed = min(n, self.capacity)
+                if self._tokens >= needed:
+                    self._tokens -= n
+                    return
+                wait = (needed - self._tokens) / self.fill_rate
+            self._sleep(wait)
+
+
+def is_retryable_error(error):
+    """Returns True if a failed API call is worth retrying (quota, server and
+    connection errors)."""
+    if isinstance(error, errors.HttpError):
+        return error.resp.status in RETRYABLE_STATUS_CODES
+    return isinstance(error, OSError)
+
+
+def backoff_delay(attempt):
+    """Returns the delay in seconds before retry number `attempt` (starting at 0),
+    using truncated exponential backoff with full jitter."""
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def execute_with_retry(request, limiter=None, max_retries=DEFAULT_MAX_RETRIES, sleep=time.sleep):
+    """Executes an API request, retrying retryable failures with exponential backoff.
+
+    Args:
+        request: a zero argument callable performing the API call.
+        limiter: optional RateLimiter every attempt must acquire from.
+        max_retries: number of retries before the last error is re-raised.
+    """
+    attempt = 0
+    while True:
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return request()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable_error(e):
+                raise
+            delay = backoff_delay(attempt)
+            logger.warning("Request failed (%s), retrying in %.1fs", e, delay)
+            sleep(delay)
+            attempt += 1
+
+
+def document_path(name, out_dir):
+    fname = f"{name}.txt".replace("/", "")
+    return pathlib.Path(out_dir).joinpath(fname)
+
+
+def write_document(doc, name, out_dir, structure_markers=False):
+    """Writes the text of a document, returning the number of bytes written"""
+    doc_content = doc.get('body').get('content')
+    out_path = document_path(name, out_dir)
+    with open(out_path, 'w') as out_f:
+        write_structural_elements(doc_content, out_f, structure_markers)
+    return out_path.stat().st_size
+
+
+def fetch_documents(docs, files, limiter=None, max_retries=DEFAULT_MAX_RETRIES,
+                    sleep=time.sleep):
+    """Fetches a group of Google Docs with a single batch HTTP request.
+
+    Calls that fail with a retryable error are collected and sent again in a
+    smaller batch after an exponential backoff.
+
+    Args:
+        docs: a Docs API service.
+        files: a mapping of file name to Drive file object, at most MAX_BATCH_SIZE
+            entries.
+        limiter: optional RateLimiter. Every call in a batch counts against the quota.
+        max_retries: retries per document before giving up on it.
+
+    Returns:
+        A `(documents, failures)` tuple of dicts keyed by file name, mapping to the
+        fetched document and to the last exception raised respectively.
+    """
+    names = list(files)
+    documents = {}
+    failures = {}
+    attempt = 0
+    while names:
+        results = {}
+
+        def callback(request_id, response, exception):
+            results[request_id] = (response, exception)
+
+        batch = docs.new_batch_http_request(callback=callback)
+        for i, name in enumerate(names):
+            batch.add(docs.documents().get(documentId=files[name]["id"]), request_id=str(i))
+        if limiter is not None:
+            limiter.acquire(len(names))
+        try:
+            batch.execute()
+        except Exception as e:
+            results = {str(i): (None, e) for i in range(len(names))}
+        retry = []
+        for i, name in enumerate(names):
+            response, exception = results.get(str(i), (None, None))
+            if exception is None and response is not None:
+                documents[name] = response
+                failures.pop(name, None)
+                continue
+            failures[name] = exception
+            if attempt < max_retries and (exception is None or is_retryable_error(exception)):
+                retry.append(name)
+        names = retry
+        if names:
+            delay = backoff_delay(attempt)
+            logger.warning(
+                "%d requests in batch failed, retrying in %.1fs", len(names), delay
+            )
+            sleep(delay)
+            attempt += 1
+    return documents, failures
+
+
+def download_files(make_docs, files, out_dir, workers=1, limiter=None,
+                   max_retries=DEFAULT_MAX_RETRIES, batch_size=1, structure_markers=False,
+                   stage=None):
+    """Downloads the text of Google Docs into `out_dir` using a pool of worker threads.
+
+    Args:
+        make_docs: a zero argument callable returning a Docs API service. Each worker
+            thread builds its own service because the underlying HTTP client is not
+            thread-safe.
+        files: a mapping of file name to Drive file object.
+        out_dir: directory to write `<name>.txt` files into.
+        workers: number of requests to have in flight concurrently.
+        limiter: optional RateLimiter shared by all workers.
+        max_retries: retries per document before giving up on it.
+        batch_size: number of documents to fetch per HTTP request. Values above one
+            use the batch endpoint, capped at MAX_BATCH_SIZE.
+        structure_markers: prefix headings and list items with Markdown-style markers.
+        stage: optional gpt_2.instrumentation.StageMetrics recording every document,
+            with the time to fetch its batch and write it, and every failure.
+
+    Returns:
+        A list of the names of documents that could not be downloaded.
+    """
+    local = threading.local()
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+
+    def get_docs():
+        docs = getattr(local, "docs", None)
+        if docs is None:
+            docs = local.docs = make_docs()
+        return docs
+
+    def fetch_one(name, f):
         try:
-            doc = docs.documents().get(documentId=f["id"]).execute()
+            doc = execute_with_retry(
+                lambda: get_docs().documents().get(documentId=f["id"]).execute(),
+                limiter=limiter,
+                max_retries=max_retries,
+            )
         except Exception as e:
-            print(f"Could not retrieve document {name}")
-            print("Exception raised:")
-            print(e)
-            continue
-        print(f"Downloading document: {doc['title']}")
-        doc_content = doc.get('body').get('content')
-        body = read_structural_elements(doc_content)
-        fname = f"{name}.txt".replace("/", "")
-        out_path = pathlib.Path(out_dir).joinpath(fname)
-        with open(out_path, 'w') as out_f:
-            out_f.write(body)
+            return {}, {name: e}
+        return {name: doc}, {}
+
+    def download(chunk):
+        start = time.perf_counter()
+        if len(chunk) == 1:
+            documents, failures = fetch_one(*chunk[0])
+        else:
+            documents, failures = fetch_documents(
+                get_docs(), dict(chunk), limiter=limiter, max_retries=max_retries
+            )
+        for name, e in failures.items():
+            logger.warning("Could not retrieve document %s: %s", name, e)
+        if stage is not None and failures:
+            stage.record_error(len(failures))
+        for name, doc in documents.items():
+            logger.debug("Downloading document: %s", doc['title'])
+            size = write_document(doc, name, out_dir, structure_markers)
+            if stage is not None:
+                stage.record_item(name, time.perf_counter() - start, bytes_out=size)
+        return list(failures)
+
+    items = list(files.items())
+    chunks = [items[i : i + batch_size] for i in range(0, len(items), batch_size)]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        failed = [name for names in executor.map(download, chunks) for name in names]
+    logger.info("Number of files that failed to download: %d", len(failed))
+    return failed
 
 
 def main():
@@ -186,35 +557,84 @@ def main():
     parser.add_argument('-o', '--output-dir', type=str, default=DEFAULT_DATA_DIR, help="Path to directory for downloading data")
     parser.add_argument('-f', '--folder', type=str, default='', help="Google Docs folder to pull data from")
     parser.add_argument('-r', '--regex', type=str, default='', help="Regex that must match any part of the downloaded file names")
-    parser.add_argument('-s', '--skip', action='store_true', default=False, help="Skip file  names that have already been downloaded")
+    parser.add_argument('-s', '--skip', action='store_true', default=False, help="Skip file  names that have already been downloaded (not with --sync, which only downloads changed documents)")
+    parser.add_argument('--sync', action='store_true', default=False, help="Only download documents that changed since the last sync, using a manifest in the output directory")
+    parser.add_argument('--manifest', type=str, default='', help=f"Path to the sync manifest (defaults to {MANIFEST_NAME} in the output directory)")
+    parser.add_argument('--prune', action='store_true', default=False, help="With --sync, delete local copies of documents removed from Drive instead of only marking them removed")
+    parser.add_argument('-m', '--structure-markers', action='store_true', default=False, help="Prefix headings and list items with Markdown-style markers")
+    parser.add_argument('--folder-cache-ttl', type=float, default=DEFAULT_FOLDER_CACHE_TTL, help="Seconds to cache folder name lookups for (0 disables the cache)")
+    parser.add_argument('-w', '--workers', type=int, default=1, help="Number of documents to download concurrently")
+    parser.add_argument('--requests-per-minute', type=int, default=DEFAULT_REQUESTS_PER_MINUTE, help="Docs API request quota shared by all workers")
+    parser.add_argument('--max-retries', type=int, default=DEFAULT_MAX_RETRIES, help="Number of retries for a failed document before skipping it")
+    parser.add_argument('-b', '--batch-size', type=int, default=MAX_BATCH_SIZE, help=f"Number of documents to fetch per batch HTTP request (at most {MAX_BATCH_SIZE})")
+    add_instrumentation_arguments(parser)
     args = parser.parse_args()
-
-    p = pathlib.Path(args.output_dir).glob('*.txt')
-    existing_files = set(x.with_suffix('').name for x in p if x.is_file())
-    for arg in (args.token, args.credentials):
-        if not os.path.isfile(arg):
-            raise ValueError("Argument {arg} is not a valid path")
-    creds = get_creds(args.credentials, args.token)
-    drive = build("drive", "v3", credentials=creds)
-    docs = build("docs", "v1", credentials=creds)
-
-    folder_id = ''
-    if args.folder:
-        print("Retrieving all folders ...")
-        folders = get_google_drive_folders(drive)
-        folder_id = folders[args.folder]["id"]
-
-    print("Getting files ...")
-    if args.regex:
-        print(f"Files must match {args.regex}")
-    if args.folder:
-        print(f"Files must be in {args.folder}")
-    files = get_google_drive_files(drive, folder_id=folder_id, regex=args.regex)
-    print(f"Number of files found: {len(files)}")
-    if args.skip:
-        files = {k: v for k, v in files.items() if k not in existing_files}
-    print(f"Number of files to download: {len(files)}")
-    download_files(docs, files, args.output_dir)
+    if args.sync and args.skip:
+        # Skipping by name would drop edited documents that exist locally, and the
+        # page token would move past their changes for good
+        parser.error("--skip can't be combined with --sync")
+
+    with instrumented(args, "download_docs") as metrics:
+        p = pathlib.Path(args.output_dir).glob('*.txt')
+        existing_files = set(x.with_suffix('').name for x in p if x.is_file())
+        for arg in (args.token, args.credentials):
+            if not os.path.isfile(arg):
+                raise ValueError("Argument {arg} is not a valid path")
+        creds = get_creds(args.credentials, args.token)
+        drive = build("drive", "v3", credentials=creds)
+
+        with metrics.stage("list_files"):
+            folder_id = ''
+            if args.folder:
+                logger.info("Looking up folder %s ...", args.folder)
+                cache_path = None
+                if args.folder_cache_ttl > 0:
+                    token_name = pathlib.Path(args.token).stem
+                    cache_path = DEFAULT_CACHE_DIR.joinpath(f"drive_folders_{token_name}.json")
+                folder_id = get_google_drive_folder_id(
+                    drive, args.folder, cache_path=cache_path, ttl=args.folder_cache_ttl
+                )
+
+            logger.info("Getting files ...")
+            if args.regex:
+                logger.info("Files must match %s", args.regex)
+            if args.folder:
+                logger.info("Files must be in %s", args.folder)
+            manifest = None
+            if args.sync:
+                manifest_path = args.manifest or pathlib.Path(args.output_dir).joinpath(MANIFEST_NAME)
+                manifest = SyncManifest(manifest_path)
+                files, page_token = select_files_to_sync(
+                    drive, manifest, folder_id=folder_id, regex=args.regex, prune=args.prune
+                )
+            else:
+                files = get_google_drive_files(drive, folder_id=folder_id, regex=args.regex)
+                logger.info("Number of files found: %d", len(files))
+            if args.skip:
+                files = {k: v for k, v in files.items() if k not in existing_files}
+            logger.info("Number of files to download: %d", len(files))
+        limiter = RateLimiter(args.requests_per_minute)
+        with metrics.stage("download") as stage:
+            failed = download_files(
+                lambda: build("docs", "v1", credentials=creds),
+                files,
+                args.output_dir,
+                workers=args.workers,
+                limiter=limiter,
+                max_retries=args.max_retries,
+                batch_size=args.batch_size,
+                structure_markers=args.structure_markers,
+                stage=stage,
+            )
+        if manifest is not None:
+            failed = set(failed)
+            for name, f in files.items():
+                if name in failed:
+                    manifest.mark_pending(f)
+                else:
+                    manifest.record(f, document_path(name, args.output_dir))
+            manifest.page_token = page_token
+            manifest.save()
 
     # # files = get_files_matching_prefix(drive, "C")
     # creds_file = "dlahood_at_carpetone_dot_com_gmail_creds.json"
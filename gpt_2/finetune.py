@@ -1,35 +1,82 @@
+import argparse
 import gpt_2_simple as gpt2
 import os
+import pathlib
 import requests
+from contextlib import ExitStack
 
 
 def build_csv():
     pass
 
 
+def load_tokenized_dataset(tokenized, dataset):
+    """
+    Returns the memory mapped tokens of a tokenized dataset, or None if it is
+    missing or was built from a different version of the `dataset` CSV
+    """
+    from gpt_2.tokenized_dataset import hash_training_csv, load_tokens, read_content_hash
+
+    if not os.path.isfile(tokenized):
+        return None
+    if os.path.isfile(dataset):
+        if read_content_hash(tokenized) != hash_training_csv(dataset):
+            print(f"{tokenized} is out of date with {dataset}, encoding the CSV instead")
+            return None
+    return load_tokens(tokenized)
+
+
 def main():
-    model_name = "355M"
+    parser = argparse.ArgumentParser(description="Finetune GPT-2 on the training data")
+    parser.add_argument("-m", "--model-name", default="355M")
     # dataset = "datasets/training_data.csv"
-    dataset = "data/processed/training_data_march_17_2021.csv"
-    run_name = "experiment_3_355M"
     # dataset = "./datasets/article.txt"
+    parser.add_argument(
+        "-d",
+        "--dataset",
+        default="data/processed/training_data_march_17_2021.csv",
+        help="Training CSV written by build_training_dataset",
+    )
+    parser.add_argument(
+        "-t",
+        "--tokenized",
+        default="",
+        help="Tokenized dataset written by build_training_dataset --tokenized. "
+        "Defaults to the dataset path with an .npz suffix, and is used in place of "
+        "the CSV when it exists and matches it.",
+    )
+    parser.add_argument("-r", "--run-name", default="experiment_3_355M")
+    parser.add_argument("-s", "--steps", type=int, default=1000)
+    args = parser.parse_args()
+
+    model_name = args.model_name
+    dataset = args.dataset
+    run_name = args.run_name
+    tokenized = args.tokenized or str(pathlib.Path(dataset).with_suffix(".npz"))
     if not os.path.isdir(os.path.join("models", model_name)):
         print(f"Downloading {model_name} model...")
         gpt2.download_gpt2(
             model_name=model_name
         )  # model is saved into current directory under /models/124M/
 
-    sess = gpt2.start_tf_sess()
-    gpt2.finetune(
-        sess,
-        dataset,
-        restore_from="fresh",
-        model_name=model_name,
-        steps=1000,
-        run_name=run_name,
-        sample_length=1023,
-        multi_gpu=False,
-    )
+    with ExitStack() as stack:
+        tokens = load_tokenized_dataset(tokenized, dataset)
+        if tokens is not None:
+            from gpt_2.tokenized_dataset import use_tokens
+
+            print(f"Loaded {len(tokens)} pre-encoded tokens from {tokenized}")
+            stack.enter_context(use_tokens(tokens))
+        sess = gpt2.start_tf_sess()
+        gpt2.finetune(
+            sess,
+            dataset,
+            restore_from="fresh",
+            model_name=model_name,
+            steps=args.steps,
+            run_name=run_name,
+            sample_length=1023,
+            multi_gpu=False,
+        )
 
 
 if __name__ == "__main__":
@@ -1,40 +1,26 @@
-import os
+import logging
 import pathlib
 import argparse
-import csv
-from datetime import datetime
 import gpt_2_simple as gpt2
 
-SCRIPT_DIR = pathlib.Path(__file__).parent.absolute()
-DEFAULT_RESULTS_DIR = SCRIPT_DIR.joinpath("..", "data", "raw")
-
-
-def generate_prompts_from_csv(path):
-    path = pathlib.Path(path)
-    prompts = []
-    with open(path, "r", encoding='utf-8-sig') as f:
-        fieldnames = f.readline().lstrip("#").strip().split(",")
-        print("fieldnames = {}".format(fieldnames))
-        reader = csv.DictReader(f, fieldnames=fieldnames)
-        for row in reader:
-            if not any(v for v in row.values()):
-                continue
-            print("row = {}".format(row))
-            prompt = f"""
-[LABELS]
-
-title: {row['title']}
+from gpt_2.generation import (
+    DEFAULT_STOP_SEQUENCES,
+    GenerationEngine,
+    StopCriteria,
+    generate_to_files,
+)
+from gpt_2.generation_cache import (
+    DEFAULT_GENERATION_CACHE,
+    DEFAULT_MAX_BYTES,
+    GenerationCache,
+)
+from gpt_2.instrumentation import add_instrumentation_arguments, instrumented
+from gpt_2.prompts import PROMPT_TEMPLATES, PromptBuilder, iter_prompts
 
-store_name: {row['store_name']}
+logger = logging.getLogger(__name__)
 
-store_location: {row['store_location']}
-
-page_template: {row['page_template']}
-
-keywords: {row['keywords']}
-"""
-            prompts.append((row["file_name"], prompt))
-    return prompts
+SCRIPT_DIR = pathlib.Path(__file__).parent.absolute()
+DEFAULT_RESULTS_DIR = SCRIPT_DIR.joinpath("..", "data", "raw")
 
 
 def main():
@@ -52,29 +38,103 @@ def main():
         default=DEFAULT_RESULTS_DIR,
         help="""Directory to save generated samples to""",
     )
+    parser.add_argument(
+        "-n", "--nsamples", type=int, default=5, help="Samples to generate per prompt"
+    )
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        type=int,
+        default=0,
+        help="Samples per forward pass. Samples of prompts with the same token length "
+        "share batches. By default the largest batch that fits in the available "
+        "memory is used.",
+    )
+    parser.add_argument("-l", "--length", type=int, default=1023)
+    parser.add_argument("-t", "--temperature", type=float, default=0.7)
+    parser.add_argument(
+        "--template",
+        default="default",
+        help=f"Prompt template, one of {sorted(PROMPT_TEMPLATES)} or the path to a "
+        "file containing a template with {field} placeholders for the CSV columns",
+    )
+    parser.add_argument(
+        "--stop",
+        action="append",
+        help="Text that ends a sample, can be given more than once. Defaults to "
+        f"{list(DEFAULT_STOP_SEQUENCES)}",
+    )
+    parser.add_argument(
+        "--no-stop",
+        action="store_true",
+        help="Don't stop samples at stop sequences, generate --length tokens",
+    )
+    parser.add_argument(
+        "--min-words",
+        type=int,
+        help="Keep the model from ending a sample before it has this many words",
+    )
+    parser.add_argument(
+        "--max-words", type=int, help="End samples once they have this many words"
+    )
+    parser.add_argument(
+        "--cache",
+        default=DEFAULT_GENERATION_CACHE,
+        help="Path to the SQLite cache of generated samples",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=DEFAULT_MAX_BYTES // 2**20,
+        help="Size bound of the generation cache in MiB",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Generate every prompt without using the generation cache",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Regenerate prompts that are already cached and replace their samples",
+    )
+    add_instrumentation_arguments(parser)
     args = parser.parse_args()
 
-    prompts = generate_prompts_from_csv(args.csv)
+    with instrumented(args, "generate") as metrics:
+        run(args, metrics)
+
+
+def run(args, metrics):
+    stop_sequences = () if args.no_stop else args.stop or DEFAULT_STOP_SEQUENCES
+    stop = StopCriteria(stop_sequences, args.min_words, args.max_words)
+    prompts = iter_prompts(args.csv, PromptBuilder.from_name_or_file(args.template))
 
-    # gen_file = "generated_samples/gpt2_gentext_{:%Y%m%d_%H%M%S}.txt".format(
-    #     datetime.utcnow()
-    # )
     sess = gpt2.start_tf_sess()
-    gpt2.load_gpt2(sess, run_name=args.model_name)
-    # gpt2.generate(sess, run_name='first_test', prefix="Luxury Vinyl Plank Flooring")
-    for fname, prefix in prompts:
-        print(f"Saving samples for prefix {prefix} to {fname}")
-        gen_file = os.path.join(args.output_dir, fname)
-        gpt2.generate_to_file(
-            sess,
-            prefix=prefix,
-            destination_path=gen_file,
-            # length=500,
-            temperature=0.7,
-            nsamples=5,
-            batch_size=1,
-            run_name=args.model_name,
+    with metrics.stage("load_model"):
+        gpt2.load_gpt2(sess, run_name=args.model_name)
+    engine = GenerationEngine(sess, run_name=args.model_name)
+    cache = None
+    if not args.no_cache:
+        cache = GenerationCache(args.cache, args.cache_size * 2**20)
+    with metrics.stage("generate") as stage:
+        paths = generate_to_files(
+            engine,
+            prompts,
+            args.output_dir,
+            nsamples=args.nsamples,
+            batch_size=args.batch_size or None,
+            length=args.length,
+            temperature=args.temperature,
+            stop=stop,
+            cache=cache,
+            refresh=args.refresh,
+            stage=stage,
         )
+    logger.info("Saved samples for %d prompts to %s", len(paths), args.output_dir)
+    if cache is not None:
+        logger.info("Generation cache: %s", cache.stats())
+        cache.close()
 
 
 if __name__ == "__main__":
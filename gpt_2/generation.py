@@ -0,0 +1,765 @@
+import hashlib
+import itertools
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+import tensorflow as tf
+from gpt_2_simple.src import encoder, model, sample
+
+DEFAULT_SAMPLE_DELIM = "=" * 20 + "\n"
+# Fraction of the GPU or available host memory auto-tuned batches may use
+DEFAULT_MEMORY_FRACTION = 0.5
+MAX_AUTO_BATCH_SIZE = 64
+# Attention pasts of this many recently used prompt prefixes are kept on the device
+DEFAULT_PREFIX_CACHE_SIZE = 16
+# Prompts read and batched together by iter_generated
+DEFAULT_PROMPT_WINDOW = 64
+# Text that ends an article: the end marker build_training_dataset writes, and the
+# start of another sample or of another labels block
+DEFAULT_STOP_SEQUENCES = ("<|endoftext|>", "<|startoftext|>", "[LABELS]")
+END_TOKEN = "<|endoftext|>"
+# Words are split on ASCII whitespace, matching the byte level counting below
+_WHITESPACE = frozenset(b" \t\n\r\x0b\x0c")
+_WORD = re.compile(r"[^ \t\n\r\x0b\x0c]+")
+
+
+def checkpoint_path_for(run_name="run1", checkpoint_dir="checkpoint", model_name=None,
+                        model_dir="models"):
+    """Returns the directory gpt_2_simple loads a model from"""
+    if model_name:
+        return os.path.join(model_dir, model_name)
+    return os.path.join(checkpoint_dir, run_name)
+
+
+def load_hparams(checkpoint_path):
+    hparams = model.default_hparams()
+    with open(os.path.join(checkpoint_path, "hparams.json")) as f:
+        hparams.override_from_dict(json.load(f))
+    return hparams
+
+
+def checkpoint_hash(checkpoint_path):
+    """
+    Returns a hash identifying the weights and vocabulary of a checkpoint
+
+    The tensor index of the latest checkpoint is hashed rather than its data files,
+    which can be gigabytes; the index records a checksum of every tensor.
+    """
+    paths = [
+        os.path.join(checkpoint_path, name)
+        for name in ("hparams.json", "encoder.json", "vocab.bpe")
+    ]
+    ckpt = tf.train.latest_checkpoint(checkpoint_path)
+    if ckpt:
+        paths.append(ckpt + ".index")
+    h = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            h.update(f.read())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def available_memory():
+    """Returns the bytes of memory available to new allocations, or None if unknown"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+@lru_cache(maxsize=None)
+def gpu_memory():
+    """Returns the bytes of memory TensorFlow may allocate on the smallest visible
+    GPU, or None when no GPU is visible"""
+    from tensorflow.python.client import device_lib
+
+    limits = [
+        device.memory_limit
+        for device in device_lib.list_local_devices()
+        if device.device_type == "GPU"
+    ]
+    return min(limits) if limits else None
+
+
+def estimate_row_memory(hparams, context_length, length):
+    """
+    Rough peak bytes one batch row needs while generating
+
+    Dominated by the attention keys and values of every layer, which are copied
+    once per step as they grow, and by the logits of every context position that
+    the model computes while reading the prompt.
+    """
+    total_length = context_length + length
+    past = hparams.n_layer * 2 * hparams.n_embd * 4 * total_length
+    logits = hparams.n_vocab * 4 * context_length
+    attention = hparams.n_head * context_length * context_length * 4 * 2
+    hidden = hparams.n_embd * 4 * context_length * 8
+    return 2 * past + logits + attention + hidden
+
+
+def auto_batch_size(hparams, context_length, length, memory=None,
+                    memory_fraction=DEFAULT_MEMORY_FRACTION,
+                    max_batch_size=MAX_AUTO_BATCH_SIZE):
+    """Largest batch size whose estimated memory fits in `memory_fraction` of the
+    memory of the GPU, or of the available host memory when there is no GPU,
+    between 1 and `max_batch_size`"""
+    if memory is None:
+        memory = gpu_memory()
+    if memory is None:
+        memory = available_memory()
+    if memory is None:
+        return 1
+    row = estimate_row_memory(hparams, context_length, length)
+    return int(max(1, min(max_batch_size, memory * memory_fraction // row)))
+
+
+class _SampleState:
+    __slots__ = ("text", "words", "in_word", "stops_from")
+
+    def __init__(self):
+        self.text = bytearray()
+        self.words = 0
+        self.in_word = False
+        # Offset of word `min_words`, where stop sequences are searched from
+        self.stops_from = None
+
+
+class StopCriteria:
+    """
+    Decides when a sample is done, so generation can stop early
+
+    A sample is done once it contains one of `stop_sequences` or once it would
+    start word `max_words + 1`. Until a sample has `min_words` words stop
+    sequences are ignored and the model is not allowed to sample the end of text
+    token, so articles aren't cut short. Stop sequences only count from the start
+    of word `min_words` on.
+
+    Parameters
+    ----------
+    stop_sequences : iterable of str
+        Text ending a sample, searched for in the generated text only
+    min_words, max_words : int, optional
+        Word count bounds of a sample
+    """
+
+    def __init__(self, stop_sequences=DEFAULT_STOP_SEQUENCES, min_words=None,
+                 max_words=None):
+        self.stop_sequences = tuple(s for s in stop_sequences if s)
+        self._stop_bytes = tuple(s.encode("utf-8") for s in self.stop_sequences)
+        self.min_words = min_words or 0
+        self.max_words = max_words
+        if max_words is not None and max_words < self.min_words:
+            raise ValueError(f"max_words {max_words} is less than min_words {min_words}")
+
+    def __bool__(self):
+        return bool(self._stop_bytes or self.min_words or self.max_words is not None)
+
+    def new_state(self):
+        state = _SampleState()
+        if not self.min_words:
+            state.stops_from = 0
+        return state
+
+    def update(self, state, data):
+        """Add the bytes of one sampled token to a sample, returns whether the
+        sample is done"""
+        start = len(state.text)
+        state.text += data
+        for i, b in enumerate(data):
+            if b in _WHITESPACE:
+                state.in_word = False
+            elif not state.in_word:
+                if state.words == self.max_words:
+                    return True
+                state.words += 1
+                state.in_word = True
+                if state.words == self.min_words:
+                    state.stops_from = start + i
+        if state.stops_from is None:
+            return False
+        for stop in self._stop_bytes:
+            search_from = max(state.stops_from, start - len(stop) + 1)
+            if state.text.find(stop, search_from) != -1:
+                return True
+        return False
+
+    def truncate(self, text):
+        """Cut generated text before its first stop sequence from word `min_words`
+        on and after `max_words` words"""
+        stops_from = 0
+        if self.min_words:
+            stops_from = len(text)
+            for n, match in enumerate(_WORD.finditer(text), 1):
+                if n == self.min_words:
+                    stops_from = match.start()
+                    break
+        for stop in self.stop_sequences:
+            i = text.find(stop, stops_from)
+            if i != -1:
+                text = text[:i]
+        if self.max_words is not None:
+            for n, match in enumerate(_WORD.finditer(text)):
+                if n == self.max_words:
+                    text = text[:match.start()].rstrip()
+                    break
+        return text
+
+
+class GenerationEngine:
+    """
+    Batched sampling from a model loaded into a session with `gpt2.load_gpt2`
+
+    Unlike `gpt2.generate`, which builds a fixed batch size sampling loop into the
+    graph, the engine runs one forward pass per step from Python. The attention
+    keys and values ("past") stay on the device between steps as session tensor
+    handles, so every step only copies the sampled tokens back to the host, and
+    each batch can have any size.
+
+    Rows finish early when given `StopCriteria`, and are dropped from the batch
+    so the remaining steps only run the rows still generating.
+
+    Contexts are not run through the model in full for every row. The tokens
+    shared by every context of a batch are run once, continuing from the longest
+    matching prefix of an earlier batch when one is cached, then every distinct
+    context is run once and its past copied to each of its samples.
+
+    Parameters
+    ----------
+    sess : tf.Session
+        Session the model was loaded into
+    run_name, checkpoint_dir, model_name, model_dir
+        Same as for `gpt2.load_gpt2`, used to find the encoder and hyperparameters
+    seed : int
+        Graph level random seed for sampling
+    share_prefixes : bool
+        Reuse the past of shared context prefixes as described above
+    prefix_cache_size : int
+        Number of prefix pasts kept for later batches
+    """
+
+    def __init__(self, sess, run_name="run1", checkpoint_dir="checkpoint",
+                 model_name=None, model_dir="models", seed=None, share_prefixes=True,
+                 prefix_cache_size=DEFAULT_PREFIX_CACHE_SIZE):
+        self.sess = sess
+        self.checkpoint_path = checkpoint_path_for(
+            run_name, checkpoint_dir, model_name, model_dir
+        )
+        self.enc = encoder.get_encoder(self.checkpoint_path)
+        self.hparams = load_hparams(self.checkpoint_path)
+        self.seed = seed
+        self._checkpoint_hash = None
+        self._step_ops = None
+        self.share_prefixes = share_prefixes
+        self.prefix_cache_size = prefix_cache_size
+        self._prefix_cache = OrderedDict()
+        self._end_token = self.enc.encoder.get(END_TOKEN)
+        self._token_bytes = None
+        with sess.graph.as_default():
+            if seed is not None:
+                tf.compat.v1.set_random_seed(seed)
+            self._build_prefill()
+
+    @property
+    def checkpoint_hash(self):
+        if self._checkpoint_hash is None:
+            self._checkpoint_hash = checkpoint_hash(self.checkpoint_path)
+        return self._checkpoint_hash
+
+    @property
+    def max_length(self):
+        """Longest context plus generated tokens the model can attend to"""
+        return self.hparams.n_ctx - 1
+
+    def check_context_length(self, context_length, name="Context"):
+        """Raise a ValueError unless a context of `context_length` tokens leaves
+        room for at least one generated token"""
+        if context_length == 0:
+            raise ValueError(f"{name} is empty")
+        if context_length >= self.max_length:
+            raise ValueError(
+                f"{name} is {context_length} tokens long, the model can only continue "
+                f"contexts of up to {self.max_length - 1} tokens"
+            )
+
+    def _sample_op(self, lm_output):
+        # Rows flagged in suppress_end can't sample the end of text token
+        logits = lm_output["logits"][:, -1, : self.hparams.n_vocab]
+        suppress_end = tf.compat.v1.placeholder_with_default(
+            tf.zeros(tf.shape(logits)[:1], tf.bool), [None], name="suppress_end"
+        )
+        if self._end_token is not None:
+            end = tf.one_hot(self._end_token, self.hparams.n_vocab)
+            logits -= 1e10 * tf.cast(suppress_end, tf.float32)[:, None] * end
+        logits = logits / tf.cast(self._temperature, tf.float32)
+        logits = tf.cond(
+            pred=self._top_p > 0.0,
+            true_fn=lambda: sample.top_p_logits(logits, p=self._top_p),
+            false_fn=lambda: sample.top_k_logits(logits, k=self._top_k),
+        )
+        samples = tf.random.categorical(logits, num_samples=1, dtype=tf.int32)
+        return tf.squeeze(samples, axis=[1]), suppress_end
+
+    def _build_prefill(self):
+        v1 = tf.compat.v1
+        with v1.name_scope("generation_engine"):
+            self._context = v1.placeholder(tf.int32, [None, None], name="context")
+            self._temperature = v1.placeholder_with_default(1.0, [], name="temperature")
+            self._top_k = v1.placeholder_with_default(0, [], name="top_k")
+            self._top_p = v1.placeholder_with_default(0.0, [], name="top_p")
+            lm_output = model.model(
+                hparams=self.hparams, X=self._context, reuse=v1.AUTO_REUSE
+            )
+            self._prefill_past = v1.get_session_handle(lm_output["present"])
+            self._prefill_next, self._prefill_suppress = self._sample_op(lm_output)
+
+    def _build_step(self, handle):
+        # Session tensors have to be read on the device they were stored on, which
+        # is only known once the first one exists
+        v1 = tf.compat.v1
+        with self.sess.graph.as_default(), v1.name_scope("generation_engine"):
+            past_shape = model.past_shape(hparams=self.hparams)
+            past_holder, past = v1.get_session_tensor(handle.handle, tf.float32)
+            past.set_shape(past_shape)
+            lm_output = model.model(
+                hparams=self.hparams, X=self._context, past=past, reuse=v1.AUTO_REUSE
+            )
+            step_past = v1.get_session_handle(
+                tf.concat([past, lm_output["present"]], axis=-2)
+            )
+            step_next, step_suppress = self._sample_op(lm_output)
+
+            gather_holder, gather_past = v1.get_session_tensor(handle.handle, tf.float32)
+            gather_past.set_shape(past_shape)
+            indices = v1.placeholder(tf.int32, [None], name="indices")
+            gather_length = v1.placeholder_with_default(
+                tf.shape(gather_past)[-2], [], name="gather_length"
+            )
+            gathered = v1.get_session_handle(
+                tf.gather(gather_past, indices)[:, :, :, :, :gather_length]
+            )
+        self._step_ops = {
+            "past_holder": past_holder,
+            "past": step_past,
+            "next": step_next,
+            "suppress_end": step_suppress,
+            "gather_holder": gather_holder,
+            "indices": indices,
+            "gather_length": gather_length,
+            "gathered": gathered,
+        }
+
+    def _feed(self, tokens, temperature, top_k, top_p):
+        return {
+            self._context: tokens,
+            self._temperature: temperature,
+            self._top_k: top_k,
+            self._top_p: top_p,
+        }
+
+    def prefill(self, tokens, temperature=0.7, top_k=0, top_p=0.0, suppress_end=None):
+        """
+        Run the model over a batch of equal length contexts, `suppress_end` flags
+        the rows that must not sample the end of text token
+
+        Returns
+        -------
+        past : tf TensorHandle
+            Handle to the keys and values of every context position
+        next_tokens : numpy.ndarray
+            One token sampled after each context
+        """
+        feed = self._feed(tokens, temperature, top_k, top_p)
+        if suppress_end is not None:
+            feed[self._prefill_suppress] = suppress_end
+        past, next_tokens = self.sess.run(
+            [self._prefill_past, self._prefill_next], feed_dict=feed
+        )
+        if self._step_ops is None:
+            self._build_step(past)
+        return past, next_tokens
+
+    def step(self, past, tokens, temperature=0.7, top_k=0, top_p=0.0,
+             suppress_end=None):
+        """Continue every row of `past` with `tokens`, a [batch, n] array, and
+        sample one token after them. Returns the extended past and the tokens."""
+        ops = self._step_ops
+        feed = self._feed(tokens, temperature, top_k, top_p)
+        feed[ops["past_holder"]] = past.handle
+        if suppress_end is not None:
+            feed[ops["suppress_end"]] = suppress_end
+        return self.sess.run([ops["past"], ops["next"]], feed_dict=feed)
+
+    def gather(self, past, indices, length=None):
+        """Returns a past holding the rows `indices` of `past`, in that order,
+        optionally truncated to its first `length` positions"""
+        ops = self._step_ops
+        feed = {ops["gather_holder"]: past.handle, ops["indices"]: indices}
+        if length is not None:
+            feed[ops["gather_length"]] = length
+        return self.sess.run(ops["gathered"], feed_dict=feed)
+
+    def prefix_past(self, prefix):
+        """
+        Returns the past of a single row holding `prefix`
+
+        The past is built from the cached prefix sharing the most leading tokens
+        with `prefix`, and cached itself.
+        """
+        prefix = tuple(int(t) for t in prefix)
+        best, best_length = None, 0
+        for key in self._prefix_cache:
+            length = common_prefix_length(key, prefix)
+            if length > best_length:
+                best, best_length = key, length
+        if best_length == len(prefix) == len(best):
+            self._prefix_cache.move_to_end(best)
+            return self._prefix_cache[best]
+        if best_length == 0:
+            past, _ = self.prefill([prefix])
+        else:
+            past = self.gather(self._prefix_cache[best], [0], best_length)
+            if best_length < len(prefix):
+                past, _ = self.step(past, [prefix[best_length:]])
+        if self.prefix_cache_size > 0:
+            self._prefix_cache[prefix] = past
+            while len(self._prefix_cache) > self.prefix_cache_size:
+                self._prefix_cache.popitem(last=False)
+        return past
+
+    def clear_prefix_cache(self):
+        """Release the cached prefix pasts, which must happen before the session
+        is closed"""
+        self._prefix_cache.clear()
+
+    def context_past(self, contexts):
+        """
+        Returns the past of every context but its last token, running the tokens
+        shared by several rows through the model only once
+
+        Parameters
+        ----------
+        contexts : numpy.ndarray
+            [batch, context_length] token ids, context_length at least 2
+        """
+        unique, rows = np.unique(contexts[:, :-1], axis=0, return_inverse=True)
+        rows = rows.reshape(-1)
+        mismatch = (unique != unique[0]).any(axis=0)
+        shared = int(mismatch.argmax()) if mismatch.any() else unique.shape[1]
+        if shared == 0:
+            past, _ = self.prefill(unique)
+        else:
+            past = self.gather(self.prefix_past(unique[0, :shared]), [0] * len(unique))
+            if shared < unique.shape[1]:
+                past, _ = self.step(past, unique[:, shared:])
+        if len(unique) < len(contexts):
+            past = self.gather(past, rows)
+        return past
+
+    def token_bytes(self, token):
+        """The raw bytes a token decodes to"""
+        if self._token_bytes is None:
+            byte_decoder = self.enc.byte_decoder
+            self._token_bytes = {
+                t: bytes(byte_decoder[c] for c in s) for t, s in self.enc.decoder.items()
+            }
+        return self._token_bytes[token]
+
+    def _suppress_end(self, stop, states, rows):
+        if stop is None or not stop.min_words or self._end_token is None:
+            return None
+        return np.array([states[r].words < stop.min_words for r in rows])
+
+    def generate_tokens(self, contexts, length, temperature=0.7, top_k=0, top_p=0.0,
+                        stop=None):
+        """
+        Sample up to `length` tokens after each of a batch of equal length contexts
+
+        `length` is clamped to the tokens left in the model's context window.
+
+        Parameters
+        ----------
+        contexts : array_like
+            [batch, context_length] token ids, see `check_context_length`
+        stop : StopCriteria, optional
+            Rows whose sample is done stop early and are dropped from the batch
+
+        Returns
+        -------
+        tokens : list of numpy.ndarray
+            Sampled token ids of each row, `length` of them unless the row stopped
+        """
+        contexts = np.asarray(contexts, dtype=np.int32)
+        if contexts.ndim != 2:
+            raise ValueError("Expected a [batch, context_length] array of contexts")
+        self.check_context_length(contexts.shape[1])
+        if length < 1:
+            raise ValueError(f"length must be at least 1, got {length}")
+        length = min(length, self.max_length - contexts.shape[1])
+        batch = contexts.shape[0]
+        out = np.empty((batch, length), dtype=np.int32)
+        lengths = np.full(batch, length)
+        if not stop:
+            stop = None
+        # Original row of each row still generating
+        rows = np.arange(batch)
+        states = [stop.new_state() for _ in rows] if stop is not None else None
+        suppress_end = self._suppress_end(stop, states, rows)
+        if self.share_prefixes and contexts.shape[1] > 1:
+            if self._step_ops is None:
+                # The step graph is built from the first prefilled past
+                self.prefill(contexts[:1, :1])
+            past, next_tokens = self.step(
+                self.context_past(contexts), contexts[:, -1:], temperature, top_k, top_p,
+                suppress_end,
+            )
+        else:
+            past, next_tokens = self.prefill(
+                contexts, temperature, top_k, top_p, suppress_end
+            )
+        for i in range(length):
+            out[rows, i] = next_tokens
+            if stop is not None:
+                done = np.array([
+                    stop.update(states[r], self.token_bytes(t))
+                    for r, t in zip(rows, next_tokens)
+                ])
+                if done.any():
+                    lengths[rows[done]] = i + 1
+                    keep = np.flatnonzero(~done)
+                    if len(keep) == 0:
+                        break
+                    if i + 1 < length:
+                        past = self.gather(past, keep)
+                    rows, next_tokens = rows[keep], next_tokens[keep]
+            if i + 1 < length:
+                past, next_tokens = self.step(
+                    past, next_tokens[:, None], temperature, top_k, top_p,
+                    self._suppress_end(stop, states, rows),
+                )
+        return [out[r, :lengths[r]] for r in range(batch)]
+
+    def decode_sample(self, context_tokens, tokens, stop=None):
+        """Decode a sample the way `gpt2.generate` does with its prefix included,
+        with the generated text truncated by `stop`"""
+        text = self.enc.decode(context_tokens[:1]) + self.enc.decode(
+            list(context_tokens[1:]) + list(tokens)
+        )
+        if stop:
+            prompt = self.enc.decode(context_tokens[:1]) + self.enc.decode(
+                list(context_tokens[1:])
+            )
+            if text.startswith(prompt):
+                text = prompt + stop.truncate(text[len(prompt):])
+            else:
+                text = prompt + stop.truncate(self.enc.decode(list(tokens)))
+        return text.lstrip("\n")
+
+
+def common_prefix_length(*sequences):
+    """Returns the number of leading tokens all `sequences` share"""
+    if not sequences:
+        return 0
+    length = min(len(seq) for seq in sequences)
+    first = sequences[0]
+    for seq in sequences[1:]:
+        for i in range(length):
+            if seq[i] != first[i]:
+                length = i
+                break
+    return length
+
+
+def plan_batches(prompt_tokens, nsamples, batch_size):
+    """
+    Split the samples of every prompt into batches
+
+    Rows in a batch must have contexts of the same length, since the model has no
+    padding mask, so each batch holds samples of one or more prompts that encode to
+    the same number of tokens. Prompts are batched in order of first appearance.
+
+    Parameters
+    ----------
+    prompt_tokens : list of list of int
+        Encoded prompts
+    nsamples : int
+        Samples to generate per prompt
+    batch_size : int or callable
+        Rows per batch, or a function of the context length returning it
+
+    Returns
+    -------
+    batches : list of list of (int, int)
+        (prompt index, sample index) of each row
+    """
+    by_length = OrderedDict()
+    for i, tokens in enumerate(prompt_tokens):
+        rows = by_length.setdefault(len(tokens), [])
+        rows.extend((i, j) for j in range(nsamples))
+    batches = []
+    for context_length, rows in by_length.items():
+        size = batch_size(context_length) if callable(batch_size) else batch_size
+        size = max(1, size)
+        batches.extend(rows[k:k + size] for k in range(0, len(rows), size))
+    return batches
+
+
+def format_samples(samples, sample_delim=DEFAULT_SAMPLE_DELIM):
+    """Join samples the way `gpt2.generate_to_file` writes them"""
+    if len(samples) == 1:
+        sample_delim = ""
+    return "".join("{}\n{}".format(text, sample_delim) for text in samples)
+
+
+def iter_generated(engine, prompts, nsamples=5, batch_size=None, length=1023,
+                   temperature=0.7, top_k=0, top_p=0.0, window=DEFAULT_PROMPT_WINDOW,
+                   stop=None, cache=None, refresh=False):
+    """
+    Generate `nsamples` samples for each prompt
+
+    Prompts are read lazily, `window` at a time, and the samples of the prompts in
+    one window are batched together.
+
+    Parameters
+    ----------
+    engine : GenerationEngine
+    prompts : iterable of (key, str)
+        Prompts with any key identifying them, e.g. an output file name
+    batch_size : int
+        Rows per forward pass, or None to pick the largest batch that fits in the
+        available memory for each context length
+    stop : StopCriteria, optional
+        Ends samples early and truncates them, see `GenerationEngine.generate_tokens`
+    cache : gpt_2.generation_cache.GenerationCache, optional
+        Prompts already generated with the same model and parameters are yielded
+        from the cache, and a prompt repeated within a window is generated once
+    refresh : bool
+        Regenerate cached prompts, replacing their cached samples
+
+    Yields
+    ------
+    key
+        Key of a prompt, as soon as all of its samples are done
+    samples : list of str
+        Its decoded samples
+    """
+    if batch_size is None:
+        def batch_size(context_length):
+            return auto_batch_size(
+                engine.hparams,
+                context_length,
+                min(length, engine.max_length - context_length),
+            )
+    if cache is not None:
+        params = {
+            "nsamples": nsamples,
+            "length": length,
+            "temperature": temperature,
+            "top_k": top_k,
+            "top_p": top_p,
+            "seed": engine.seed,
+            "stop": [stop.stop_sequences, stop.min_words, stop.max_words]
+            if stop else None,
+        }
+    prompts = iter(prompts)
+    while True:
+        window_prompts = list(itertools.islice(prompts, window))
+        if not window_prompts:
+            return
+        # Keys sharing each distinct prompt to generate, and its cache key
+        keys = []
+        prompt_tokens = []
+        cache_keys = []
+        pending = {}
+        for key, prompt in window_prompts:
+            cache_key = None
+            if cache is not None:
+                cache_key = cache.key(engine.checkpoint_hash, prompt, params)
+                if cache_key in pending:
+                    keys[pending[cache_key]].append(key)
+                    continue
+                samples = None if refresh else cache.get(cache_key)
+                if samples is not None:
+                    yield key, samples
+                    continue
+                pending[cache_key] = len(keys)
+            tokens = engine.enc.encode(prompt)
+            engine.check_context_length(len(tokens), f"Prompt {key!r}")
+            keys.append([key])
+            prompt_tokens.append(tokens)
+            cache_keys.append(cache_key)
+        results = [[None] * nsamples for _ in keys]
+        remaining = [nsamples] * len(keys)
+        for batch in plan_batches(prompt_tokens, nsamples, batch_size):
+            contexts = [prompt_tokens[i] for i, _ in batch]
+            out = engine.generate_tokens(
+                contexts, length, temperature, top_k, top_p, stop
+            )
+            for (i, j), tokens in zip(batch, out):
+                results[i][j] = engine.decode_sample(prompt_tokens[i], tokens, stop)
+                remaining[i] -= 1
+                if remaining[i] == 0:
+                    if cache is not None:
+                        cache.put(cache_keys[i], results[i])
+                    for key in keys[i]:
+                        yield key, results[i]
+                    results[i] = None
+
+
+def generate_to_files(engine, prompts, output_dir, nsamples=5, batch_size=None,
+                      length=1023, temperature=0.7, top_k=0, top_p=0.0,
+                      sample_delim=DEFAULT_SAMPLE_DELIM, stop=None, cache=None,
+                      refresh=False, stage=None):
+    """
+    Generate `nsamples` samples for each prompt and write them to
+    `output_dir/<file_name>` in the same format as `gpt2.generate_to_file`
+
+    Parameters
+    ----------
+    engine : GenerationEngine
+    prompts : iterable of (str, str)
+        (file_name, prompt) pairs
+    batch_size : int
+        See `iter_generated`
+    stop, cache, refresh
+        See `iter_generated`
+    stage : gpt_2.instrumentation.StageMetrics, optional
+        Records every file written, with the time since the previous one, and the
+        hits and misses of `cache`
+
+    Returns
+    -------
+    paths : list of str
+        The files written, in the order they were finished
+    """
+    paths = []
+    hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    last = time.perf_counter()
+    for file_name, samples in iter_generated(
+        engine, prompts, nsamples, batch_size, length, temperature, top_k, top_p,
+        stop=stop, cache=cache, refresh=refresh,
+    ):
+        path = os.path.join(output_dir, file_name)
+        text = format_samples(samples, sample_delim)
+        with open(path, "w") as f:
+            f.write(text)
+        paths.append(path)
+        if stage is not None:
+            now = time.perf_counter()
+            stage.record_item(
+                file_name, now - last, bytes_out=len(text.encode("utf-8")),
+                samples=len(samples),
+            )
+            last = now
+    if stage is not None and cache is not None:
+        stage.record_cache(cache.hits - hits, cache.misses - misses)
+    return paths
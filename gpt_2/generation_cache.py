@@ -0,0 +1,122 @@
+import hashlib
+import json
+import pathlib
+import sqlite3
+import time
+
+SCRIPT_DIR = pathlib.Path(__file__).parent.absolute()
+DEFAULT_GENERATION_CACHE = SCRIPT_DIR.joinpath(
+    "..", "data", "interim", "cache", "generation_cache.sqlite"
+)
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+
+class GenerationCache:
+    """
+    Disk-backed memoization of generated samples
+
+    The samples of a prompt are stored in an SQLite database keyed by a hash of
+    the model checkpoint, the rendered prompt and the sampling parameters, so
+    retraining the model or changing any parameter is a cache miss. Once the
+    stored samples take more than `max_bytes` the least recently used entries are
+    deleted. Several processes can share one database.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Location of the SQLite database
+    max_bytes : int
+        Size bound of the stored samples
+    """
+
+    def __init__(self, path=DEFAULT_GENERATION_CACHE, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = pathlib.Path(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS samples ("
+                "key TEXT PRIMARY KEY, samples TEXT, size INTEGER, last_used REAL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS samples_last_used ON samples (last_used)"
+            )
+
+    @staticmethod
+    def key(checkpoint_hash, prompt, params):
+        """
+        Parameters
+        ----------
+        checkpoint_hash : str
+            See `gpt_2.generation.checkpoint_hash`
+        prompt : str
+        params : dict
+            JSON serializable sampling parameters
+        """
+        h = hashlib.sha256()
+        for part in (checkpoint_hash, prompt, json.dumps(params, sort_keys=True)):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def get(self, key):
+        """Returns the cached list of samples, or None on a miss"""
+        row = self._conn.execute(
+            "SELECT samples FROM samples WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        with self._conn:
+            self._conn.execute(
+                "UPDATE samples SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+        return json.loads(row[0])
+
+    def put(self, key, samples):
+        data = json.dumps(samples)
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?)",
+                (key, data, len(data.encode("utf-8")), time.time()),
+            )
+        self.evict()
+
+    def evict(self):
+        """
+        Delete the least recently used entries until the cache fits in `max_bytes`
+
+        Returns
+        -------
+        count : int
+            Number of entries deleted
+        """
+        with self._conn:
+            (total,) = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM samples"
+            ).fetchone()
+            if total <= self.max_bytes:
+                return 0
+            keys = []
+            for key, size in self._conn.execute(
+                "SELECT key, size FROM samples ORDER BY last_used"
+            ):
+                if total <= self.max_bytes:
+                    break
+                keys.append((key,))
+                total -= size
+            self._conn.executemany("DELETE FROM samples WHERE key = ?", keys)
+        return len(keys)
+
+    def stats(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"{self.hits} hits, {self.misses} misses ({rate:.0%} hit rate)"
+
+    def close(self):
+        self._conn.close()
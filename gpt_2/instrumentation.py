@@ -0,0 +1,300 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import resource
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+DEFAULT_PROFILE_TOP = 25
+PROMETHEUS_PREFIX = "gpt2"
+
+
+def peak_rss(who=resource.RUSAGE_SELF):
+    """Peak resident set size in bytes of this process, or of its waited for
+    children with `resource.RUSAGE_CHILDREN`"""
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss * 1024
+
+
+class StageMetrics:
+    """
+    Counters of one stage of a run, e.g. downloading documents
+
+    Every method is thread safe, so worker threads can record into one stage.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage
+    keep_items : bool
+        Keep a record of every item besides the totals, which grows with the
+        number of items
+    """
+
+    def __init__(self, name, keep_items=True):
+        self.name = name
+        self.keep_items = keep_items
+        self.items = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.wall_time = 0.0
+        self.peak_rss = 0
+        self.item_records = []
+        self._lock = threading.Lock()
+
+    def record_item(self, name, seconds, bytes_in=0, bytes_out=0, **fields):
+        """
+        Count one item processed by the stage
+
+        Parameters
+        ----------
+        name : str
+            Identifies the item, e.g. a file name
+        seconds : float
+            Time spent on the item
+        bytes_in, bytes_out : int
+            Size of the item's input and output
+        fields
+            Any other JSON serializable values to record with the item
+        """
+        record = None
+        if self.keep_items:
+            record = {"name": name, "seconds": round(seconds, 6)}
+            if bytes_in:
+                record["bytes_in"] = bytes_in
+            if bytes_out:
+                record["bytes_out"] = bytes_out
+            record.update(fields)
+        with self._lock:
+            self.items += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            if record is not None:
+                self.item_records.append(record)
+
+    def record_items(self, count):
+        """Count items processed by the stage without timing or sizing them"""
+        with self._lock:
+            self.items += count
+
+    def record_error(self, count=1):
+        with self._lock:
+            self.errors += count
+
+    def record_cache(self, hits=0, misses=0):
+        with self._lock:
+            self.cache_hits += hits
+            self.cache_misses += misses
+
+    @property
+    def items_per_second(self):
+        return self.items / self.wall_time if self.wall_time else 0.0
+
+    def summary(self):
+        return (
+            f"{self.name}: {self.items} items in {self.wall_time:.2f} s "
+            f"({self.items_per_second:.1f} items/s), {self.errors} errors, "
+            f"peak RSS {self.peak_rss / 2**20:.0f} MiB"
+        )
+
+    def to_dict(self, items=True):
+        d = OrderedDict(
+            wall_time=round(self.wall_time, 6),
+            items=self.items,
+            items_per_second=round(self.items_per_second, 3),
+            errors=self.errors,
+            bytes_in=self.bytes_in,
+            bytes_out=self.bytes_out,
+            cache_hits=self.cache_hits,
+            cache_misses=self.cache_misses,
+            peak_rss=self.peak_rss,
+        )
+        if items and self.keep_items:
+            d["item_records"] = self.item_records
+        return d
+
+
+class Metrics:
+    """
+    Timings, rates, sizes, cache statistics and memory use of the stages of a run
+
+    Parameters
+    ----------
+    run : str
+        Name of the run, e.g. the CLI
+    keep_items : bool
+        Keep a record of every item of every stage, see `StageMetrics`
+    """
+
+    def __init__(self, run, keep_items=True):
+        self.run = run
+        self.keep_items = keep_items
+        self.stages = OrderedDict()
+        self._start = time.time()
+
+    @contextmanager
+    def stage(self, name):
+        """Time the with block as stage `name`, yielding its `StageMetrics`"""
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = StageMetrics(name, self.keep_items)
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.wall_time += time.perf_counter() - start
+            stage.peak_rss = peak_rss()
+            logger.info(stage.summary())
+
+    def to_dict(self, items=True):
+        return OrderedDict(
+            run=self.run,
+            started=self._start,
+            wall_time=round(time.time() - self._start, 6),
+            peak_rss=peak_rss(),
+            children_peak_rss=peak_rss(resource.RUSAGE_CHILDREN),
+            stages=OrderedDict(
+                (name, stage.to_dict(items)) for name, stage in self.stages.items()
+            ),
+        )
+
+    def write_json(self, path):
+        """Write every metric, including the record of each item when they are
+        kept, to a JSON file"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_path, path)
+
+    def prometheus_text(self):
+        """The per-stage totals in the Prometheus text exposition format"""
+        d = self.to_dict(items=False)
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            name = f"{PROMETHEUS_PREFIX}_{name}"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}")
+
+        run = {"run": self.run}
+        metric("run_wall_seconds", "gauge", "Wall time of the run", [(run, d["wall_time"])])
+        metric("peak_rss_bytes", "gauge", "Peak resident set size", [
+            (dict(run, process="self"), d["peak_rss"]),
+            (dict(run, process="children"), d["children_peak_rss"]),
+        ])
+        for key, name, kind, help_text in (
+            ("wall_time", "wall_seconds", "gauge", "Wall time of a stage"),
+            ("items", "items_total", "counter", "Items processed by a stage"),
+            ("items_per_second", "items_per_second", "gauge",
+             "Items processed per second of wall time"),
+            ("errors", "errors_total", "counter", "Items a stage failed on"),
+            ("bytes_in", "read_bytes_total", "counter", "Bytes read by a stage"),
+            ("bytes_out", "written_bytes_total", "counter", "Bytes written by a stage"),
+            ("cache_hits", "cache_hits_total", "counter", "Cache hits of a stage"),
+            ("cache_misses", "cache_misses_total", "counter", "Cache misses of a stage"),
+        ):
+            metric(f"stage_{name}", kind, help_text, [
+                (dict(run, stage=stage_name), stage[key])
+                for stage_name, stage in d["stages"].items()
+            ])
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+
+def configure_logging(level="INFO"):
+    logging.basicConfig(format=LOG_FORMAT, level=getattr(logging, level.upper()))
+
+
+def add_instrumentation_arguments(parser):
+    """Add the logging, metrics and profiling options `instrumented` reads"""
+    group = parser.add_argument_group("instrumentation")
+    group.add_argument(
+        "--log-level",
+        default="INFO",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        help="DEBUG also logs every item",
+    )
+    group.add_argument(
+        "--metrics", default="", help="Write timings, rates and sizes to this JSON file"
+    )
+    group.add_argument(
+        "--prometheus",
+        default="",
+        help="Write per-stage totals to this file in the Prometheus text format",
+    )
+    group.add_argument(
+        "--profile",
+        nargs="?",
+        const="-",
+        default="",
+        help="Run under cProfile and log the hottest functions, also saving the "
+        "profile to this file when given",
+    )
+    group.add_argument(
+        "--profile-top",
+        type=int,
+        default=DEFAULT_PROFILE_TOP,
+        help="Number of functions --profile logs",
+    )
+
+
+def format_profile(profile, top=DEFAULT_PROFILE_TOP):
+    """The `top` functions of a profile by cumulative and by own time"""
+    out = io.StringIO()
+    stats = pstats.Stats(profile, stream=out)
+    stats.sort_stats("cumulative").print_stats(top)
+    stats.sort_stats("tottime").print_stats(top)
+    return out.getvalue()
+
+
+@contextmanager
+def instrumented(args, run):
+    """
+    Set up logging and optionally profile the with block, then write the metrics
+    requested by the options `add_instrumentation_arguments` added
+
+    Yields
+    ------
+    metrics : Metrics
+        For the CLI to record its stages into
+    """
+    configure_logging(args.log_level)
+    # Only the JSON metrics hold the record of each item
+    metrics = Metrics(run, keep_items=bool(args.metrics))
+    profile = cProfile.Profile() if args.profile else None
+    if profile is not None:
+        profile.enable()
+    try:
+        yield metrics
+    finally:
+        if profile is not None:
+            profile.disable()
+            if args.profile != "-":
+                profile.dump_stats(args.profile)
+                logger.info("Saved profile to %s", args.profile)
+            logger.info("Hottest functions:\n%s", format_profile(profile, args.profile_top))
+        if args.metrics:
+            metrics.write_json(args.metrics)
+            logger.info("Saved metrics to %s", args.metrics)
+        if args.prometheus:
+            metrics.write_prometheus(args.prometheus)
+            logger.info("Saved Prometheus metrics to %s", args.prometheus)
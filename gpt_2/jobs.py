@@ -0,0 +1,503 @@
+import argparse
+import json
+import logging
+import pathlib
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+from gpt_2.instrumentation import add_instrumentation_arguments, instrumented
+
+logger = logging.getLogger(__name__)
+
+SCRIPT_DIR = pathlib.Path(__file__).parent.absolute()
+DEFAULT_JOBS_DB = SCRIPT_DIR.joinpath("..", "data", "interim", "jobs.sqlite")
+JOBS_DB_ENV = "GPT2_JOBS_DB"
+DEFAULT_RUN_NAME = "experiment_3_355M"
+# stop_sequences None stands for gpt_2.generation.DEFAULT_STOP_SEQUENCES
+DEFAULT_PARAMS = {
+    "nsamples": 5,
+    "length": 1023,
+    "temperature": 0.7,
+    "top_k": 0,
+    "top_p": 0.0,
+    "stop_sequences": None,
+    "min_words": None,
+    "max_words": None,
+}
+# A claimed prompt goes back to the queue if its worker doesn't finish or renew it
+# within this many seconds, e.g. because the worker crashed. Workers renew their
+# leases this many times per lease while they generate.
+DEFAULT_LEASE_SECONDS = 15 * 60
+LEASE_RENEWALS = 3
+DEFAULT_PROMPTS_PER_CLAIM = 16
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueue:
+    """
+    SQLite backed queue of bulk generation jobs
+
+    A job is a list of prompts that are generated with the same model and sampling
+    parameters, and every prompt is a separately claimed unit of work. Prompts are
+    claimed with a lease, so the prompts of a worker that crashes are claimed again
+    once their lease expires. Each claim gets its own lease token, and a worker can
+    only renew, complete or fail the prompts it still holds under its token, so a
+    prompt claimed again after its lease expired is only stored once. Several
+    processes can share one database.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Location of the SQLite database
+    """
+
+    def __init__(self, path=DEFAULT_JOBS_DB):
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, run_name TEXT, params TEXT, created REAL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                "job_id TEXT, idx INTEGER, file_name TEXT, prompt TEXT, status TEXT, "
+                "lease_expires REAL, output TEXT, error TEXT, finished REAL, seq INTEGER, "
+                "lease_token TEXT, PRIMARY KEY (job_id, idx))"
+            )
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(tasks)")]
+            if "lease_token" not in columns:
+                # Databases created before claims had tokens
+                self._conn.execute("ALTER TABLE tasks ADD COLUMN lease_token TEXT")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, job_id, idx)"
+            )
+
+    def submit(self, prompts, run_name=DEFAULT_RUN_NAME, params=None):
+        """
+        Queue a job
+
+        Parameters
+        ----------
+        prompts : iterable of (str, str)
+            (file_name, prompt) pairs
+        run_name : str
+            Checkpoint to generate with
+        params : dict
+            Sampling parameters overriding `DEFAULT_PARAMS`
+
+        Returns
+        -------
+        job_id : str
+        """
+        job_id = uuid.uuid4().hex
+        params = dict(DEFAULT_PARAMS, **(params or {}))
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs VALUES (?, ?, ?, ?)",
+                (job_id, run_name, json.dumps(params), time.time()),
+            )
+            self._conn.executemany(
+                "INSERT INTO tasks (job_id, idx, file_name, prompt, status) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    (job_id, i, file_name, prompt, PENDING)
+                    for i, (file_name, prompt) in enumerate(prompts)
+                ),
+            )
+        return job_id
+
+    def job(self, job_id):
+        """Returns the run name and sampling parameters of a job"""
+        row = self._conn.execute(
+            "SELECT run_name, params FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(f"Unknown job {job_id}")
+        return row[0], json.loads(row[1])
+
+    def status(self, job_id):
+        """
+        Returns the progress of a job as a dict with the number of prompts in each
+        state and an overall `status`: queued, running, done, or failed when every
+        prompt finished but some failed
+        """
+        self.job(job_id)
+        counts = dict.fromkeys((PENDING, RUNNING, DONE, FAILED), 0)
+        counts.update(
+            self._conn.execute(
+                "SELECT status, COUNT(*) FROM tasks WHERE job_id = ? GROUP BY status",
+                (job_id,),
+            ).fetchall()
+        )
+        total = sum(counts.values())
+        if counts[PENDING] + counts[RUNNING] == 0:
+            status = FAILED if counts[FAILED] else DONE
+        elif counts[RUNNING] + counts[DONE] + counts[FAILED]:
+            status = RUNNING
+        else:
+            status = "queued"
+        return dict(counts, id=job_id, status=status, total=total)
+
+    def results(self, job_id, after=0):
+        """
+        Yield the finished articles of a job, for incremental downloads
+
+        Prompts are batched by length, so they finish out of order. Every finished
+        prompt gets the next sequence number of its job instead.
+
+        Parameters
+        ----------
+        after : int
+            Only return prompts that finished after this sequence number, e.g. the
+            last one a previous call returned
+
+        Yields
+        ------
+        (seq, file_name, output) of every done prompt in the order they finished
+        """
+        yield from self._conn.execute(
+            "SELECT seq, file_name, output FROM tasks "
+            "WHERE job_id = ? AND status = ? AND seq > ? ORDER BY seq",
+            (job_id, DONE, after),
+        )
+
+    def errors(self, job_id):
+        """Yield (index, file_name, error) of every failed prompt of a job"""
+        yield from self._conn.execute(
+            "SELECT idx, file_name, error FROM tasks "
+            "WHERE job_id = ? AND status = ? ORDER BY idx",
+            (job_id, FAILED),
+        )
+
+    def claim(self, limit=DEFAULT_PROMPTS_PER_CLAIM, lease=DEFAULT_LEASE_SECONDS):
+        """
+        Claim up to `limit` prompts of the oldest job with unclaimed work
+
+        Returns
+        -------
+        job_id : str
+            The job, or None if there is nothing to do
+        tasks : list of (int, str, str)
+            (index, file_name, prompt) of the claimed prompts
+        lease_token : str
+            Identifies the claim to `renew`, `complete` and `fail`, or None if
+            there is nothing to do
+        """
+        now = time.time()
+        lease_token = uuid.uuid4().hex
+        claimable = "(status = ? OR (status = ? AND lease_expires < ?))"
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute(
+                f"SELECT tasks.job_id FROM tasks JOIN jobs ON jobs.id = tasks.job_id "
+                f"WHERE {claimable} ORDER BY jobs.created LIMIT 1",
+                (PENDING, RUNNING, now),
+            ).fetchone()
+            if row is None:
+                self._conn.commit()
+                return None, [], None
+            job_id = row[0]
+            tasks = self._conn.execute(
+                f"SELECT idx, file_name, prompt FROM tasks "
+                f"WHERE job_id = ? AND {claimable} ORDER BY idx LIMIT ?",
+                (job_id, PENDING, RUNNING, now, limit),
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE tasks SET status = ?, lease_expires = ?, lease_token = ? "
+                "WHERE job_id = ? AND idx = ?",
+                ((RUNNING, now + lease, lease_token, job_id, idx) for idx, _, _ in tasks),
+            )
+            self._conn.commit()
+        except BaseException:
+            self._conn.rollback()
+            raise
+        return job_id, tasks, lease_token
+
+    def renew(self, lease_token, lease=DEFAULT_LEASE_SECONDS):
+        """
+        Extend the lease of the prompts of a claim that are still being worked on
+
+        Returns
+        -------
+        count : int
+            Number of prompts still held under `lease_token`
+        """
+        with self._conn:
+            return self._conn.execute(
+                "UPDATE tasks SET lease_expires = ? WHERE lease_token = ? AND status = ?",
+                (time.time() + lease, lease_token, RUNNING),
+            ).rowcount
+
+    def complete(self, job_id, idx, output, lease_token):
+        """
+        Store the output of a claimed prompt
+
+        Returns
+        -------
+        stored : bool
+            False if the prompt is no longer held under `lease_token`, because its
+            lease expired and another worker claimed it, in which case nothing is
+            stored
+        """
+        with self._conn:
+            return self._conn.execute(
+                "UPDATE tasks SET status = ?, output = ?, error = NULL, finished = ?, "
+                "seq = (SELECT COALESCE(MAX(seq), 0) + 1 FROM tasks WHERE job_id = ?) "
+                "WHERE job_id = ? AND idx = ? AND status = ? AND lease_token = ?",
+                (DONE, output, time.time(), job_id, job_id, idx, RUNNING, lease_token),
+            ).rowcount == 1
+
+    def fail(self, job_id, idx, error, lease_token):
+        """Record that a claimed prompt failed, returns False like `complete`"""
+        with self._conn:
+            return self._conn.execute(
+                "UPDATE tasks SET status = ?, error = ?, finished = ? "
+                "WHERE job_id = ? AND idx = ? AND status = ? AND lease_token = ?",
+                (FAILED, error, time.time(), job_id, idx, RUNNING, lease_token),
+            ).rowcount == 1
+
+    def retry_failed(self, job_id):
+        """Queue the failed prompts of a job again. Returns how many there were."""
+        with self._conn:
+            return self._conn.execute(
+                "UPDATE tasks SET status = ?, error = NULL WHERE job_id = ? AND status = ?",
+                (PENDING, job_id, FAILED),
+            ).rowcount
+
+    def close(self):
+        self._conn.close()
+
+
+class LeaseRenewer(threading.Thread):
+    """
+    Renews the lease of a claim every `interval` seconds until stopped
+
+    Runs on a daemon thread with its own database connection, so the lease is kept
+    while a long batch is still generating its first prompt.
+    """
+
+    def __init__(self, queue_path, lease_token, lease=DEFAULT_LEASE_SECONDS,
+                 interval=None):
+        super().__init__(daemon=True)
+        self.queue_path = queue_path
+        self.lease_token = lease_token
+        self.lease = lease
+        self.interval = lease / LEASE_RENEWALS if interval is None else interval
+        self.stop_event = threading.Event()
+
+    def run(self):
+        queue = JobQueue(self.queue_path)
+        try:
+            while not self.stop_event.wait(self.interval):
+                if queue.renew(self.lease_token, self.lease) == 0:
+                    return
+        finally:
+            queue.close()
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+def run_worker(queue, model_manager, batch_size=None, limit=DEFAULT_PROMPTS_PER_CLAIM,
+               lease=DEFAULT_LEASE_SECONDS, poll_interval=5.0, stop_event=None,
+               exit_when_idle=False):
+    """
+    Generate claimed prompts until `stop_event` is set
+
+    Each finished prompt is stored as soon as its samples are done, formatted like
+    a file written by `gpt2.generate_to_file`.
+
+    Parameters
+    ----------
+    queue : JobQueue
+    model_manager : gpt_2.model_manager.ModelManager
+    batch_size : int
+        Passed to `gpt_2.generation.iter_generated`
+    exit_when_idle : bool
+        Return once the queue is empty instead of polling it
+    """
+    from gpt_2.generation import (
+        DEFAULT_STOP_SEQUENCES,
+        StopCriteria,
+        format_samples,
+        iter_generated,
+    )
+
+    while stop_event is None or not stop_event.is_set():
+        job_id, tasks, lease_token = queue.claim(limit, lease)
+        if not tasks:
+            if exit_when_idle:
+                return
+            time.sleep(poll_interval)
+            continue
+        run_name, params = queue.job(job_id)
+        # Jobs submitted before stop conditions existed generate full length
+        stop_sequences = params.pop("stop_sequences", ())
+        stop = StopCriteria(
+            DEFAULT_STOP_SEQUENCES if stop_sequences is None else stop_sequences,
+            params.pop("min_words", None),
+            params.pop("max_words", None),
+        )
+        logger.info("Generating %d prompts of job %s", len(tasks), job_id)
+        unfinished = {idx for idx, _, _ in tasks}
+        renewer = LeaseRenewer(queue.path, lease_token, lease)
+        renewer.start()
+        try:
+            with model_manager.model(run_name) as engine:
+                for idx, samples in iter_generated(
+                    engine,
+                    [(idx, prompt) for idx, _, prompt in tasks],
+                    batch_size=batch_size,
+                    stop=stop,
+                    **params,
+                ):
+                    queue.complete(job_id, idx, format_samples(samples), lease_token)
+                    unfinished.discard(idx)
+        except Exception:
+            error = traceback.format_exc()
+            logger.exception("Generating prompts of job %s failed", job_id)
+            for idx in unfinished:
+                queue.fail(job_id, idx, error, lease_token)
+        finally:
+            renewer.stop()
+
+
+class JobWorker(threading.Thread):
+    """Runs `run_worker` on a daemon thread with its own database connection"""
+
+    def __init__(self, queue_path, model_manager, **kwargs):
+        super().__init__(daemon=True)
+        self.queue_path = queue_path
+        self.model_manager = model_manager
+        self.kwargs = kwargs
+        self.stop_event = threading.Event()
+
+    def run(self):
+        queue = JobQueue(self.queue_path)
+        try:
+            run_worker(queue, self.model_manager, stop_event=self.stop_event, **self.kwargs)
+        finally:
+            queue.close()
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk article generation jobs")
+    parser.add_argument(
+        "--db", type=str, default=DEFAULT_JOBS_DB, help="Path to the job queue database"
+    )
+    add_instrumentation_arguments(parser)
+    subparsers = parser.add_subparsers(dest="command")
+
+    submit = subparsers.add_parser("submit", help="Queue the prompts of a CSV")
+    submit.add_argument("-c", "--csv", required=True, help="Path to CSV with prompt metadata")
+    submit.add_argument("-m", "--model-name", default=DEFAULT_RUN_NAME)
+    submit.add_argument(
+        "--template", default="default",
+        help="Prompt template name (default, training) or path to a template file",
+    )
+    submit.add_argument("-n", "--nsamples", type=int, default=DEFAULT_PARAMS["nsamples"])
+    submit.add_argument("-l", "--length", type=int, default=DEFAULT_PARAMS["length"])
+    submit.add_argument(
+        "-t", "--temperature", type=float, default=DEFAULT_PARAMS["temperature"]
+    )
+    submit.add_argument(
+        "--stop", action="append",
+        help="Text that ends a sample, can be given more than once. Defaults to the "
+        "end of text marker and the start of another sample or labels block",
+    )
+    submit.add_argument(
+        "--no-stop", action="store_true", help="Generate --length tokens per sample"
+    )
+    submit.add_argument("--min-words", type=int)
+    submit.add_argument("--max-words", type=int)
+
+    status = subparsers.add_parser("status", help="Show the progress of a job")
+    status.add_argument("job_id")
+
+    result = subparsers.add_parser(
+        "result", help="Write the finished articles of a job to a directory"
+    )
+    result.add_argument("job_id")
+    result.add_argument("-o", "--output-dir", required=True)
+    result.add_argument(
+        "--after", type=int, default=0,
+        help="Only write prompts finished after this sequence number, as printed by "
+        "an earlier call",
+    )
+
+    worker = subparsers.add_parser("worker", help="Generate queued prompts")
+    worker.add_argument(
+        "--checkpoint-dir", default=str(SCRIPT_DIR.joinpath("..", "checkpoint"))
+    )
+    worker.add_argument("-b", "--batch-size", type=int, default=0)
+    worker.add_argument(
+        "--exit-when-idle", action="store_true", help="Stop once the queue is empty"
+    )
+    args = parser.parse_args()
+    # add_subparsers only takes required=True from Python 3.7
+    if args.command is None:
+        parser.error("a command is required")
+
+    with instrumented(args, f"jobs_{args.command}") as metrics:
+        run(args, metrics)
+
+
+def run(args, metrics):
+    queue = JobQueue(args.db)
+    if args.command == "submit":
+        from gpt_2.prompts import PromptBuilder, iter_prompts
+
+        params = {
+            "nsamples": args.nsamples,
+            "length": args.length,
+            "temperature": args.temperature,
+            "stop_sequences": [] if args.no_stop else args.stop,
+            "min_words": args.min_words,
+            "max_words": args.max_words,
+        }
+        prompts = iter_prompts(args.csv, PromptBuilder.from_name_or_file(args.template))
+        job_id = queue.submit(prompts, args.model_name, params)
+        print(job_id)
+    elif args.command == "status":
+        print(json.dumps(queue.status(args.job_id), indent=2))
+        for idx, file_name, error in queue.errors(args.job_id):
+            print(f"{idx} {file_name} failed:\n{error}")
+    elif args.command == "result":
+        output_dir = pathlib.Path(args.output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        last = args.after
+        count = 0
+        for seq, file_name, output in queue.results(args.job_id, args.after):
+            output_dir.joinpath(file_name).write_text(output)
+            last = seq
+            count += 1
+        print(f"Wrote {count} articles, continue with --after {last}")
+    elif args.command == "worker":
+        from gpt_2.model_manager import ModelManager
+
+        model_manager = ModelManager.from_env(checkpoint_dir=args.checkpoint_dir)
+        with metrics.stage("worker"):
+            run_worker(
+                queue,
+                model_manager,
+                batch_size=args.batch_size or None,
+                exit_when_idle=args.exit_when_idle,
+            )
+
+
+if __name__ == "__main__":
+    main()
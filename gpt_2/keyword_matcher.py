@@ -0,0 +1,103 @@
+from collections import deque
+
+
+def is_word_char(c):
+    return c.isalnum() or c == "_"
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton finding every keyword of a corpus in a single pass
+
+    Keywords are matched case-insensitively as substrings of the body, exactly
+    like `build_label_csv.get_keywords_in_body` used to. Duplicate keywords
+    (ignoring case) are only reported once, in the order they first appear in
+    the corpus.
+
+    Parameters
+    ----------
+    keywords : iterable of str
+        Keywords and phrases, e.g. the output of `load_keyword_corpus`
+    word_boundary : bool
+        Only count a match if it is not preceded or followed by a word character
+    """
+
+    def __init__(self, keywords, word_boundary=False):
+        self.word_boundary = word_boundary
+        self.keywords = []
+        ids = {}
+        for keyword in keywords:
+            klower = keyword.lower()
+            if klower not in ids:
+                ids[klower] = len(self.keywords)
+                self.keywords.append(klower)
+        # Keyword IDs matching at the start of any body, i.e. the empty keyword
+        self._always = [i for i, k in enumerate(self.keywords) if not k]
+        self._goto = [{}]
+        self._out = [[]]
+        for i, keyword in enumerate(self.keywords):
+            if keyword:
+                self._add(keyword, i)
+        self._fail = [0] * len(self._goto)
+        self._link()
+
+    def _add(self, keyword, keyword_id):
+        node = 0
+        for c in keyword:
+            nxt = self._goto[node].get(c)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][c] = nxt
+                self._goto.append({})
+                self._out.append([])
+            node = nxt
+        self._out[node].append(keyword_id)
+
+    def _link(self):
+        goto, fail, out = self._goto, self._fail, self._out
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for c, child in goto[node].items():
+                queue.append(child)
+                f = fail[node]
+                while f and c not in goto[f]:
+                    f = fail[f]
+                fail[child] = goto[f].get(c, 0)
+                # Keywords that are suffixes of this one end here as well
+                out[child] = out[child] + out[fail[child]]
+
+    def __len__(self):
+        return len(self.keywords)
+
+    def find_all(self, body):
+        """
+        Get the keywords contained in `body`
+
+        Returns
+        -------
+        keywords : list of str
+            Lower cased keywords found, in corpus order
+        """
+        text = body.lower()
+        goto, fail, out = self._goto, self._fail, self._out
+        keywords = self.keywords
+        found = set(self._always)
+        node = 0
+        for i, c in enumerate(text):
+            while node and c not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(c, 0)
+            if not out[node]:
+                continue
+            if not self.word_boundary:
+                found.update(out[node])
+                continue
+            end = i + 1
+            if end < len(text) and is_word_char(text[end]):
+                continue
+            for keyword_id in out[node]:
+                start = end - len(keywords[keyword_id])
+                if start == 0 or not is_word_char(text[start - 1]):
+                    found.add(keyword_id)
+        return [keywords[i] for i in sorted(found)]
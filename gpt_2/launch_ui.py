@@ -0,0 +1,89 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from gpt_2.jobs import DEFAULT_JOBS_DB, DEFAULT_RUN_NAME, JOBS_DB_ENV, SCRIPT_DIR
+
+# gpt_2.model_manager.WARM_UP_ENV, not imported to keep tensorflow out of the launcher
+WARM_UP_ENV = "GPT2_WARM_UP_MODELS"
+
+# `opyrator launch-ui` serves a single function, so every endpoint gets its own
+# process, on consecutive ports in this order
+ENDPOINTS = [
+    "generate_prompts",
+    "submit_generation_job",
+    "get_generation_job_status",
+    "get_generation_job_result",
+]
+DEFAULT_PORT = 8051
+
+
+def endpoint_command(endpoint, port):
+    return ["opyrator", "launch-ui", f"gpt_2.opyrator_ui:{endpoint}", "--port", str(port)]
+
+
+def worker_command(db, checkpoint_dir):
+    return [
+        sys.executable, "-m", "gpt_2.jobs", "--db", str(db),
+        "worker", "--checkpoint-dir", str(checkpoint_dir),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve the generation UIs and the workers of their job queue"
+    )
+    parser.add_argument(
+        "--port", type=int, default=DEFAULT_PORT,
+        help="Port of the first endpoint, the others use the ports after it",
+    )
+    parser.add_argument(
+        "--endpoints", nargs="+", choices=ENDPOINTS, default=ENDPOINTS,
+        help="Endpoints to serve",
+    )
+    parser.add_argument(
+        "--job-workers", type=int, default=1,
+        help="Number of `python -m gpt_2.jobs worker` processes to run",
+    )
+    parser.add_argument(
+        "--warm-up", default=os.environ.get(WARM_UP_ENV, DEFAULT_RUN_NAME),
+        help="Comma separated runs generate_prompts loads before its first request, "
+        "empty to load them on demand",
+    )
+    parser.add_argument(
+        "--checkpoint-dir", default=str(SCRIPT_DIR.joinpath("..", "checkpoint"))
+    )
+    args = parser.parse_args()
+
+    db = os.environ.get(JOBS_DB_ENV, DEFAULT_JOBS_DB)
+    processes = []
+    try:
+        for endpoint in args.endpoints:
+            env = dict(os.environ, **{JOBS_DB_ENV: str(db)})
+            env.pop(WARM_UP_ENV, None)
+            if endpoint == "generate_prompts" and args.warm_up:
+                env[WARM_UP_ENV] = args.warm_up
+            port = args.port + ENDPOINTS.index(endpoint)
+            print(f"Serving {endpoint} on port {port}")
+            processes.append(subprocess.Popen(endpoint_command(endpoint, port), env=env))
+        for _ in range(args.job_workers):
+            processes.append(subprocess.Popen(worker_command(db, args.checkpoint_dir)))
+
+        # Stop serving as soon as any of the processes exits
+        while all(process.poll() is None for process in processes):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in processes:
+            process.wait()
+    sys.exit(max((process.returncode or 0 for process in processes), default=0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import hashlib
+import pathlib
+import sqlite3
+import time
+
+# Hits update the last use of their entries in one transaction per this many
+# keys, instead of writing on every hit
+TOUCH_BATCH_SIZE = 1000
+
+
+class LocationCache:
+    """
+    Disk-backed memoization of store location extraction
+
+    Locations are stored in an SQLite database keyed by a hash of the extractor
+    version, the article title and the article body, so changing any of them is a
+    cache miss. Several processes can share one database.
+
+    The last use of hit entries is written in batches, so `close` or `flush` the
+    cache before other processes prune it.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Location of the SQLite database
+    version : str
+        Version of the location extractor. Bump it whenever the extraction logic
+        changes so stale results are not reused.
+    """
+
+    def __init__(self, path, version):
+        self.path = pathlib.Path(path)
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self._touched = set()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS locations ("
+            "key TEXT PRIMARY KEY, version TEXT, location TEXT, last_used REAL)"
+        )
+        self._conn.commit()
+
+    def key(self, title, body):
+        h = hashlib.sha256()
+        for part in (self.version, title, body):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def get(self, title, body):
+        """Returns the cached location, or None on a miss"""
+        key = self.key(title, body)
+        row = self._conn.execute(
+            "SELECT location FROM locations WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touched.add(key)
+        if len(self._touched) >= TOUCH_BATCH_SIZE:
+            self.flush()
+        return row[0]
+
+    def _write_touched(self):
+        now = time.time()
+        self._conn.executemany(
+            "UPDATE locations SET last_used = ? WHERE key = ?",
+            ((now, key) for key in self._touched),
+        )
+        self._touched.clear()
+
+    def flush(self):
+        """Write the last use of the entries hit since the previous flush"""
+        if self._touched:
+            with self._conn:
+                self._write_touched()
+
+    def put(self, title, body, location):
+        with self._conn:
+            self._write_touched()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO locations VALUES (?, ?, ?, ?)",
+                (self.key(title, body), self.version, location, time.time()),
+            )
+
+    def get_or_compute(self, title, body, extract):
+        """Returns the cached location, calling `extract(title, body)` on a miss"""
+        location = self.get(title, body)
+        if location is None:
+            location = extract(title, body)
+            self.put(title, body, location)
+        return location
+
+    def record(self, hit):
+        """Count a lookup made by another process against this cache's stats"""
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def prune(self, unused_since=None):
+        """
+        Delete entries written by other extractor versions
+
+        Parameters
+        ----------
+        unused_since : float
+            Also delete entries not used since this UNIX timestamp
+
+        Returns
+        -------
+        count : int
+            Number of entries deleted
+        """
+        with self._conn:
+            self._write_touched()
+            cursor = self._conn.execute(
+                "DELETE FROM locations WHERE version != ? OR last_used < ?",
+                (self.version, unused_since if unused_since is not None else 0),
+            )
+        return cursor.rowcount
+
+    def stats(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"{self.hits} hits, {self.misses} misses ({rate:.0%} hit rate)"
+
+    def close(self):
+        self.flush()
+        self._conn.close()
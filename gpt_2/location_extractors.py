@@ -0,0 +1,171 @@
+import logging
+import re
+
+ALLOWED_COUNTRIES = ("Canada", "United States")
+TITLE_LOCATION_RE = re.compile(r"\([\w ]+\)")
+
+logger = logging.getLogger(__name__)
+
+US_STATES = {
+    "AL": "Alabama", "AK": "Alaska", "AZ": "Arizona", "AR": "Arkansas",
+    "CA": "California", "CO": "Colorado", "CT": "Connecticut", "DE": "Delaware",
+    "DC": "District of Columbia", "FL": "Florida", "GA": "Georgia", "HI": "Hawaii",
+    "ID": "Idaho", "IL": "Illinois", "IN": "Indiana", "IA": "Iowa", "KS": "Kansas",
+    "KY": "Kentucky", "LA": "Louisiana", "ME": "Maine", "MD": "Maryland",
+    "MA": "Massachusetts", "MI": "Michigan", "MN": "Minnesota", "MS": "Mississippi",
+    "MO": "Missouri", "MT": "Montana", "NE": "Nebraska", "NV": "Nevada",
+    "NH": "New Hampshire", "NJ": "New Jersey", "NM": "New Mexico", "NY": "New York",
+    "NC": "North Carolina", "ND": "North Dakota", "OH": "Ohio", "OK": "Oklahoma",
+    "OR": "Oregon", "PA": "Pennsylvania", "RI": "Rhode Island", "SC": "South Carolina",
+    "SD": "South Dakota", "TN": "Tennessee", "TX": "Texas", "UT": "Utah",
+    "VT": "Vermont", "VA": "Virginia", "WA": "Washington", "WV": "West Virginia",
+    "WI": "Wisconsin", "WY": "Wyoming",
+}
+CANADIAN_PROVINCES = {
+    "AB": "Alberta", "BC": "British Columbia", "MB": "Manitoba", "NB": "New Brunswick",
+    "NL": "Newfoundland and Labrador", "NS": "Nova Scotia", "NT": "Northwest Territories",
+    "NU": "Nunavut", "ON": "Ontario", "PE": "Prince Edward Island", "QC": "Quebec",
+    "SK": "Saskatchewan", "YT": "Yukon",
+}
+
+
+def get_title_location(title):
+    """Returns the parenthesised location in a title followed by a space, or ''"""
+    match = re.search(TITLE_LOCATION_RE, title)
+    if match is None:
+        return ''
+    return match.group(0).strip('()') + " "
+
+
+class LocationExtractor:
+    """
+    Base class of the store location extractors used by build_label_csv
+
+    Subclasses must not import heavy dependencies at module import time. Anything
+    expensive belongs in `load`, which is called once before the first extraction.
+    """
+
+    name = ""
+    # Bump whenever the extraction logic changes so cached locations are recomputed
+    version = "1"
+
+    @property
+    def cache_version(self):
+        return f"{self.name}-{self.version}"
+
+    def load(self):
+        """Load models and data needed for extraction"""
+
+    def extract(self, title, body):
+        raise NotImplementedError
+
+
+class NoLocationExtractor(LocationExtractor):
+    """Skips location extraction, every store location is left empty"""
+
+    name = "none"
+
+    def extract(self, title, body):
+        return ''
+
+
+class GeograpyLocationExtractor(LocationExtractor):
+    """
+    Finds US and Canadian regions and cities with geograpy's NLTK based named
+    entity recognition. Slow, but finds locations written in any form.
+    """
+
+    name = "geograpy"
+
+    def __init__(self):
+        self._geograpy = None
+
+    def __getstate__(self):
+        # Modules can't be pickled, worker processes import geograpy themselves
+        return {}
+
+    def __setstate__(self, state):
+        self._geograpy = None
+
+    def load(self):
+        if self._geograpy is None:
+            import geograpy
+
+            self._geograpy = geograpy
+            # Run a tiny extraction so geograpy and NLTK load their models now
+            # rather than on the first article
+            geograpy.get_geoPlace_context(text="Springfield, Illinois")
+
+    def extract(self, title, body):
+        self.load()
+        # First try to grab it from the title
+        location = get_title_location(title)
+        # If that didn't work we need to search the body
+        places = self._geograpy.get_geoPlace_context(text=body)
+        all_locs = []
+        for attr in ('country_regions', 'country_cities'):
+            for k, v in getattr(places, attr).items():
+                if k not in ALLOWED_COUNTRIES:
+                    continue
+                for subloc in v:
+                    all_locs.append(f"{subloc} {k}")
+        location += ",".join(all_locs)
+        logger.debug("location = %s", location)
+        return location
+
+
+class RegexLocationExtractor(LocationExtractor):
+    """
+    Finds US states and Canadian provinces, written out or as the abbreviation in
+    a "City, ST" address, with plain regular expressions. Much faster than
+    geograpy and needs no models, at the cost of missing free-form mentions.
+    """
+
+    name = "regex"
+
+    def __init__(self):
+        self._regions = {}
+        for country, regions in (
+            ("United States", US_STATES),
+            ("Canada", CANADIAN_PROVINCES),
+        ):
+            for abbreviation, region in regions.items():
+                self._regions[abbreviation] = (region, country)
+                self._regions[region] = (region, country)
+        names = "|".join(
+            re.escape(r) for r in sorted(self._regions, key=len, reverse=True) if len(r) > 2
+        )
+        abbreviations = "|".join(r for r in self._regions if len(r) == 2)
+        self._region_re = re.compile(rf"\b({names})\b")
+        self._address_re = re.compile(
+            rf"\b([A-Z][a-z]+(?: [A-Z][a-z]+){{0,2}}), ({abbreviations}|{names})\b"
+        )
+
+    def extract(self, title, body):
+        location = get_title_location(title)
+        all_locs = []
+        for match in self._region_re.finditer(body):
+            region, country = self._regions[match.group(1)]
+            all_locs.append(f"{region} {country}")
+        for match in self._address_re.finditer(body):
+            region, country = self._regions[match.group(2)]
+            all_locs.append(f"{match.group(1)} {country}")
+        location += ",".join(dict.fromkeys(all_locs))
+        return location
+
+
+LOCATION_EXTRACTORS = {
+    GeograpyLocationExtractor.name: GeograpyLocationExtractor,
+    RegexLocationExtractor.name: RegexLocationExtractor,
+    NoLocationExtractor.name: NoLocationExtractor,
+}
+
+
+def get_location_extractor(name):
+    """Create the location extractor registered under `name`"""
+    try:
+        return LOCATION_EXTRACTORS[name]()
+    except KeyError:
+        raise ValueError(
+            f"Unknown location extractor {name!r}, choose from {sorted(LOCATION_EXTRACTORS)}"
+        )
@@ -0,0 +1,149 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import gpt_2_simple as gpt2
+import tensorflow as tf
+
+from gpt_2.generation import GenerationEngine
+
+logger = logging.getLogger(__name__)
+
+# Comma separated run names to load when a ModelManager is warmed up from the
+# environment, and the number of models kept in memory
+WARM_UP_ENV = "GPT2_WARM_UP_MODELS"
+MAX_MODELS_ENV = "GPT2_MAX_MODELS"
+DEFAULT_MAX_MODELS = 1
+
+
+class LoadedModel:
+    """A checkpoint loaded into its own graph and session"""
+
+    def __init__(self, run_name, checkpoint_dir):
+        self.run_name = run_name
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.sess = gpt2.start_tf_sess()
+            gpt2.load_gpt2(self.sess, run_name=run_name, checkpoint_dir=checkpoint_dir)
+        self.engine = GenerationEngine(
+            self.sess, run_name=run_name, checkpoint_dir=checkpoint_dir
+        )
+        # Generation on one session is serialized
+        self.lock = threading.Lock()
+        self.users = 0
+
+    def warm_up(self):
+        """Generate a couple of tokens so the step graph is built and the kernels
+        are initialized before the first real request"""
+        with self.lock:
+            end_token = self.engine.enc.encoder["<|endoftext|>"]
+            self.engine.generate_tokens([[end_token]], 2)
+
+    def close(self):
+        self.engine.clear_prefix_cache()
+        self.sess.close()
+
+
+class ModelManager:
+    """
+    Process wide cache of loaded checkpoints
+
+    Each run name is loaded once, into its own graph and session, and reused by
+    every later request. When more than `max_models` are loaded the least recently
+    used idle model is closed.
+
+    Parameters
+    ----------
+    checkpoint_dir : str or pathlib.Path
+        Directory holding one checkpoint directory per run name
+    max_models : int
+        Number of models to keep in memory
+    """
+
+    def __init__(self, checkpoint_dir="checkpoint", max_models=DEFAULT_MAX_MODELS):
+        self.checkpoint_dir = str(checkpoint_dir)
+        self.max_models = max(1, max_models)
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        # One lock per run name, so loading one model doesn't block using another
+        self._load_locks = {}
+
+    @classmethod
+    def from_env(cls, checkpoint_dir="checkpoint"):
+        max_models = int(os.environ.get(MAX_MODELS_ENV, DEFAULT_MAX_MODELS))
+        return cls(checkpoint_dir, max_models)
+
+    def _acquire(self, run_name):
+        with self._lock:
+            load_lock = self._load_locks.setdefault(run_name, threading.Lock())
+        with load_lock:
+            with self._lock:
+                loaded = self._models.get(run_name)
+                if loaded is not None:
+                    self._models.move_to_end(run_name)
+                    loaded.users += 1
+                    return loaded
+            logger.info("Loading model %s", run_name)
+            loaded = LoadedModel(run_name, self.checkpoint_dir)
+            with self._lock:
+                self._models[run_name] = loaded
+                loaded.users += 1
+                self._evict()
+            return loaded
+
+    def _release(self, loaded):
+        with self._lock:
+            loaded.users -= 1
+            self._evict()
+
+    def _evict(self):
+        # Called with self._lock held. Models in use are skipped, so the limit can
+        # be exceeded until they are released.
+        for run_name in list(self._models):
+            if len(self._models) <= self.max_models:
+                break
+            loaded = self._models[run_name]
+            if loaded.users == 0:
+                logger.info("Unloading model %s", run_name)
+                del self._models[run_name]
+                loaded.close()
+
+    @contextmanager
+    def model(self, run_name):
+        """Load `run_name` if needed and hold its lock while the with block
+        generates from the yielded `GenerationEngine`"""
+        loaded = self._acquire(run_name)
+        try:
+            with loaded.lock:
+                yield loaded.engine
+        finally:
+            self._release(loaded)
+
+    def warm_up(self, run_names):
+        """Load and warm up each of `run_names`"""
+        for run_name in run_names:
+            loaded = self._acquire(run_name)
+            try:
+                loaded.warm_up()
+            finally:
+                self._release(loaded)
+
+    def warm_up_from_env(self, default=""):
+        """Warm up the run names listed in the GPT2_WARM_UP_MODELS environment
+        variable, or `default` when it is unset"""
+        run_names = os.environ.get(WARM_UP_ENV, default)
+        self.warm_up([r.strip() for r in run_names.split(",") if r.strip()])
+
+    @property
+    def loaded(self):
+        """Run names of the loaded models, least recently used first"""
+        with self._lock:
+            return list(self._models)
+
+    def close(self):
+        with self._lock:
+            for loaded in self._models.values():
+                loaded.close()
+            self._models.clear()
@@ -1,22 +1,71 @@
 import io
+import logging
 import os
 import pathlib
-import argparse
-import csv
-import gpt_2_simple as gpt2
-import numpy as np
+import threading
+import zipfile
 
-from datetime import datetime
-from shutil import make_archive
 from pydantic import BaseModel, Field
 
 from opyrator.components.types import FileContent
-from tempfile import NamedTemporaryFile, TemporaryDirectory
+from tempfile import SpooledTemporaryFile
 
+from gpt_2.generation_cache import (
+    DEFAULT_GENERATION_CACHE,
+    DEFAULT_MAX_BYTES,
+    GenerationCache,
+)
+from gpt_2.jobs import DEFAULT_JOBS_DB, JOBS_DB_ENV, JobQueue
+from gpt_2.prompts import iter_prompts
+
+logger = logging.getLogger(__name__)
 
 SCRIPT_DIR = pathlib.Path(__file__).parent.absolute()
 DEFAULT_RESULTS_DIR = SCRIPT_DIR.joinpath("..", "data", "raw")
 CHECKPOINT_DIR = SCRIPT_DIR.joinpath("..", "checkpoint")
+RUN_NAME = "experiment_3_355M"
+# ZIP archives are built in memory up to this size, then on disk
+ZIP_SPOOL_SIZE = 16 * 1024 * 1024
+
+# gpt_2.model_manager.WARM_UP_ENV, not imported to keep tensorflow out of the
+# job endpoints
+WARM_UP_ENV = "GPT2_WARM_UP_MODELS"
+
+# Generation jobs are queued here and worked on by `python -m gpt_2.jobs worker`
+# processes sharing the database
+JOBS_DB = os.environ.get(JOBS_DB_ENV, DEFAULT_JOBS_DB)
+
+# Samples of prompts generated before, shared with `python -m gpt_2.generate`
+GENERATION_CACHE = os.environ.get("GPT2_GENERATION_CACHE", DEFAULT_GENERATION_CACHE)
+GENERATION_CACHE_MAX_BYTES = int(
+    os.environ.get("GPT2_GENERATION_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)
+)
+
+# Created by the first generate_prompts request and shared by every later one, so
+# only the process serving generate_prompts loads TensorFlow and the models
+_model_manager = None
+_model_manager_lock = threading.Lock()
+
+
+def get_model_manager():
+    """The process's `gpt_2.model_manager.ModelManager`, created and warmed up
+    from the environment on first use"""
+    global _model_manager
+    with _model_manager_lock:
+        if _model_manager is None:
+            from gpt_2.model_manager import ModelManager
+
+            manager = ModelManager.from_env(checkpoint_dir=CHECKPOINT_DIR)
+            manager.warm_up_from_env()
+            _model_manager = manager
+    return _model_manager
+
+
+# `python -m gpt_2.launch_ui` only sets GPT2_WARM_UP_MODELS for the process
+# serving generate_prompts, which loads the models before its first request
+if os.environ.get(WARM_UP_ENV):
+    get_model_manager()
+
 
 class PromptCSVInput(BaseModel):
     csv_file: FileContent = Field(
@@ -24,6 +73,12 @@ class PromptCSVInput(BaseModel):
     )
 
 
+class GeneratePromptsInput(PromptCSVInput):
+    refresh: bool = Field(
+        False, description="Regenerate prompts that were generated before"
+    )
+
+
 class GeneratedArticlesZipOutput(BaseModel):
     generated_articles: FileContent = Field(
         ...,
@@ -32,85 +87,141 @@ class GeneratedArticlesZipOutput(BaseModel):
     )
 
 
-def generate_prompts_from_csv(path):
+class GenerationJobSubmitted(BaseModel):
+    job_id: str = Field(..., description="ID to query the status and results with")
+    prompts: int = Field(..., description="Number of prompts queued")
 
-    path = pathlib.Path(path)
-    prompts = []
-    with open(path, "r", encoding="utf-8-sig") as f:
-        fieldnames = f.readline().lstrip("#").strip().split(",")
-        print("fieldnames = {}".format(fieldnames))
-        reader = csv.DictReader(f, fieldnames=fieldnames)
-        for row in reader:
-            if not any(v for v in row.values()):
-                continue
-            print("row = {}".format(row))
-            prompt = f"""
-[LABELS]
 
-title: {row['title']}
+class GenerationJobQuery(BaseModel):
+    job_id: str = Field(..., description="ID returned when the job was submitted")
+    after: int = Field(
+        0,
+        description="Only return articles finished after this sequence number, "
+        "as returned by an earlier result request",
+    )
+
 
-store_name: {row['store_name']}
+class GenerationJobStatus(BaseModel):
+    job_id: str
+    status: str = Field(..., description="queued, running, done or failed")
+    total: int
+    pending: int
+    running: int
+    done: int
+    failed: int
 
-store_location: {row['store_location']}
 
-page_template: {row['page_template']}
+class GenerationJobResult(GeneratedArticlesZipOutput):
+    last: int = Field(
+        ..., description="Sequence number of the last article in the archive"
+    )
 
-keywords: {row['keywords']}
-"""
-            prompts.append((row["file_name"], prompt))
-    return prompts
+
+def zip_articles(articles):
+    """
+    Returns a ZIP archive of `articles`, (file name, text) pairs placed in an
+    `articles` directory
+
+    Articles are compressed into the archive one at a time as the iterable yields
+    them, so only the finished archive is ever held in full.
+    """
+    with SpooledTemporaryFile(max_size=ZIP_SPOOL_SIZE) as spool:
+        with zipfile.ZipFile(spool, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("articles/", "")
+            for fname, text in articles:
+                zf.writestr(f"articles/{fname}", text)
+        spool.seek(0)
+        return spool.read()
+
+
+def prompts_from_input(input: PromptCSVInput):
+    """Lazily yield the (file_name, prompt) pairs of an uploaded prompt CSV"""
+    return iter_prompts(io.StringIO(input.csv_file.as_str()))
 
 
 def generate_prompts(
-    input: PromptCSVInput,
+    input: GeneratePromptsInput,
 ) -> GeneratedArticlesZipOutput:
     """
     Given a CSV file of prompts, generate articles for each prompt
     """
 
-    with NamedTemporaryFile(suffix=".csv", mode="w") as csv_file:
-        csv_file.write(input.csv_file.as_str())
-        csv_file.seek(0)
-        print("CSV file name:")
-        print(csv_file.name)
-        prompts = generate_prompts_from_csv(csv_file.name)
-
-    print("prompts:")
-    print(prompts)
+    prompts = (
+        (fname + ".txt", prefix) for fname, prefix in prompts_from_input(input)
+    )
 
     # gpt2.generate(sess, run_name='first_test', prefix="Luxury Vinyl Plank Flooring")
-    sess = gpt2.start_tf_sess()
-    gpt2.load_gpt2(sess, run_name="experiment_3_355M", checkpoint_dir=CHECKPOINT_DIR)
-    with TemporaryDirectory() as tmp_dir:
-        for fname, prefix in prompts:
-            fname += ".txt"
-            print(f"Saving samples for prefix {prefix} to {fname}")
-            articles_dir = os.path.join(tmp_dir, "articles") 
-            if not os.path.isdir(articles_dir):
-                os.makedirs(articles_dir)
-            gen_file = os.path.join(articles_dir, fname)
-            print("gen_file = {}".format(gen_file))
-            gpt2.generate_to_file(
-                sess,
-                prefix=prefix,
-                destination_path=gen_file,
-                checkpoint_dir=CHECKPOINT_DIR,
-                # length=500,
-                temperature=0.7,
-                nsamples=5,
-                batch_size=1,
-                run_name="experiment_3_355M",
-            )
-        zip_name = os.path.join(tmp_dir, "generated-articles") 
-        print("zip_name = {}".format(zip_name))	
-        zip_path = make_archive(
-            zip_name,
-            "zip",
-            root_dir=tmp_dir,
-            base_dir="articles",
+    def articles():
+        from gpt_2.generation import StopCriteria, format_samples, iter_generated
+
+        cache = GenerationCache(GENERATION_CACHE, GENERATION_CACHE_MAX_BYTES)
+        try:
+            with get_model_manager().model(RUN_NAME) as engine:
+                for fname, samples in iter_generated(
+                    engine,
+                    prompts,
+                    # length=500,
+                    temperature=0.7,
+                    nsamples=5,
+                    stop=StopCriteria(),
+                    cache=cache,
+                    refresh=input.refresh,
+                ):
+                    yield fname, format_samples(samples)
+        finally:
+            logger.info("Generation cache: %s", cache.stats())
+            cache.close()
+
+    zip_bytes = zip_articles(articles())
+    print("len(zip_bytes) = {}".format(len(zip_bytes)))
+    return GeneratedArticlesZipOutput(generated_articles=zip_bytes)
+
+
+def submit_generation_job(input: PromptCSVInput) -> GenerationJobSubmitted:
+    """
+    Queue generating articles for each prompt of a CSV file and return at once
+    """
+    queue = JobQueue(JOBS_DB)
+    try:
+        job_id = queue.submit(
+            ((fname + ".txt", prefix) for fname, prefix in prompts_from_input(input)),
+            RUN_NAME,
+            {"temperature": 0.7, "nsamples": 5},
         )
-        print("zip_path = {}".format(zip_path))	
-        with open(zip_path, 'rb') as f:
-            zip_bytes = f.read()
-        print("len(zip_bytes) = {}".format(len(zip_bytes)))
-        return GeneratedArticlesZipOutput(generated_articles=zip_bytes) 
+        prompts = queue.status(job_id)["total"]
+    finally:
+        queue.close()
+    return GenerationJobSubmitted(job_id=job_id, prompts=prompts)
+
+
+def get_generation_job_status(input: GenerationJobQuery) -> GenerationJobStatus:
+    """
+    Show how many prompts of a generation job are done
+    """
+    queue = JobQueue(JOBS_DB)
+    try:
+        status = queue.status(input.job_id)
+    finally:
+        queue.close()
+    return GenerationJobStatus(job_id=status.pop("id"), **status)
+
+
+def get_generation_job_result(input: GenerationJobQuery) -> GenerationJobResult:
+    """
+    Download the articles of a generation job finished so far, or only those
+    finished since an earlier download
+    """
+    queue = JobQueue(JOBS_DB)
+    last = input.after
+
+    def articles():
+        nonlocal last
+        for seq, fname, output in queue.results(input.job_id, input.after):
+            last = seq
+            yield fname, output
+
+    try:
+        zip_bytes = zip_articles(articles())
+    finally:
+        queue.close()
+    return GenerationJobResult(generated_articles=zip_bytes, last=last)
@@ -0,0 +1,121 @@
+import csv
+import io
+import logging
+import os
+import string
+
+logger = logging.getLogger(__name__)
+
+PROMPT_FIELDS = ("title", "store_name", "store_location", "page_template", "keywords")
+# The prompt generate and opyrator_ui have always used
+DEFAULT_PROMPT_TEMPLATE = """
+[LABELS]
+
+title: {title}
+
+store_name: {store_name}
+
+store_location: {store_location}
+
+page_template: {page_template}
+
+keywords: {keywords}
+"""
+
+
+def labels_template(fields=PROMPT_FIELDS, body=True):
+    """
+    Returns a template laid out exactly like the `[LABELS]` block of a training
+    sample written by build_training_dataset, optionally followed by the `[BODY]`
+    marker so the model continues with an article body
+    """
+    parts = ["[LABELS]\n\n"]
+    for field in fields:
+        parts.append(f"{field}: {{{field}}}\n\n")
+    if body:
+        parts.append("[BODY]\n\n")
+    return "".join(parts)
+
+
+TRAINING_PROMPT_TEMPLATE = labels_template()
+PROMPT_TEMPLATES = {
+    "default": DEFAULT_PROMPT_TEMPLATE,
+    "training": TRAINING_PROMPT_TEMPLATE,
+}
+
+
+class PromptBuilder:
+    """
+    Fills a `str.format` style template with the fields of prompt CSV rows
+
+    The template is parsed once, so building a prompt is a single join.
+
+    Parameters
+    ----------
+    template : str
+        Template with `{field}` placeholders, see `PROMPT_TEMPLATES`
+    """
+
+    def __init__(self, template=DEFAULT_PROMPT_TEMPLATE):
+        self.template = template
+        self._parts = []
+        self.fields = []
+        for literal, field, spec, conversion in string.Formatter().parse(template):
+            if spec or conversion:
+                raise ValueError("Prompt templates only support plain {field}s")
+            if literal:
+                self._parts.append((literal, None))
+            if field is not None:
+                self._parts.append((None, field))
+                self.fields.append(field)
+
+    @classmethod
+    def from_name_or_file(cls, template):
+        """A builder for one of `PROMPT_TEMPLATES` or the template in a file"""
+        if template in PROMPT_TEMPLATES:
+            return cls(PROMPT_TEMPLATES[template])
+        with open(template, "r") as f:
+            return cls(f.read())
+
+    def build(self, row):
+        return "".join(
+            literal if field is None else row[field] for literal, field in self._parts
+        )
+
+
+DEFAULT_PROMPT_BUILDER = PromptBuilder()
+
+
+def _iter_prompt_rows(f):
+    header = f.readline()
+    fieldnames = header.lstrip("\ufeff").lstrip("#").strip().split(",")
+    logger.debug("fieldnames = %s", fieldnames)
+    for row in csv.DictReader(f, fieldnames=fieldnames):
+        if not any(v for v in row.values()):
+            continue
+        logger.debug("row = %s", row)
+        yield row
+
+
+def iter_prompts(source, builder=DEFAULT_PROMPT_BUILDER):
+    """
+    Lazily yield `(file_name, prompt)` for every row of a prompt CSV
+
+    The first line of the CSV holds the column names, optionally after a `#`, and
+    empty rows are skipped.
+
+    Parameters
+    ----------
+    source : str, os.PathLike, file-like or bytes
+        Path to the CSV, an open text file or buffer, or the CSV's raw bytes
+    builder : PromptBuilder
+    """
+    if isinstance(source, bytes):
+        source = io.StringIO(source.decode("utf-8-sig"))
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "r", encoding="utf-8-sig") as f:
+            for row in _iter_prompt_rows(f):
+                yield row["file_name"], builder.build(row)
+    else:
+        for row in _iter_prompt_rows(source):
+            yield row["file_name"], builder.build(row)
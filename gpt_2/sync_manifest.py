@@ -0,0 +1,101 @@
+import json
+import os
+import pathlib
+
+
+class SyncManifest:
+    """
+    Persistent record of the Google Drive files downloaded into a directory
+
+    The manifest is a JSON file keyed by Drive file id. Each entry stores the
+    file name, its `modifiedTime`/`version` at the time it was downloaded and
+    the local path it was written to. The Drive `changes` page token is stored
+    alongside so the next sync only needs to look at what changed since.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Location of the manifest JSON file
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.page_token = None
+        self.files = {}
+        self.pending = {}
+        if self.path.is_file():
+            data = json.loads(self.path.read_text())
+            self.page_token = data.get("page_token")
+            self.files = data.get("files", {})
+            self.pending = data.get("pending", {})
+
+    def is_current(self, f):
+        """Returns True if the Drive file `f` was already downloaded at its current version"""
+        entry = self.files.get(f["id"])
+        if entry is None or entry.get("removed"):
+            return False
+        return (
+            entry.get("version") == f.get("version")
+            and entry.get("modifiedTime") == f.get("modifiedTime")
+        )
+
+    def record(self, f, path):
+        """Record a successful download of Drive file `f` to `path`"""
+        path = pathlib.Path(path)
+        entry = self.files.get(f["id"])
+        if entry is not None and entry.get("path") != str(path):
+            # The document was renamed, drop the copy stored under the old name
+            old_path = pathlib.Path(entry["path"])
+            if old_path.is_file():
+                old_path.unlink()
+        self.files[f["id"]] = {
+            "name": f["name"],
+            "modifiedTime": f.get("modifiedTime"),
+            "version": f.get("version"),
+            "path": str(path),
+        }
+        self.pending.pop(f["id"], None)
+
+    def mark_pending(self, f):
+        """Remember a file whose download failed so the next sync retries it"""
+        self.pending[f["id"]] = f
+
+    def remove(self, file_id, delete=False):
+        """
+        Handle a file that was removed from Drive (or no longer matches the filters)
+
+        Parameters
+        ----------
+        file_id : str
+            Drive file ID
+        delete : bool
+            Delete the local copy and forget the file instead of marking it removed
+
+        Returns
+        -------
+        entry : dict or None
+            The manifest entry of the removed file, if there was one
+        """
+        self.pending.pop(file_id, None)
+        entry = self.files.get(file_id)
+        if entry is None:
+            return None
+        if delete:
+            path = pathlib.Path(entry["path"])
+            if path.is_file():
+                path.unlink()
+            del self.files[file_id]
+        else:
+            entry["removed"] = True
+        return entry
+
+    def save(self):
+        """Atomically write the manifest back to disk"""
+        data = {
+            "page_token": self.page_token,
+            "files": self.files,
+            "pending": self.pending,
+        }
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_text(json.dumps(data, indent=2, sort_keys=True))
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,164 @@
+import json
+import pathlib
+import re
+from collections import namedtuple
+
+DEFAULT_PAGE_MODIFIERS = (
+    "MULTI-MAIN",
+    "MULTI-ADDON",
+    "MULTI-LOC",
+    "MULTI SINGLE",
+    "MULTI",
+)
+DEFAULT_STORE_SUFFIXES = (
+    "Carpet One Floor & Home - Asheville",
+    "Carpet One Floor & Home of Billings",
+    "Carpet One Floor & Home",
+    "Carpet One Belleville",
+    "Rochester Flooring",
+    "Nice Carpets",
+    "Fox Floors",
+    "Northeast Flooring and Kitchens",
+    "Carpet & Flooring",
+    "Carpet One & Paint",
+    "Flooring & Kitchens",
+    "Carpet One",
+    "Carpet",
+)
+
+ParsedTitle = namedtuple("ParsedTitle", ["store_name", "page_template", "matched"])
+ParsedTitle.__doc__ = """
+Result of parsing an article title
+
+`matched` is False when no store suffix was found in the title, in which case
+`store_name` is empty and `page_template` only holds the page modifier, if any.
+"""
+_make_parsed_title = ParsedTitle._make
+
+
+class _Alternation:
+    """
+    Finds the highest priority of several literal strings in a text
+
+    Among all occurrences the alternative listed first wins, and between
+    occurrences of the same alternative the leftmost one does. Small tables are
+    walked with substring tests, which beat a regex up to a few dozen
+    alternatives. Larger ones are compiled into one alternation regex, and each
+    scan resumes one character after the previous candidate so overlapping
+    occurrences are all seen.
+    """
+
+    # Largest table walked with substring tests, see benchmarks/bench_title_parser.py
+    MAX_WALKED_ALTERNATIVES = 32
+
+    def __init__(self, alternatives):
+        self.alternatives = tuple(alternatives)
+        self.priorities = {}
+        for i, alternative in enumerate(self.alternatives):
+            self.priorities.setdefault(alternative, i)
+        # Empty alternatives never match
+        self._walked = ()
+        self.regex = None
+        if len(self.alternatives) <= self.MAX_WALKED_ALTERNATIVES:
+            self._walked = tuple(a for a in self.alternatives if a)
+        else:
+            pattern = "|".join(re.escape(a) for a in self.alternatives if a)
+            self.regex = re.compile(pattern) if pattern else None
+
+    def search(self, text):
+        """Returns `(alternative, index)` for the best match, or None"""
+        if self.regex is not None:
+            return self._scan(text)
+        for alternative in self._walked:
+            if alternative in text:
+                return alternative, text.find(alternative)
+        return None
+
+    def _scan(self, text):
+        best = None
+        search = self.regex.search
+        match = search(text)
+        while match is not None:
+            priority = self.priorities[match.group()]
+            if best is None or priority < best[0]:
+                best = (priority, match.group(), match.start())
+                if priority == 0:
+                    break
+            match = search(text, match.start() + 1)
+        return None if best is None else best[1:]
+
+
+class TitleParser:
+    """
+    Splits article titles into a store name and a page template
+
+    Parameters
+    ----------
+    page_modifiers : sequence of str
+        Page template modifiers such as "MULTI-MAIN", highest priority first. The
+        first one found anywhere in a title is removed from it and starts the page
+        template.
+    store_suffixes : sequence of str
+        Endings of store names such as "Carpet One Floor & Home", highest priority
+        first. Everything up to and including the first one found is the store
+        name, everything after it is the page template.
+    """
+
+    def __init__(self, page_modifiers=DEFAULT_PAGE_MODIFIERS,
+                 store_suffixes=DEFAULT_STORE_SUFFIXES):
+        self._modifiers = _Alternation(page_modifiers)
+        self._suffixes = _Alternation(store_suffixes)
+
+    @property
+    def page_modifiers(self):
+        return self._modifiers.alternatives
+
+    @property
+    def store_suffixes(self):
+        return self._suffixes.alternatives
+
+    @classmethod
+    def from_config(cls, path):
+        """
+        Load the modifier and suffix tables from a JSON file
+
+        The file holds an object with optional "page_modifiers" and
+        "store_suffixes" lists. Missing tables fall back to the defaults.
+        """
+        config = json.loads(pathlib.Path(path).read_text())
+        return cls(
+            page_modifiers=config.get("page_modifiers", DEFAULT_PAGE_MODIFIERS),
+            store_suffixes=config.get("store_suffixes", DEFAULT_STORE_SUFFIXES),
+        )
+
+    def parse(self, title):
+        """
+        Parse a single title
+
+        Returns
+        -------
+        parsed : ParsedTitle
+        """
+        cleaned_name = title
+        page_template = ""
+        modifier = self._modifiers.search(title)
+        if modifier is not None:
+            page_template = modifier[0]
+            cleaned_name = cleaned_name.replace(page_template, "")
+        suffix = self._suffixes.search(cleaned_name)
+        if suffix is None:
+            return ParsedTitle("", page_template, False)
+        store_suffix, index = suffix
+        store_name = cleaned_name[0:index].strip() + " " + store_suffix
+        page_template = page_template + cleaned_name[index + len(store_suffix) :]
+        # _make skips the keyword argument handling of the namedtuple constructor
+        return _make_parsed_title((store_name.strip(), page_template.strip(), True))
+
+    def parse_many(self, titles):
+        """Parse an iterable of titles, yielding a ParsedTitle for each"""
+        parse = self.parse
+        for title in titles:
+            yield parse(title)
+
+
+DEFAULT_TITLE_PARSER = TitleParser()
@@ -0,0 +1,137 @@
+import csv
+import hashlib
+import os
+import pathlib
+from contextlib import contextmanager
+
+import numpy as np
+
+START_TOKEN = "<|startoftext|>"
+END_TOKEN = "<|endoftext|>"
+# Every GPT-2 model shares a 50257 token vocabulary, which fits in 16 bits
+TOKEN_DTYPE = np.uint16
+
+
+def wrap_sample(text):
+    """Returns a training sample the way gpt_2_simple wraps each row of a CSV
+    dataset before encoding it"""
+    return START_TOKEN + text + END_TOKEN + "\n"
+
+
+def hash_training_csv(csv_path):
+    """
+    Returns the content hash of a training CSV
+
+    The CSV is read exactly like gpt_2_simple's `load_dataset` reads it, so the
+    hash matches the one `TokenizedDatasetWriter` records for the same samples.
+    """
+    h = hashlib.sha256()
+    with open(csv_path, "r", encoding="utf8", errors="ignore") as fp:
+        fp.readline()
+        for row in csv.reader(fp):
+            h.update(wrap_sample(row[0]).encode("utf-8"))
+    return h.hexdigest()
+
+
+class TokenizedDatasetWriter:
+    """
+    Encodes training samples once with the GPT-2 encoder and saves them as a
+    compressed `.npz` holding
+
+    * `tokens`: every sample's tokens concatenated, as uint16
+    * `offsets`: sample `i` is `tokens[offsets[i]:offsets[i + 1]]`
+    * `content_hash`: sha256 of the wrapped sample texts, see `hash_training_csv`
+
+    Encoding samples one at a time yields the same tokens as gpt_2_simple encoding
+    the whole CSV, because every sample ends with a newline, which always starts a
+    new token.
+
+    Parameters
+    ----------
+    encoder : gpt_2_simple.src.encoder.Encoder
+        Encoder of the model that will be finetuned
+    """
+
+    def __init__(self, encoder):
+        self.encoder = encoder
+        self._chunks = []
+        self._lengths = []
+        self._hash = hashlib.sha256()
+
+    @classmethod
+    def from_model_dir(cls, model_dir):
+        """Load the encoder from a downloaded model, e.g. `models/355M`"""
+        from gpt_2_simple.src import encoder
+
+        return cls(encoder.get_encoder(str(model_dir)))
+
+    def encode(self, text):
+        """Returns the wrapped sample and its tokens. Safe to call from several
+        threads."""
+        wrapped = wrap_sample(text)
+        return wrapped, np.asarray(self.encoder.encode(wrapped), dtype=TOKEN_DTYPE)
+
+    def add(self, wrapped, tokens):
+        """Append a sample returned by `encode`. Samples must be added in order."""
+        self._hash.update(wrapped.encode("utf-8"))
+        self._chunks.append(tokens)
+        self._lengths.append(len(tokens))
+
+    @property
+    def content_hash(self):
+        return self._hash.hexdigest()
+
+    def save(self, path):
+        path = pathlib.Path(path)
+        offsets = np.zeros(len(self._lengths) + 1, dtype=np.int64)
+        np.cumsum(self._lengths, out=offsets[1:])
+        tokens = (
+            np.concatenate(self._chunks) if self._chunks else np.zeros(0, TOKEN_DTYPE)
+        )
+        # np.savez appends .npz to names without it, so give the temp file one too
+        tmp_path = path.with_name(path.name + ".tmp.npz")
+        np.savez_compressed(
+            tmp_path, tokens=tokens, offsets=offsets, content_hash=self.content_hash
+        )
+        os.replace(tmp_path, path)
+        return len(tokens)
+
+
+def read_content_hash(path):
+    """Returns the content hash stored in a tokenized dataset"""
+    with np.load(path) as npz:
+        return str(npz["content_hash"])
+
+
+def load_tokens(path):
+    """
+    Returns the tokens of a tokenized dataset as a read-only memory map
+
+    Members of a compressed `.npz` can't be memory mapped, so the tokens are
+    extracted once to a `.npy` next to it, named after the content hash so a
+    rebuilt dataset is extracted again.
+    """
+    path = pathlib.Path(path)
+    content_hash = read_content_hash(path)
+    npy_path = path.with_name(f"{path.stem}.{content_hash[:16]}.npy")
+    if not npy_path.exists():
+        with np.load(path) as npz:
+            tokens = npz["tokens"]
+        tmp_path = npy_path.with_name(npy_path.name + ".tmp.npy")
+        np.save(tmp_path, tokens)
+        os.replace(tmp_path, npy_path)
+    return np.load(npy_path, mmap_mode="r")
+
+
+@contextmanager
+def use_tokens(tokens):
+    """Make gpt_2_simple's finetune train on `tokens` instead of encoding its
+    dataset argument"""
+    import gpt_2_simple.gpt_2
+
+    original = gpt_2_simple.gpt_2.load_dataset
+    gpt_2_simple.gpt_2.load_dataset = lambda *args, **kwargs: [tokens]
+    try:
+        yield
+    finally:
+        gpt_2_simple.gpt_2.load_dataset = original
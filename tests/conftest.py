@@ -0,0 +1,36 @@
+import json
+
+import pytest
+
+TINY_HPARAMS = dict(n_ctx=64, n_embd=16, n_head=2, n_layer=2)
+
+
+@pytest.fixture(scope="session")
+def tiny_checkpoint_dir(tmp_path_factory):
+    """
+    A checkpoint directory holding a randomly initialized two layer model run
+    named "tiny", with a byte level encoder and a 64 token context
+    """
+    tf = pytest.importorskip("tensorflow")
+    from gpt_2_simple.src import model
+    from gpt_2_simple.src.encoder import bytes_to_unicode
+
+    checkpoint_dir = tmp_path_factory.mktemp("checkpoint")
+    run_dir = checkpoint_dir.joinpath("tiny")
+    run_dir.mkdir()
+    encoder = {c: i for i, c in enumerate(bytes_to_unicode().values())}
+    encoder["<|endoftext|>"] = len(encoder)
+    run_dir.joinpath("encoder.json").write_text(json.dumps(encoder))
+    run_dir.joinpath("vocab.bpe").write_text("#version: 0.2\n", encoding="utf-8")
+    hparams = dict(TINY_HPARAMS, n_vocab=len(encoder))
+    run_dir.joinpath("hparams.json").write_text(json.dumps(hparams))
+
+    v1 = tf.compat.v1
+    with tf.Graph().as_default(), v1.Session() as sess:
+        v1.set_random_seed(0)
+        h = model.default_hparams()
+        h.override_from_dict(hparams)
+        model.model(hparams=h, X=v1.placeholder(tf.int32, [1, None]))
+        sess.run(v1.global_variables_initializer())
+        v1.train.Saver().save(sess, str(run_dir.joinpath("model")))
+    return checkpoint_dir
@@ -0,0 +1,82 @@
+import csv
+import json
+
+from benchmarks.synthetic import write_articles
+from gpt_2.build_training_dataset import (
+    build_training_dataset,
+    create_training_text_body,
+    iter_label_rows,
+)
+from gpt_2.instrumentation import Metrics
+
+
+def write_legacy_csv(rows, data_dir, path):
+    # The csv.writer output build_training_dataset produced before streaming
+    with open(path, "w") as f:
+        f.write("# data\n")
+        writer = csv.writer(f)
+        for row in rows:
+            writer.writerow([create_training_text_body(row, data_dir)])
+
+
+def test_csv_matches_the_csv_writer(tmp_path):
+    raw_dir, label_csv = write_articles(tmp_path, 20, 50)
+    raw_dir.joinpath("C000003-X Store 3 Carpet One Area Rugs.txt").write_text(
+        'Commas, "quotes", été and a\r\nCRLF\n'
+    )
+    expected = tmp_path.joinpath("expected.csv")
+    write_legacy_csv(iter_label_rows(label_csv), raw_dir, expected)
+    for jobs in (1, 3):
+        training_csv = tmp_path.joinpath(f"train_{jobs}.csv")
+        count = build_training_dataset(
+            iter_label_rows(label_csv), raw_dir, training_csv=training_csv, jobs=jobs
+        )
+        assert count == 20
+        assert training_csv.read_bytes() == expected.read_bytes()
+
+
+def test_outputs_hold_the_same_samples(tmp_path):
+    raw_dir, label_csv = write_articles(tmp_path, 10, 30)
+    output_dir = tmp_path.joinpath("processed")
+    output_dir.mkdir()
+    jsonl = tmp_path.joinpath("train.jsonl")
+    build_training_dataset(iter_label_rows(label_csv), raw_dir, output_dir, jsonl=jsonl)
+    rows = list(iter_label_rows(label_csv))
+    records = [json.loads(line) for line in jsonl.read_text().splitlines()]
+    assert [r["file_name"] for r in records] == [row["file_name"] for row in rows]
+    for row, record in zip(rows, records):
+        expected = create_training_text_body(row, raw_dir)
+        assert record["text"] == expected
+        assert output_dir.joinpath(f"{row['file_name']}.txt").read_text() == expected
+
+
+def test_shards_split_the_csv(tmp_path):
+    raw_dir, label_csv = write_articles(tmp_path, 30, 20)
+    training_csv = tmp_path.joinpath("train.csv")
+    build_training_dataset(
+        iter_label_rows(label_csv), raw_dir, training_csv=training_csv, shards=3
+    )
+    samples = []
+    for i in range(3):
+        with open(tmp_path.joinpath(f"train-{i:05d}-of-00003.csv")) as f:
+            assert f.readline() == "# data\n"
+            samples.extend(row[0] for row in csv.reader(f))
+    expected = [create_training_text_body(row, raw_dir) for row in iter_label_rows(label_csv)]
+    assert sorted(samples) == sorted(expected)
+
+
+def test_stage_totals_without_item_records(tmp_path):
+    raw_dir, label_csv = write_articles(tmp_path, 10, 30)
+    jsonl = tmp_path.joinpath("train.jsonl")
+    totals = []
+    for keep_items in (True, False):
+        metrics = Metrics("test", keep_items=keep_items)
+        with metrics.stage("write_samples") as stage:
+            build_training_dataset(
+                iter_label_rows(label_csv), raw_dir, jsonl=jsonl, jobs=2, stage=stage
+            )
+        d = metrics.to_dict()["stages"]["write_samples"]
+        totals.append((d["items"], d["bytes_in"], d["bytes_out"]))
+        assert len(d.get("item_records", ())) == (10 if keep_items else 0)
+    assert totals[0] == totals[1]
+    assert totals[0][0] == 10 and totals[0][2] > 0
@@ -0,0 +1,231 @@
+import threading
+
+import httplib2
+import pytest
+from googleapiclient import errors
+
+from gpt_2.download_docs import (
+    RateLimiter,
+    download_files,
+    execute_with_retry,
+    fetch_documents,
+    get_google_drive_files,
+)
+
+
+def http_error(status):
+    return errors.HttpError(httplib2.Response({"status": status}), b"")
+
+
+def make_doc(file_id):
+    text = {"textRun": {"content": f"Text of {file_id}\n"}}
+    return {
+        "title": file_id,
+        "body": {"content": [{"paragraph": {"elements": [text]}}]},
+    }
+
+
+class FakeRequest:
+    def __init__(self, service, file_id):
+        self.service = service
+        self.file_id = file_id
+
+    def execute(self):
+        return self.service.fetch(self.file_id)
+
+
+class FakeBatch:
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        with self.service._lock:
+            self.service.batches.append([request.file_id for _, request in self.requests])
+        for request_id, request in self.requests:
+            try:
+                response, exception = request.execute(), None
+            except errors.HttpError as e:
+                response, exception = None, e
+            self.callback(request_id, response, exception)
+
+
+class FakeDocs:
+    """
+    Local stand-in for the Docs API service
+
+    Documents with an ID in `failing` raise their HttpError status `failures`
+    times before being returned, or forever when `failures` is None.
+    """
+
+    def __init__(self, failing=None, failures=None):
+        self.failing = failing or {}
+        self.failures = failures
+        self.calls = {}
+        self._lock = threading.Lock()
+
+        self.batches = []
+
+    def documents(self):
+        return self
+
+    def get(self, documentId):
+        return FakeRequest(self, documentId)
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+    def fetch(self, file_id):
+        with self._lock:
+            calls = self.calls[file_id] = self.calls.get(file_id, 0) + 1
+        if file_id in self.failing and (self.failures is None or calls <= self.failures):
+            raise http_error(self.failing[file_id])
+        return make_doc(file_id)
+
+
+class FakeDrive:
+    """Local stand-in for the Drive API service, listing `files` in pages"""
+
+    def __init__(self, files, page_size=2):
+        self.files_ = list(files)
+        self.page_size = page_size
+        self.queries = []
+
+    def files(self):
+        return self
+
+    def list(self, q=None, pageSize=None, fields=None, pageToken=None):
+        self.queries.append(q)
+        start = int(pageToken or 0)
+        response = {"files": self.files_[start : start + self.page_size]}
+        if start + self.page_size < len(self.files_):
+            response["nextPageToken"] = str(start + self.page_size)
+        return FakeListRequest(response)
+
+
+class FakeListRequest:
+    def __init__(self, response):
+        self.response = response
+
+    def execute(self):
+        return self.response
+
+
+def make_files(count):
+    return {f"doc{i:03d}": {"id": f"id{i:03d}", "name": f"doc{i:03d}"} for i in range(count)}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_rate_limiter_paces_calls_to_the_rate():
+    clock = FakeClock()
+    limiter = RateLimiter(2, period=1.0, clock=clock, sleep=clock.sleep)
+    for _ in range(6):
+        limiter.acquire()
+    # The first two calls use the full bucket, then one call every half second
+    assert clock.now == pytest.approx(2.0)
+    assert clock.sleeps == pytest.approx([0.5] * 4)
+
+
+def test_rate_limiter_allows_requests_larger_than_the_bucket():
+    clock = FakeClock()
+    limiter = RateLimiter(2, period=1.0, clock=clock, sleep=clock.sleep)
+    limiter.acquire(5)
+    assert clock.now == 0.0
+    # The bucket is in debt by three calls
+    limiter.acquire()
+    assert clock.now == pytest.approx(2.0)
+
+
+def test_execute_with_retry_backs_off_until_success():
+    docs = FakeDocs({"id000": 503}, failures=2)
+    sleeps = []
+    doc = execute_with_retry(
+        lambda: docs.documents().get(documentId="id000").execute(),
+        max_retries=5,
+        sleep=sleeps.append,
+    )
+    assert doc["title"] == "id000"
+    assert docs.calls["id000"] == 3
+    assert len(sleeps) == 2
+
+
+def test_execute_with_retry_gives_up_after_max_retries():
+    docs = FakeDocs({"id000": 429})
+    sleeps = []
+    with pytest.raises(errors.HttpError):
+        execute_with_retry(
+            lambda: docs.documents().get(documentId="id000").execute(),
+            max_retries=3,
+            sleep=sleeps.append,
+        )
+    assert docs.calls["id000"] == 4
+    assert len(sleeps) == 3
+
+
+def test_execute_with_retry_does_not_retry_client_errors():
+    docs = FakeDocs({"id000": 404})
+    with pytest.raises(errors.HttpError):
+        execute_with_retry(
+            lambda: docs.documents().get(documentId="id000").execute(),
+            sleep=lambda seconds: None,
+        )
+    assert docs.calls["id000"] == 1
+
+
+def test_download_files_reports_failed_documents(tmp_path):
+    files = make_files(20)
+    docs = FakeDocs({"id003": 404, "id011": 403})
+    failed = download_files(lambda: docs, files, tmp_path, workers=4)
+    assert sorted(failed) == ["doc003", "doc011"]
+    written = sorted(path.stem for path in tmp_path.glob("*.txt"))
+    assert written == sorted(set(files) - {"doc003", "doc011"})
+    assert tmp_path.joinpath("doc007.txt").read_text() == "Text of id007\n"
+
+
+def test_get_google_drive_files_follows_pages_and_filters_names():
+    drive = FakeDrive(
+        {"id": str(i), "name": name}
+        for i, name in enumerate(["C1-a Store", "Notes", "C2-b Store", "C3-c Store", "x"])
+    )
+    files = get_google_drive_files(drive, folder_id="folder", regex="^C[0-9]+-")
+    assert sorted(files) == ["C1-a Store", "C2-b Store", "C3-c Store"]
+    assert len(drive.queries) == 3
+    assert "'folder' in parents" in drive.queries[0]
+    assert "name contains 'C'" in drive.queries[0]
+
+
+def test_download_files_fetches_batches_of_documents(tmp_path):
+    files = make_files(250)
+    docs = FakeDocs()
+    failed = download_files(lambda: docs, files, tmp_path, workers=2, batch_size=100)
+    assert failed == []
+    assert sorted(len(batch) for batch in docs.batches) == [50, 100, 100]
+    assert len(list(tmp_path.glob("*.txt"))) == 250
+
+
+def test_fetch_documents_retries_only_failed_requests():
+    files = make_files(10)
+    docs = FakeDocs({"id002": 503, "id005": 429, "id007": 404}, failures=1)
+    sleeps = []
+    documents, failures = fetch_documents(docs, files, sleep=sleeps.append)
+    assert docs.batches[1:] == [["id002", "id005"]]
+    assert len(sleeps) == 1
+    assert sorted(documents) == sorted(set(files) - {"doc007"})
+    assert list(failures) == ["doc007"]
+    assert failures["doc007"].resp.status == 404
@@ -0,0 +1,180 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("gpt_2_simple")
+
+from gpt_2 import generation
+from gpt_2.generation import (
+    END_TOKEN,
+    StopCriteria,
+    auto_batch_size,
+    format_samples,
+    iter_generated,
+    plan_batches,
+)
+from gpt_2.model_manager import LoadedModel
+
+
+@pytest.fixture(scope="module")
+def engine(tiny_checkpoint_dir):
+    loaded = LoadedModel("tiny", tiny_checkpoint_dir)
+    yield loaded.engine
+    loaded.close()
+
+
+def test_plan_batches_groups_prompts_by_length():
+    prompt_tokens = [[1, 2], [3, 4, 5], [6, 7], [8, 9, 10]]
+    batches = plan_batches(prompt_tokens, 2, 3)
+    assert batches == [
+        [(0, 0), (0, 1), (2, 0)],
+        [(2, 1)],
+        [(1, 0), (1, 1), (3, 0)],
+        [(3, 1)],
+    ]
+    for batch in batches:
+        assert len(set(len(prompt_tokens[i]) for i, _ in batch)) == 1
+
+
+def test_plan_batches_sizes_batches_by_context_length():
+    batches = plan_batches([[1], [2, 3]], 4, lambda context_length: 2 * context_length)
+    assert [len(batch) for batch in batches] == [2, 2, 4]
+
+
+def test_auto_batch_size_fits_the_gpu_memory(monkeypatch):
+    hparams = generation.model.default_hparams()
+    row = generation.estimate_row_memory(hparams, 100, 923)
+    monkeypatch.setattr(generation, "available_memory", lambda: 1000 * row)
+    monkeypatch.setattr(generation, "gpu_memory", lambda: None)
+    assert auto_batch_size(hparams, 100, 923) == 64
+    monkeypatch.setattr(generation, "gpu_memory", lambda: 10 * row)
+    assert auto_batch_size(hparams, 100, 923) == 5
+    assert auto_batch_size(hparams, 100, 923, memory=4 * row) == 2
+
+
+def test_format_samples():
+    assert format_samples(["a"]) == "a\n"
+    assert format_samples(["a", "b"], "--\n") == "a\n--\nb\n--\n"
+
+
+def test_generate_tokens(engine):
+    contexts = [engine.enc.encode("\nab cd")] * 3
+    out = engine.generate_tokens(contexts, 10, top_k=1)
+    assert [len(tokens) for tokens in out] == [10] * 3
+    # Greedy samples of the same context agree
+    assert all((tokens == out[0]).all() for tokens in out)
+
+
+def test_length_is_clamped_to_the_context_window(engine):
+    context = engine.enc.encode("x" * 50)
+    out = engine.generate_tokens([context], 100, top_k=1)
+    assert len(out[0]) == engine.max_length - 50
+
+
+def test_contexts_without_room_for_a_token_are_rejected(engine):
+    with pytest.raises(ValueError, match="63 tokens long"):
+        engine.generate_tokens([engine.enc.encode("x" * 63)], 10)
+    with pytest.raises(ValueError, match="empty"):
+        engine.generate_tokens(np.zeros((1, 0), np.int32), 10)
+    with pytest.raises(ValueError, match="length"):
+        engine.generate_tokens([engine.enc.encode("x")], 0)
+
+
+def test_iter_generated_names_the_prompt_that_is_too_long(engine):
+    prompts = [("short", "\nab"), ("long", "y" * 70)]
+    with pytest.raises(ValueError, match="Prompt 'long'"):
+        list(iter_generated(engine, prompts, nsamples=1, length=4))
+
+
+def test_iter_generated_yields_every_prompt(engine):
+    prompts = [("a", "\nab"), ("b", "\nabc"), ("c", "\nab")]
+    results = dict(iter_generated(engine, prompts, nsamples=2, batch_size=3, length=4))
+    assert sorted(results) == ["a", "b", "c"]
+    for key, samples in results.items():
+        assert len(samples) == 2
+        assert all(sample.startswith(dict(prompts)[key].lstrip("\n")) for sample in samples)
+
+
+def test_shared_prefixes_give_the_same_samples(engine, tiny_checkpoint_dir):
+    unshared = LoadedModel("tiny", tiny_checkpoint_dir)
+    unshared.engine.share_prefixes = False
+    try:
+        prompts = ["\n[LABELS] ab", "\n[LABELS] cd", "\n[LABELS] ab", "\n[LABEL] xyz"]
+        for prompt_group in (prompts[:3], prompts[:2], prompts[3:]):
+            contexts = [engine.enc.encode(p) for p in prompt_group]
+            shared = engine.generate_tokens(contexts, 8, top_k=1)
+            expected = unshared.engine.generate_tokens(contexts, 8, top_k=1)
+            for a, b in zip(shared, expected):
+                assert (a == b).all()
+        # The common prefix of the batches was cached for the later ones
+        assert len(engine._prefix_cache) > 0
+    finally:
+        unshared.close()
+
+
+def feed(stop, chunks):
+    """Update a new sample with byte chunks, returning the chunk it stopped at"""
+    state = stop.new_state()
+    for i, chunk in enumerate(chunks):
+        if stop.update(state, chunk):
+            return i
+    return None
+
+
+def test_stop_sequences_spanning_tokens():
+    stop = StopCriteria(["<|endoftext|>"])
+    assert feed(stop, [b"Some text", b"<|end", b"of", b"text|>", b"more"]) == 3
+    assert feed(stop, [b"No end", b" in sight"]) is None
+    assert stop.truncate("An article<|endoftext|>next") == "An article"
+
+
+def test_max_words_stops_before_the_next_word():
+    stop = StopCriteria((), max_words=3)
+    assert feed(stop, [b"one", b" two", b"\nthree", b" ", b"fo", b"ur"]) == 4
+    assert stop.truncate("one two\nthree four five") == "one two\nthree"
+
+
+def test_stop_sequences_before_min_words_are_ignored():
+    stop = StopCriteria(["<|endoftext|>"], min_words=3)
+    chunks = [b"one", b" two<|end", b"oftext|>", b" three", b" four<|endoftext|>"]
+    assert feed(stop, chunks) == 4
+    assert feed(stop, [b"one two", b" three<|endoftext|>"]) == 1
+    text = "one two<|endoftext|> three four<|endoftext|>five"
+    assert stop.truncate(text) == "one two<|endoftext|> three four"
+    assert stop.truncate("one<|endoftext|>") == "one<|endoftext|>"
+
+
+def test_min_words_must_not_exceed_max_words():
+    with pytest.raises(ValueError):
+        StopCriteria(min_words=5, max_words=2)
+    assert not StopCriteria(())
+    assert StopCriteria((), min_words=1)
+
+
+def test_rows_stop_at_their_first_stop_sequence(engine):
+    stops = ["a", "b", "c", "d", "e"]
+    stop = StopCriteria(stops)
+    context = engine.enc.encode("\nab")
+    # Close to uniform sampling, so about half of the rows stop early
+    out = engine.generate_tokens([context] * 40, 30, temperature=1e4, stop=stop)
+    lengths = [len(tokens) for tokens in out]
+    assert min(lengths) < 30 and max(lengths) == 30
+    for tokens in out:
+        data = [engine.token_bytes(int(t)) for t in tokens]
+        assert not any(s.encode() in b"".join(data[:-1]) for s in stops)
+        if len(tokens) < 30:
+            assert any(s.encode() in data[-1] for s in stops)
+        sample = engine.decode_sample(context, tokens, stop)
+        assert sample.startswith("ab")
+        assert not any(s in sample[2:] for s in stops)
+
+
+def test_min_words_suppresses_the_end_token(engine):
+    end = engine.enc.encoder[END_TOKEN]
+    context = np.array([engine.enc.encode("\nab")] * 2000)
+    # Close to uniform sampling over 257 tokens draws the end token now and then
+    _, free = engine.prefill(context, temperature=1e4)
+    _, suppressed = engine.prefill(
+        context, temperature=1e4, suppress_end=np.ones(len(context), bool)
+    )
+    assert (free == end).any()
+    assert (suppressed != end).all()
@@ -0,0 +1,117 @@
+import time
+
+import pytest
+
+from gpt_2.jobs import (
+    DEFAULT_PARAMS,
+    DONE,
+    FAILED,
+    PENDING,
+    RUNNING,
+    JobQueue,
+    LeaseRenewer,
+    run_worker,
+)
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(tmp_path.joinpath("jobs.sqlite"))
+    yield queue
+    queue.close()
+
+
+def make_prompts(count):
+    return [(f"article_{i}.txt", f"\nprompt {i}") for i in range(count)]
+
+
+def lease_expires(queue, job_id, idx):
+    return queue._conn.execute(
+        "SELECT lease_expires FROM tasks WHERE job_id = ? AND idx = ?", (job_id, idx)
+    ).fetchone()[0]
+
+
+def test_claim_complete_and_results(queue):
+    job_id = queue.submit(make_prompts(5), "tiny", {"nsamples": 2})
+    run_name, params = queue.job(job_id)
+    assert run_name == "tiny"
+    assert params == dict(DEFAULT_PARAMS, nsamples=2)
+    assert queue.status(job_id)["status"] == "queued"
+
+    claimed_job, tasks, token = queue.claim(limit=3)
+    assert claimed_job == job_id
+    assert [idx for idx, _, _ in tasks] == [0, 1, 2]
+    status = queue.status(job_id)
+    assert (status[RUNNING], status[PENDING], status["status"]) == (3, 2, RUNNING)
+
+    # Prompts finish out of order and are numbered in the order they finished
+    assert queue.complete(job_id, 2, "two", token)
+    assert queue.complete(job_id, 0, "zero", token)
+    assert list(queue.results(job_id)) == [
+        (1, "article_2.txt", "two"),
+        (2, "article_0.txt", "zero"),
+    ]
+    assert list(queue.results(job_id, after=1)) == [(2, "article_0.txt", "zero")]
+
+    assert queue.fail(job_id, 1, "boom", token)
+    _, tasks, token = queue.claim()
+    for idx, _, _ in tasks:
+        queue.complete(job_id, idx, str(idx), token)
+    assert queue.status(job_id)["status"] == FAILED
+    assert list(queue.errors(job_id)) == [(1, "article_1.txt", "boom")]
+    assert queue.retry_failed(job_id) == 1
+    assert queue.claim()[1] == [(1, "article_1.txt", "\nprompt 1")]
+    assert queue.claim() == (None, [], None)
+
+
+def test_expired_claims_are_only_stored_once(queue):
+    job_id = queue.submit(make_prompts(2), "tiny")
+    _, tasks, stale_token = queue.claim(lease=-1)
+    _, reclaimed, token = queue.claim()
+    assert reclaimed == tasks
+
+    assert not queue.complete(job_id, 0, "stale", stale_token)
+    assert not queue.fail(job_id, 1, "stale", stale_token)
+    assert queue.renew(stale_token) == 0
+    assert queue.complete(job_id, 0, "fresh", token)
+    assert not queue.complete(job_id, 0, "again", token)
+    assert queue.complete(job_id, 1, "fresh", token)
+    assert [output for _, _, output in queue.results(job_id)] == ["fresh", "fresh"]
+    assert queue.status(job_id)[DONE] == 2
+
+
+def test_renew_only_extends_the_claims_running_prompts(queue):
+    job_id = queue.submit(make_prompts(2), "tiny")
+    _, _, token = queue.claim(lease=10)
+    queue.complete(job_id, 0, "done", token)
+    before = lease_expires(queue, job_id, 1)
+    assert queue.renew(token, lease=100) == 1
+    assert lease_expires(queue, job_id, 1) > before + 80
+
+
+def test_lease_renewer_keeps_the_lease(queue):
+    job_id = queue.submit(make_prompts(1), "tiny")
+    _, _, token = queue.claim(lease=0.5)
+    renewer = LeaseRenewer(queue.path, token, lease=0.5, interval=0.05)
+    renewer.start()
+    try:
+        time.sleep(1)
+        assert queue.claim() == (None, [], None)
+    finally:
+        renewer.stop()
+    assert queue.complete(job_id, 0, "done", token)
+
+
+def test_worker_generates_every_prompt(queue, tiny_checkpoint_dir):
+    pytest.importorskip("gpt_2_simple")
+    from gpt_2.model_manager import ModelManager
+
+    params = {"nsamples": 2, "length": 4, "stop_sequences": []}
+    job_id = queue.submit(make_prompts(5), "tiny", params)
+    run_worker(queue, ModelManager(tiny_checkpoint_dir), limit=3, exit_when_idle=True)
+    assert queue.status(job_id)["status"] == DONE
+    results = list(queue.results(job_id))
+    assert [seq for seq, _, _ in results] == [1, 2, 3, 4, 5]
+    assert sorted(file_name for _, file_name, _ in results) == [
+        f"article_{i}.txt" for i in range(5)
+    ]
@@ -0,0 +1,47 @@
+import random
+
+from gpt_2.keyword_matcher import KeywordMatcher
+
+
+def find_naively(corpus, body):
+    # The per-keyword search build_label_csv used before the automaton
+    keywords = []
+    for keyword in corpus:
+        klower = keyword.lower()
+        if klower in keywords:
+            continue
+        if klower in body.lower():
+            keywords.append(klower)
+    return keywords
+
+
+def test_matches_like_substring_search():
+    rng = random.Random(0)
+    words = ["ab", "abc", "bca", "c", "carpet", "Carpet One", "pet", "one", "tile"]
+    corpus = [" ".join(rng.sample(words, rng.randint(1, 2))) for _ in range(40)]
+    matcher = KeywordMatcher(corpus)
+    for _ in range(50):
+        body = " ".join(rng.choice(words) for _ in range(rng.randint(0, 12)))
+        assert matcher.find_all(body) == find_naively(corpus, body)
+
+
+def test_reports_duplicates_once_in_corpus_order():
+    matcher = KeywordMatcher(["Vinyl", "carpet", "vinyl", "CARPET", "rug"])
+    assert len(matcher) == 3
+    assert matcher.find_all("A RUG on vinyl and Carpet") == ["vinyl", "carpet", "rug"]
+
+
+def test_overlapping_and_suffix_keywords():
+    matcher = KeywordMatcher(["hardwood floor", "wood", "floor", "flooring"])
+    assert matcher.find_all("Hardwood flooring") == [
+        "hardwood floor",
+        "wood",
+        "floor",
+        "flooring",
+    ]
+
+
+def test_word_boundary():
+    matcher = KeywordMatcher(["rug", "area rug", "tile"], word_boundary=True)
+    assert matcher.find_all("Area rugs, tile_work and a rug.") == ["rug"]
+    assert matcher.find_all("an area rug") == ["rug", "area rug"]
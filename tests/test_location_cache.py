@@ -0,0 +1,80 @@
+import sqlite3
+
+from gpt_2 import location_cache as location_cache_module
+from gpt_2.build_label_csv import iter_label_rows
+from gpt_2.keyword_matcher import KeywordMatcher
+from gpt_2.location_cache import LocationCache
+from gpt_2.location_extractors import RegexLocationExtractor
+
+
+def last_used(path):
+    with sqlite3.connect(str(path)) as conn:
+        return dict(conn.execute("SELECT key, last_used FROM locations"))
+
+
+def forget_last_use(path):
+    with sqlite3.connect(str(path)) as conn:
+        conn.execute("UPDATE locations SET last_used = 0")
+
+
+def test_hits_are_written_on_flush(tmp_path):
+    path = tmp_path.joinpath("cache.sqlite")
+    cache = LocationCache(path, "v1")
+    cache.put("title", "body", "Texas, United States")
+    forget_last_use(path)
+    assert cache.get("title", "body") == "Texas, United States"
+    assert cache.get("other", "body") is None
+    assert list(last_used(path).values()) == [0]
+    cache.flush()
+    assert list(last_used(path).values())[0] > 0
+    assert cache.stats() == "1 hits, 1 misses (50% hit rate)"
+    cache.close()
+
+
+def test_hits_are_written_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(location_cache_module, "TOUCH_BATCH_SIZE", 2)
+    path = tmp_path.joinpath("cache.sqlite")
+    cache = LocationCache(path, "v1")
+    for title in "abc":
+        cache.put(title, "body", title)
+    forget_last_use(path)
+    cache.get("a", "body")
+    assert sorted(last_used(path).values()) == [0, 0, 0]
+    cache.get("b", "body")
+    assert sorted(last_used(path).values())[1:] != [0, 0]
+    cache.close()
+
+
+def test_prune_keeps_entries_hit_since(tmp_path):
+    path = tmp_path.joinpath("cache.sqlite")
+    cache = LocationCache(path, "v1")
+    cache.put("used", "body", "x")
+    cache.put("unused", "body", "y")
+    forget_last_use(path)
+    cache.get("used", "body")
+    assert cache.prune(unused_since=1) == 1
+    assert cache.get("used", "body") == "x"
+    assert cache.get("unused", "body") is None
+    cache.close()
+
+
+def test_worker_processes_write_their_hits(tmp_path):
+    files = []
+    for i in range(6):
+        path = tmp_path.joinpath(f"C{i}-x Store {i} Carpet One.txt")
+        path.write_text(f"Visit us in Austin, TX. Article {i} about carpet.")
+        files.append(path)
+    cache_path = tmp_path.joinpath("cache.sqlite")
+    extractor = RegexLocationExtractor()
+    cache = LocationCache(cache_path, extractor.cache_version)
+    matcher = KeywordMatcher(["carpet"])
+    list(iter_label_rows(files, matcher, location_cache=cache, location_extractor=extractor))
+    forget_last_use(cache_path)
+
+    rows = list(iter_label_rows(
+        files, matcher, jobs=2, location_cache=cache, location_extractor=extractor
+    ))
+    assert [row["keywords"] for row in rows] == ["carpet"] * 6
+    assert cache.hits == 6
+    assert all(used > 0 for used in last_used(cache_path).values())
+    cache.close()
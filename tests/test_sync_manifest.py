@@ -0,0 +1,131 @@
+import httplib2
+import pytest
+from googleapiclient import errors
+
+from gpt_2.download_docs import select_files_to_sync
+from gpt_2.sync_manifest import SyncManifest
+
+
+def drive_file(file_id, name, version=1, **fields):
+    f = {
+        "id": file_id,
+        "name": name,
+        "version": str(version),
+        "modifiedTime": f"2021-01-0{version}T00:00:00Z",
+        "mimeType": "application/vnd.google-apps.document",
+        "parents": ["folder"],
+    }
+    f.update(fields)
+    return f
+
+
+class FakeResponse:
+    def __init__(self, response):
+        self.response = response
+
+    def execute(self):
+        return self.response
+
+
+class FakeDrive:
+    """Local stand-in for the Drive files and changes APIs"""
+
+    def __init__(self, files, changes=()):
+        self.listed = files
+        self.changes_ = list(changes)
+
+    def files(self):
+        return self
+
+    def changes(self):
+        return self
+
+    def getStartPageToken(self):
+        return FakeResponse({"startPageToken": "token-1"})
+
+    def list(self, pageToken=None, q=None, **kwargs):
+        if q is not None:
+            if isinstance(self.listed, Exception):
+                raise self.listed
+            return FakeResponse({"files": self.listed})
+        return FakeResponse({"changes": self.changes_, "newStartPageToken": "token-2"})
+
+
+def test_manifest_round_trips_and_tracks_versions(tmp_path):
+    path = tmp_path.joinpath("manifest.json")
+    manifest = SyncManifest(path)
+    f = drive_file("1", "C1-a Store")
+    assert not manifest.is_current(f)
+    manifest.record(f, tmp_path.joinpath("C1-a Store.txt"))
+    manifest.mark_pending(drive_file("2", "C2-b Store"))
+    manifest.page_token = "token-1"
+    manifest.save()
+
+    manifest = SyncManifest(path)
+    assert manifest.page_token == "token-1"
+    assert manifest.is_current(f)
+    assert not manifest.is_current(drive_file("1", "C1-a Store", version=2))
+    assert list(manifest.pending) == ["2"]
+
+
+def test_rename_deletes_the_old_copy(tmp_path):
+    manifest = SyncManifest(tmp_path.joinpath("manifest.json"))
+    old_path = tmp_path.joinpath("Old.txt")
+    old_path.write_text("text")
+    manifest.record(drive_file("1", "Old"), old_path)
+    manifest.record(drive_file("1", "New", version=2), tmp_path.joinpath("New.txt"))
+    assert not old_path.exists()
+    assert manifest.files["1"]["name"] == "New"
+
+
+def test_remove_marks_or_deletes(tmp_path):
+    manifest = SyncManifest(tmp_path.joinpath("manifest.json"))
+    kept, pruned = tmp_path.joinpath("a.txt"), tmp_path.joinpath("b.txt")
+    for file_id, path in (("1", kept), ("2", pruned)):
+        path.write_text("text")
+        manifest.record(drive_file(file_id, path.stem), path)
+    manifest.remove("1")
+    manifest.remove("2", delete=True)
+    assert kept.exists() and manifest.files["1"]["removed"]
+    assert not manifest.is_current(drive_file("1", "a"))
+    assert not pruned.exists() and "2" not in manifest.files
+
+
+def test_first_sync_lists_every_file(tmp_path):
+    manifest = SyncManifest(tmp_path.joinpath("manifest.json"))
+    files = [drive_file("1", "C1-a Store"), drive_file("2", "C2-b Store")]
+    manifest.record(files[0], tmp_path.joinpath("C1-a Store.txt"))
+    selected, page_token = select_files_to_sync(FakeDrive(files), manifest)
+    assert list(selected) == ["C2-b Store"]
+    assert page_token == "token-1"
+
+
+def test_later_syncs_only_download_changes(tmp_path):
+    manifest = SyncManifest(tmp_path.joinpath("manifest.json"))
+    manifest.page_token = "token-1"
+    for file_id in "123":
+        manifest.record(drive_file(file_id, f"C{file_id}"), tmp_path.joinpath(f"{file_id}.txt"))
+    manifest.mark_pending(drive_file("4", "C4"))
+    changes = [
+        {"fileId": "1", "file": drive_file("1", "C1", version=2)},
+        {"fileId": "2", "file": drive_file("2", "C2")},
+        {"fileId": "3", "removed": True},
+        {"fileId": "5", "file": drive_file("5", "Notes")},
+    ]
+    selected, page_token = select_files_to_sync(
+        FakeDrive([], changes), manifest, regex="^C"
+    )
+    assert sorted(selected) == ["C1", "C4"]
+    assert page_token == "token-2"
+    assert manifest.files["3"]["removed"]
+
+
+def test_first_sync_listing_errors_are_raised(tmp_path):
+    manifest = SyncManifest(tmp_path.joinpath("manifest.json"))
+    path = tmp_path.joinpath("C1-a Store.txt")
+    path.write_text("text")
+    manifest.record(drive_file("1", "C1-a Store"), path)
+    error = errors.HttpError(httplib2.Response({"status": 500}), b"")
+    with pytest.raises(errors.HttpError):
+        select_files_to_sync(FakeDrive(error), manifest, prune=True)
+    assert path.exists() and not manifest.files["1"].get("removed")
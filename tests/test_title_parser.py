@@ -0,0 +1,69 @@
+import json
+
+from benchmarks.bench_title_parser import (
+    legacy_extract_store_name_and_page_template_from_title,
+)
+from benchmarks.synthetic import make_store_suffixes, make_titles
+from gpt_2.title_parser import ParsedTitle, TitleParser
+
+
+def test_parse_splits_store_name_and_page_template():
+    parser = TitleParser()
+    assert parser.parse("MULTI-MAIN Wrucks Carpet One Floor & Home Area Rugs") == (
+        "Wrucks Carpet One Floor & Home",
+        "MULTI-MAIN Area Rugs",
+        True,
+    )
+    assert parser.parse("Hosner Carpet One Hardwood") == ParsedTitle(
+        "Hosner Carpet One", "Hardwood", True
+    )
+
+
+def test_priority_beats_position():
+    parser = TitleParser(page_modifiers=(), store_suffixes=("Floors", "Carpet"))
+    assert parser.parse("Joe's Carpet and Fox Floors Tile") == (
+        "Joe's Carpet and Fox Floors",
+        "Tile",
+        True,
+    )
+
+
+def test_no_store_suffix_is_an_explicit_no_match():
+    assert TitleParser().parse("MULTI Unknown Store Page") == ("", "MULTI", False)
+
+
+def test_matches_the_table_walk_for_small_and_large_tables():
+    for extra in (0, 100):
+        store_suffixes = make_store_suffixes(extra)
+        parser = TitleParser(store_suffixes=store_suffixes)
+        titles = make_titles(2000, store_suffixes)
+        expected = [
+            legacy_extract_store_name_and_page_template_from_title(
+                title, store_suffixes=store_suffixes
+            )
+            for title in titles
+        ]
+        assert [parsed[:2] for parsed in parser.parse_many(titles)] == expected
+
+
+def test_large_tables_see_overlapping_occurrences():
+    # "One Floor" starts inside the lower priority "Carpet One" occurrence
+    suffixes = ["One Floor"] + [f"Filler {i}" for i in range(40)] + ["Carpet One"]
+    parser = TitleParser(page_modifiers=(), store_suffixes=suffixes)
+    assert parser.parse("Wrucks Carpet One Floor Rugs") == (
+        "Wrucks Carpet One Floor",
+        "Rugs",
+        True,
+    )
+
+
+def test_from_config(tmp_path):
+    path = tmp_path.joinpath("titles.json")
+    path.write_text(json.dumps({"store_suffixes": ["Flooring"]}))
+    parser = TitleParser.from_config(path)
+    assert parser.store_suffixes == ("Flooring",)
+    assert parser.parse("MULTI-LOC Rochester Flooring Tile") == (
+        "Rochester Flooring",
+        "MULTI-LOC Tile",
+        True,
+    )